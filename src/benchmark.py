@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+# Measures how many ticks per second a simulation achieves with the different
+# ways of distributing creatures over pymunk spaces (see
+# Simulation.SPACE_PARTITIONING and Simulation.USE_SPATIAL_HASH).
+
+import time
+import random
+import argparse
+
+from evolution import *
+from headless import SIMULATION_CLASSES
+
+
+def measure_ticks_per_second(simulation_class, generation, max_ticks, creatures_per_space, use_spatial_hash):
+    # Returns a tuple (ticks per second, setup seconds, number of spaces). The
+    # ticks per second only count stepping, not building the spaces.
+    # Culling is disabled, so that every strategy simulates the same creatures
+    # for the same number of ticks.
+    settings = (simulation_class.SPACE_PARTITIONING, simulation_class.USE_SPATIAL_HASH, \
+        simulation_class.CULL_CHECK_TICKS)
+    simulation_class.SPACE_PARTITIONING = creatures_per_space
+    simulation_class.USE_SPATIAL_HASH = use_spatial_hash
+    simulation_class.CULL_CHECK_TICKS = 0
+    try:
+        time_start = time.perf_counter()
+        sim = simulation_class(generation, max_ticks)
+        time_setup = time.perf_counter() - time_start
+        while not sim.is_done():
+            sim.do_timestep()
+        time_total = time.perf_counter() - time_start
+    finally:
+        simulation_class.SPACE_PARTITIONING, simulation_class.USE_SPATIAL_HASH, \
+            simulation_class.CULL_CHECK_TICKS = settings
+    return max_ticks / (time_total - time_setup), time_setup, len(sim.spaces)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark space partitioning strategies.")
+    parser.add_argument("-environment", choices=SIMULATION_CLASSES.keys(), default="hopper")
+    parser.add_argument("-sizes", type=int, nargs="+", default=[GENERATION_SIZE // MAX_WORKERS, GENERATION_SIZE],
+        help="Numbers of creatures per simulation to measure, e.g. the chunk size of one worker")
+    parser.add_argument("-ticks", type=int, default=1000)
+    parser.add_argument("-partitions", type=int, nargs="+", default=[0, 1, 5, 20],
+        help="Creatures per space to measure, 0 for one shared space")
+    parser.add_argument("-seed", type=int, default=1)
+    args = parser.parse_args()
+
+    simulation_class = SIMULATION_CLASSES[args.environment]
+    print("{:<10} {:<12} {:<8} {:<8} {:<10} {:<8}".format( \
+        "Creatures", "Per space", "Spaces", "Hash", "Ticks/s", "Setup s"))
+    for size in args.sizes:
+        random.seed(args.seed)
+        generation = Generation(1, [])
+        generation.add_random_genomes(size)
+        for creatures_per_space in args.partitions:
+            for use_spatial_hash in (False, True):
+                random.seed(args.seed)
+                ticks_per_second, time_setup, nb_spaces = measure_ticks_per_second( \
+                    simulation_class, generation, args.ticks, creatures_per_space, use_spatial_hash)
+                print("{:<10} {:<12} {:<8} {:<8} {:<10.1f} {:<8.3f}".format( \
+                    size, creatures_per_space if creatures_per_space > 0 else "all", nb_spaces, \
+                    "yes" if use_spatial_hash else "no", ticks_per_second, time_setup))
+
+
+if __name__ == "__main__":
+    main()
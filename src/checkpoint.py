@@ -0,0 +1,163 @@
+
+import os
+import time
+import pickle
+import random
+import tempfile
+from datetime import datetime
+
+
+class GenerationSummary:
+    # What a resumed run keeps of the generations before the last one: their
+    # statistics, but not their genomes. Can be used in place of a
+    # FinishedGeneration for charts.
+
+    def __init__(self, finished_generation):
+        self.idx = finished_generation.idx
+        self.stats = finished_generation.get_stats()
+        self.nb_culled = finished_generation.nb_culled
+        self.nb_cached = finished_generation.nb_cached
+        self.utilization = finished_generation.utilization
+        self.main_cpu = finished_generation.main_cpu
+
+    def get_stats(self):
+        return self.stats
+
+
+class ResumedState:
+    # Everything needed to continue a run, see Checkpoint.resume().
+
+    def __init__(self, old_generations, next_generation, settings):
+        # old_generations (list): GenerationSummary instances, except for the
+        #   last element, which is the FinishedGeneration of the last snapshot
+        # next_generation (Generation|ReproductionPlan): What to evaluate next
+        # settings (dict): As passed to Checkpoint.add_generation()
+        self.old_generations = old_generations
+        self.next_generation = next_generation
+        self.settings = settings
+
+
+class Checkpoint:
+    """
+    Records a run in a directory, so that it can be continued after the
+    process died.
+    The log is appended a record with the ranking and statistics of every
+    finished generation, and flushed to disk right away. A partially written
+    last record, e.g. after a crash, is ignored when reading the log.
+    Every SNAPSHOT_INTERVAL generations, a snapshot with the full state is
+    written, i.e. the last finished generation, the next generation, the
+    state of the random generator and the settings. It atomically replaces
+    the previous snapshot, and is what resume() starts from, without reading
+    the log.
+    """
+
+    LOG_FILENAME = "log.pickle"
+    SNAPSHOT_FILENAME = "snapshot.pickle"
+
+    # Generations between snapshots. Generations finished after the last
+    # snapshot are simulated again when resuming, with the same results.
+    SNAPSHOT_INTERVAL = 1
+
+    def __init__(self, directory, summaries=None, log_size=0):
+        # Use create() or resume() instead.
+        self.directory = directory
+        self._summaries = summaries if summaries is not None else []    # of all logged generations
+        self._log = open(os.path.join(directory, self.LOG_FILENAME), "ab")
+        self._log.truncate(log_size)    # drop generations after the snapshot
+        self._log.seek(0, os.SEEK_END)
+
+    @classmethod
+    def create(cls, parent_directory):
+        # Returns a new checkpoint in a new subdirectory of parent_directory.
+        # The names sort by creation time, with a unique suffix for runs that
+        # start at the same time, see find_latest().
+        os.makedirs(parent_directory, exist_ok=True)
+        timestamp = datetime.now().strftime("%Y-%m-%d_%H_%M_%S_%f")
+        directory = tempfile.mkdtemp(prefix=timestamp + "_", dir=parent_directory)
+        return cls(directory)
+
+    @classmethod
+    def find_latest(cls, parent_directory):
+        # Returns the directory of the most recent checkpoint with a snapshot
+        # in parent_directory, or None.
+        if not os.path.isdir(parent_directory):
+            return None
+        for name in sorted(os.listdir(parent_directory), reverse=True):
+            directory = os.path.join(parent_directory, name)
+            if os.path.isfile(os.path.join(directory, cls.SNAPSHOT_FILENAME)):
+                return directory
+        return None
+
+    @classmethod
+    def resume(cls, directory):
+        # Restores the state of the random generator and returns a tuple
+        # (checkpoint, ResumedState). The checkpoint continues the log after
+        # the snapshot.
+        f = open(os.path.join(directory, cls.SNAPSHOT_FILENAME), "rb")
+        snapshot = pickle.load(f)
+        f.close()
+        random.setstate(snapshot["random_state"])
+        summaries = snapshot["summaries"]
+        checkpoint = cls(directory, summaries, snapshot["log_size"])
+        state = ResumedState(summaries[:-1] + [snapshot["finished_generation"]], \
+            snapshot["next_generation"], snapshot["settings"])
+        return checkpoint, state
+
+    @classmethod
+    def read_log(cls, directory):
+        # Yields the records of the log, oldest first, see add_generation().
+        f = open(os.path.join(directory, cls.LOG_FILENAME), "rb")
+        try:
+            while True:
+                try:
+                    yield pickle.load(f)
+                except (EOFError, pickle.UnpicklingError):
+                    return
+        finally:
+            f.close()
+
+    def add_generation(self, finished_generation, next_generation, settings):
+        # Call after making the next generation, before using the random
+        # generator for anything else.
+        # settings (dict): Values to restore when resuming
+        fg = finished_generation
+        record = {
+            "idx": fg.idx,
+            "time": time.time(),
+            "stats": fg.get_stats(),
+            "nb_culled": fg.nb_culled,
+            "nb_cached": fg.nb_cached,
+            "utilization": fg.utilization,
+            "main_cpu": fg.main_cpu,
+            "terrain_seed": fg.terrain_seed,
+            # Tuples (fitness, genome content hash), best first
+            "ranking": [(fitness, genome.get_content_hash()) for fitness, genome in fg.ranked_genomes],
+        }
+        pickle.dump(record, self._log)
+        self._log.flush()
+        os.fsync(self._log.fileno())
+        self._summaries.append(GenerationSummary(fg))
+        if len(self._summaries) % self.SNAPSHOT_INTERVAL == 0:
+            self._write_snapshot(fg, next_generation, settings)
+
+    def _write_snapshot(self, finished_generation, next_generation, settings):
+        snapshot = {
+            "summaries": self._summaries,
+            "finished_generation": finished_generation,
+            "next_generation": next_generation,
+            "random_state": random.getstate(),
+            "settings": settings,
+            "log_size": self._log.tell(),
+        }
+        # Write to a temporary file first, so that a crash never leaves a
+        # partially written snapshot behind
+        location = os.path.join(self.directory, self.SNAPSHOT_FILENAME)
+        f = open(location + ".tmp", "wb")
+        pickle.dump(snapshot, f, pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+        os.replace(location + ".tmp", location)
+
+    def close(self):
+        self._log.close()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+
+# Converts generations saved as pickle, the format of earlier versions, to
+# genome archives (see GenomeArchive), next to the original files. The
+# converted genomes are checked to have the same content as the originals.
+
+import os
+import glob
+import argparse
+
+from evolution import *
+
+
+def convert(location):
+    # Returns the location of the new archive.
+    genomes = load_pickle(location)
+    archive_location = os.path.splitext(location)[0] + GenomeArchive.FILE_EXTENSION
+    GenomeArchive.write(archive_location, genomes)
+    archive = GenomeArchive(archive_location)
+    for position, genome in enumerate(genomes):
+        if archive.get_genome(position).get_content_hash() != genome.get_content_hash():
+            raise ValueError("Genome {} of {} differs after converting".format(position, location))
+    archive.close()
+    return archive_location
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert generations saved as pickle to genome archives.")
+    parser.add_argument("locations", metavar="LOCATION", nargs="*",
+        help="Files to convert, all pickles in the save directory if none are given")
+    parser.add_argument("-delete", action="store_true",
+        help="Delete each pickle after converting it")
+    args = parser.parse_args()
+
+    locations = args.locations or sorted(glob.glob(SAVE_DIRECTORY + "*.pickle"))
+    for location in locations:
+        if GenomeArchive.is_archive(location):
+            print("Skipping {}, already an archive".format(location))
+            continue
+        archive_location = convert(location)
+        print("{} -> {} ({} -> {} bytes)".format(location, archive_location, \
+            os.path.getsize(location), os.path.getsize(archive_location)))
+        if args.delete:
+            os.remove(location)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+
+import time
+import socket
+import secrets
+import ipaddress
+import threading
+import collections
+from multiprocessing.connection import Listener, Client, AuthenticationError
+
+import dill
+
+
+# Evaluation by worker processes that connect over TCP, possibly from other
+# machines (see worker.py), instead of a pathos pool of local processes.
+# Messages are tuples pickled with dill, like pathos does, sent over
+# multiprocessing connections, which authenticate both ends with a shared key.
+# Note that a worker runs whatever its coordinator sends it, and the
+# coordinator trusts the results, so anyone who knows the key can run code on
+# both. The default key is only meant for coordinators that listen on a
+# loopback address, see get_listen_authkey().
+
+DEFAULT_AUTHKEY = b"locomotion-evolution"
+
+# Seconds between the heartbeats of a worker, and after which a worker that
+# wasn't heard from is considered lost, and its task given to another one
+HEARTBEAT_INTERVAL = 1.0
+HEARTBEAT_TIMEOUT = 10.0
+# Workers a task may be handed to before it fails, in case it's the task that
+# makes them get lost
+MAX_TASK_ATTEMPTS = 3
+
+
+def parse_address(text):
+    # Returns a tuple (host, port) of a string "host:port".
+    host, port = text.rsplit(":", 1)
+    return host, int(port)
+
+def is_loopback(host):
+    # Returns whether host only accepts connections from this machine.
+    try:
+        return ipaddress.ip_address(socket.gethostbyname(host)).is_loopback
+    except (socket.gaierror, ValueError):
+        return False
+
+def get_listen_authkey(host, authkey=None):
+    # Returns the key to listen on host with: authkey if given, the default
+    # one on a loopback address, or else a new random one, which the workers
+    # must then be given.
+    if authkey is not None:
+        return authkey
+    if is_loopback(host):
+        return DEFAULT_AUTHKEY
+    return secrets.token_hex(16).encode()
+
+def _send(conn, message):
+    conn.send_bytes(dill.dumps(message))
+
+def _recv(conn):
+    return dill.loads(conn.recv_bytes())
+
+
+class DistributedJob:
+    # Result of DistributedPool.apipe(), like the jobs of pathos pools.
+
+    def __init__(self, task_id, func, args, kwds):
+        self.task_id = task_id
+        self.func = func
+        self.args = args
+        self.kwds = kwds
+        self.nb_attempts = 0    # workers the task was handed to
+        self._done = threading.Event()
+        self._result = None
+        self._error = None
+
+    def ready(self):
+        return self._done.is_set()
+
+    def get(self, timeout=None):
+        # Waits until the job is done and returns its result, or raises the
+        # exception it raised.
+        if not self._done.wait(timeout):
+            raise TimeoutError("Job {} not done after {} seconds".format(self.task_id, timeout))
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+    def _finish(self, result=None, error=None):
+        self._result = result
+        self._error = error
+        self._done.set()
+
+
+class DistributedPool:
+    """
+    Coordinator that hands tasks to the workers connected to it, one task at
+    a time per worker, and takes back their results. Can be used in place of
+    a pathos pool. The tasks of workers that disconnect or miss their
+    heartbeats are handed to other workers, see MAX_TASK_ATTEMPTS.
+    """
+
+    def __init__(self, address, authkey=DEFAULT_AUTHKEY, initializer=None, initargs=()):
+        # address (tuple): (host, port) to listen on, port 0 for any free one,
+        #   see self.address
+        # authkey (bytes): Shared with the workers
+        # initializer (function|None): Invoked with initargs by each worker
+        #   when it connects, before its first task
+        self.initializer = initializer
+        self.initargs = initargs
+        self._listener = Listener(address, authkey=authkey)
+        self.address = self._listener.address
+        self._lock = threading.Condition()
+        self._tasks = collections.deque()    # DistributedJobs not handed to a worker yet
+        self._nb_unfinished = 0
+        self._nb_workers = 0
+        self._next_task_id = 0
+        self._is_closed = False     # no new tasks
+        self._is_stopped = False    # no more connections
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def apipe(self, func, *args, **kwds):
+        # Returns a DistributedJob of func(*args, **kwds). func must be
+        # importable by the workers, e.g. a function of evolution.py.
+        with self._lock:
+            if self._is_closed:
+                raise ValueError("Pool is closed")
+            job = DistributedJob(self._next_task_id, func, args, kwds)
+            self._next_task_id += 1
+            self._nb_unfinished += 1
+            self._tasks.append(job)
+            self._lock.notify_all()
+        return job
+
+    def get_nb_workers(self):
+        # Number of currently connected workers
+        return self._nb_workers
+
+    def close(self):
+        # No new tasks can be added afterwards.
+        with self._lock:
+            self._is_closed = True
+
+    def join(self):
+        # Waits until all tasks are done, after close(), and disconnects the
+        # workers.
+        with self._lock:
+            while self._nb_unfinished > 0:
+                self._lock.wait()
+            self._is_stopped = True
+            self._lock.notify_all()
+        self._listener.close()
+
+    def clear(self):
+        pass
+
+    def _accept(self):
+        while not self._is_stopped:
+            try:
+                conn = self._listener.accept()
+            except (AuthenticationError, ConnectionError, EOFError):
+                continue    # e.g. a wrong key
+            except OSError:
+                return      # the listener was closed
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _take_task(self, timeout):
+        # Returns the next task, or None if there's none within timeout
+        # seconds or the pool was stopped.
+        with self._lock:
+            self._lock.wait_for(lambda: len(self._tasks) > 0 or self._is_stopped, timeout)
+            if self._is_stopped or len(self._tasks) == 0:
+                return None
+            return self._tasks.popleft()
+
+    def _finish_task(self, job, result=None, error=None):
+        job._finish(result, error)
+        with self._lock:
+            self._nb_unfinished -= 1
+            self._lock.notify_all()
+
+    def _serve(self, conn):
+        # Talks to one worker until it's lost or the pool is stopped.
+        job = None      # the task the worker is on
+        with self._lock:
+            self._nb_workers += 1
+        try:
+            _send(conn, ("setup", self.initializer, self.initargs))
+            last_heard = time.monotonic()
+            while not self._is_stopped:
+                if job is None:
+                    job = self._take_task(HEARTBEAT_INTERVAL)
+                    if job is not None:
+                        job.nb_attempts += 1
+                        _send(conn, ("task", job.task_id, job.func, job.args, job.kwds))
+                while conn.poll(0 if job is None else HEARTBEAT_INTERVAL):
+                    message = _recv(conn)
+                    last_heard = time.monotonic()
+                    if message[0] == "result" and job is not None and message[1] == job.task_id:
+                        self._finish_task(job, result=message[2])
+                        job = None
+                    elif message[0] == "error" and job is not None and message[1] == job.task_id:
+                        self._finish_task(job, error=message[2])
+                        job = None
+                if time.monotonic() - last_heard > HEARTBEAT_TIMEOUT:
+                    break
+            if self._is_stopped:
+                _send(conn, ("stop",))
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+            with self._lock:
+                self._nb_workers -= 1
+                if job is not None and job.nb_attempts < MAX_TASK_ATTEMPTS:
+                    # The worker was lost, let the next idle one do its task
+                    self._tasks.appendleft(job)
+                    self._lock.notify_all()
+                    job = None
+            if job is not None:
+                self._finish_task(job, error=RuntimeError("Task {} lost {} workers".format( \
+                    job.task_id, job.nb_attempts)))
+
+
+class DistributedWorker:
+    """
+    Connects to a DistributedPool and does its tasks, one at a time, until
+    the pool is stopped or the connection is lost. Sends heartbeats while
+    idle and while busy.
+    """
+
+    # Seconds between attempts to connect to a pool that isn't there yet
+    CONNECT_INTERVAL = 0.5
+
+    def __init__(self, address, authkey=DEFAULT_AUTHKEY, transform_args=None):
+        # transform_args (function|None): Applied to the args of each task
+        #   before running it, e.g. to replace resources of the coordinator's
+        #   machine
+        self.address = address
+        self.authkey = authkey
+        self.transform_args = transform_args
+        self._conn = None
+        self._send_lock = threading.Lock()
+
+    def connect(self, wait=0):
+        # Returns whether the connection succeeded, trying for up to wait
+        # seconds.
+        deadline = time.monotonic() + wait
+        while True:
+            try:
+                self._conn = Client(self.address, authkey=self.authkey)
+                return True
+            except (ConnectionRefusedError, socket.gaierror):
+                if time.monotonic() >= deadline:
+                    return False
+                time.sleep(self.CONNECT_INTERVAL)
+
+    def run(self):
+        # Does tasks until the pool is stopped or lost. Returns the number of
+        # tasks done.
+        nb_done = 0
+        heartbeat_stop = threading.Event()
+        threading.Thread(target=self._send_heartbeats, args=(heartbeat_stop,), daemon=True).start()
+        try:
+            while True:
+                message = _recv(self._conn)
+                if message[0] == "stop":
+                    break
+                if message[0] == "setup":
+                    initializer, initargs = message[1:]
+                    if initializer is not None:
+                        initializer(*initargs)
+                elif message[0] == "task":
+                    task_id, func, args, kwds = message[1:]
+                    if self.transform_args is not None:
+                        args = self.transform_args(args)
+                    try:
+                        reply = ("result", task_id, func(*args, **kwds))
+                    except Exception as e:
+                        reply = ("error", task_id, e)
+                    try:
+                        self._send(reply)
+                    except (EOFError, OSError):
+                        raise
+                    except Exception as e:
+                        # The result or exception can't be pickled
+                        self._send(("error", task_id, RuntimeError("{}: {!r}".format(e, reply[2]))))
+                    nb_done += 1
+        except (EOFError, OSError):
+            pass
+        finally:
+            heartbeat_stop.set()
+            self._conn.close()
+        return nb_done
+
+    def _send(self, message):
+        with self._send_lock:
+            _send(self._conn, message)
+
+    def _send_heartbeats(self, stop):
+        try:
+            while not stop.wait(HEARTBEAT_INTERVAL):
+                self._send(("heartbeat",))
+        except (EOFError, OSError):
+            pass
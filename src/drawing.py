@@ -1,5 +1,6 @@
 import pygame
 import math
+import numpy as np
 
 from timer import TimerNode
 
@@ -13,22 +14,60 @@ class Drawing:
     RADIUS_NODE = 10
 
     COLOR_MUSCLE = (128,128,128)
+    COLOR_MUSCLE_CONTRACTED = (208,208,208)
 
     COLOR_GROUND = (255,255,255)
 
     DRAW_TIMERS = True
 
+    # Nodes that are smaller on screen than this radius, in pixels, are drawn
+    # as squares, without their creature's muscles and timers
+    SIMPLE_NODE_RADIUS = 3
+
 
     def __init__(self, ui):
         # ui (Graphics): 
         self.ui = ui
+        # Tuple (ground, transform, surface) of the last drawn ground, see
+        # _draw_ground_layer()
+        self._ground_layer = None
+
+    def get_viewport(self):
+        # Returns the area of the world that is on screen, a tuple (min x,
+        # min y, max x, max y). The camera transform only translates and
+        # scales, see UIGame.
+        t = self.ui.draw_options.transform
+        width, height = self.ui.game.screen.get_size()
+        min_x, max_x = sorted(((0 - t.tx) / t.a, (width - t.tx) / t.a))
+        min_y, max_y = sorted(((0 - t.ty) / t.d, (height - t.ty) / t.d))
+        return min_x, min_y, max_x, max_y
+
+    def is_visible(self, bb_min, bb_max, viewport=None):
+        # Returns whether the bounding box (min, max) is on screen, at least
+        # partly. Also works with arrays of coordinates, of several bounding
+        # boxes.
+        if viewport is None:
+            viewport = self.get_viewport()
+        return (bb_max[0] >= viewport[0]) & (bb_max[1] >= viewport[1]) \
+            & (bb_min[0] <= viewport[2]) & (bb_min[1] <= viewport[3])
 
     def draw_creature(self, creature, show_specs=False):
+        margin = max([node.radius for node in creature.nodes], default=0)
+        bb_min, bb_max = creature.get_bounding_box()
+        if not self.is_visible(bb_min - (margin, margin), bb_max + (margin, margin)):
+            return
+        if margin * self.ui.scaling < self.SIMPLE_NODE_RADIUS:
+            for node in creature.nodes:
+                color = self.COLOR_NODE_STICKY if node.is_sticky else self.COLOR_NODE_NONSTICKY
+                self._draw_simple_node(self.ui.draw_options.transform @ node.body.position, \
+                    node.radius * self.ui.scaling, color)
+            return
+
         for node in creature.nodes:
             pos = self.ui.draw_options.transform @ node.body.position
             radius = int(node.radius * self.ui.scaling)
             color = self.COLOR_NODE_STICKY if node.is_sticky else self.COLOR_NODE_NONSTICKY
-            if self.DRAW_TIMERS and isinstance(node, TimerNode):
+            if self.DRAW_TIMERS and isinstance(node, TimerNode) and radius >= self.SIMPLE_NODE_RADIUS:
                 arc_rect = pygame.Rect(pos.x-radius, pos.y-radius, radius*2, radius*2)
                 pygame.draw.arc(self.ui.game.screen, self.COLOR_NODE_NONSTICKY, arc_rect, \
                     -node.timer.timer_type.true_from, -node.timer.timer_type.false_from)
@@ -74,16 +113,92 @@ class Drawing:
             color = self.COLOR_NODE_STICKY
             pygame.draw.circle(self.ui.game.screen, color, pos, radius)
         for muscle_type in genome.muscle_matrix.iterate_all_muscles():
-            pos_1 = self.ui.draw_options.transform @ (bb_topleft + muscle_type.node_type_1.bb_position)
-            pos_2 = self.ui.draw_options.transform @ (bb_topleft + muscle_type.node_type_2.bb_position)
+            pos_1 = self.ui.draw_options.transform @ (bb_topleft + genome.node_types[muscle_type.node_idx_1].bb_position)
+            pos_2 = self.ui.draw_options.transform @ (bb_topleft + genome.node_types[muscle_type.node_idx_2].bb_position)
             pygame.draw.line(self.ui.game.screen, self.COLOR_MUSCLE, pos_1, pos_2)
 
     def draw_ground(self, segments):
         # segments (pymunk.Segment[]): The segments to draw, must be contiguous,
         #   i.e., the next must start where the previous one ended
-        # Is faster than drawing lines separately, I hope?
-        points = [self.ui.draw_options.transform @ segments[0].a]
-        for segment in segments:
-            points.append(self.ui.draw_options.transform @ segment.b)
-        pygame.draw.lines(self.ui.game.screen, self.COLOR_GROUND, False, points)
+        self._draw_ground_layer(segments, lambda: [tuple(segments[0].a)] \
+            + [tuple(segment.b) for segment in segments])
+
+    def transform_points(self, points):
+        # Returns the screen positions of an array of points (x, y), like
+        # draw_options.transform @ point for each point, as an array.
+        t = self.ui.draw_options.transform
+        points = np.asarray(points, dtype=np.float64)
+        return np.column_stack((t.a * points[:,0] + t.c * points[:,1] + t.tx, \
+            t.b * points[:,0] + t.d * points[:,1] + t.ty))
+
+    def draw_ground_points(self, points):
+        # points (ndarray): Of the ground, see Simulation.generate_ground()
+        self._draw_ground_layer(points, lambda: points)
+
+    def _draw_ground_layer(self, ground, get_points):
+        # Blits the ground, which is rendered to a surface of the screen's
+        # size only when it or the camera changed, and only the segments on
+        # screen.
+        # ground (object): Identifies the ground
+        # get_points (function): Returns the points of the ground
+        transform = tuple(self.ui.draw_options.transform)
+        if self._ground_layer is None or self._ground_layer[0] is not ground \
+                or self._ground_layer[1] != transform:
+            surface = pygame.Surface(self.ui.game.screen.get_size())
+            surface.set_colorkey((0,0,0), pygame.RLEACCEL)
+            points = np.asarray(get_points(), dtype=np.float64)
+            viewport = self.get_viewport()
+            segment_mins = np.minimum(points[:-1], points[1:])
+            segment_maxs = np.maximum(points[:-1], points[1:])
+            visible = (segment_maxs[:,0] >= viewport[0]) & (segment_maxs[:,1] >= viewport[1]) \
+                & (segment_mins[:,0] <= viewport[2]) & (segment_mins[:,1] <= viewport[3])
+            # Draw each run of consecutive visible segments as one line
+            edges = np.flatnonzero(np.diff(np.concatenate(([0], visible.astype(np.int8), [0]))))
+            for first, end in zip(edges[0::2], edges[1::2]):
+                pygame.draw.lines(surface, self.COLOR_GROUND, False, \
+                    self.transform_points(points[first:end+1]).tolist())
+            self._ground_layer = (ground, transform, surface)
+        self.ui.game.screen.blit(self._ground_layer[2], (0,0))
+
+    def draw_recorded_creatures(self, frames, positions, sticky, contracted, creature_indices):
+        # Draws creatures of a frame, see Trajectory.get_frame(), except the
+        # ones that are off screen.
+        # frames (Trajectory|Snapshot): Where the frame is from
+        # creature_indices (int[]): The creatures to draw
+        bb_mins, bb_maxs = frames.get_bounding_boxes(positions)
+        on_screen = self.is_visible(bb_mins.T, bb_maxs.T)
+        screen_positions = self.transform_points(positions).tolist()
+        screen_radii = (frames.node_radii * self.ui.scaling).astype(np.int64).tolist()
+        sticky = sticky.tolist()
+        for idx in creature_indices:
+            if not on_screen[idx]:
+                continue
+            nodes = frames.get_nodes(idx)
+            muscles, muscle_nodes = frames.get_muscles(idx)
+            self.draw_recorded_creature(screen_positions[nodes], sticky[nodes], screen_radii[nodes], \
+                muscle_nodes.tolist(), contracted[muscles].tolist())
+
+    def draw_recorded_creature(self, screen_positions, sticky, screen_radii, muscle_nodes, contracted):
+        # Draws a creature of a frame, see draw_recorded_creatures().
+        # screen_positions (float[][2]): Of the creature's nodes, on screen
+        # sticky (bool[]): Of the creature's nodes
+        # screen_radii (int[]): Of the creature's nodes, on screen
+        # muscle_nodes (int[][2]): Indices of the nodes of each muscle
+        # contracted (bool[]): Of the creature's muscles
+        if max(screen_radii, default=0) < self.SIMPLE_NODE_RADIUS:
+            for pos, is_sticky, radius in zip(screen_positions, sticky, screen_radii):
+                color = self.COLOR_NODE_STICKY if is_sticky else self.COLOR_NODE_NONSTICKY
+                self._draw_simple_node(pos, radius, color)
+            return
+        for pos, is_sticky, radius in zip(screen_positions, sticky, screen_radii):
+            color = self.COLOR_NODE_STICKY if is_sticky else self.COLOR_NODE_NONSTICKY
+            pygame.draw.circle(self.ui.game.screen, color, pos, radius)
+        for (node_idx_1, node_idx_2), is_contracted in zip(muscle_nodes, contracted):
+            color = self.COLOR_MUSCLE_CONTRACTED if is_contracted else self.COLOR_MUSCLE
+            pygame.draw.line(self.ui.game.screen, color, screen_positions[node_idx_1], \
+                screen_positions[node_idx_2])
 
+    def _draw_simple_node(self, pos, screen_radius, color):
+        # Draws a node as a square, at least one pixel wide.
+        size = max(1, int(2 * screen_radius))
+        self.ui.game.screen.fill(color, (int(pos[0] - size/2), int(pos[1] - size/2), size, size))
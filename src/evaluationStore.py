@@ -0,0 +1,106 @@
+
+import os
+import time
+import sqlite3
+
+from pymunk.vec2d import Vec2d
+
+from simulation import EvaluationResult
+
+
+class EvaluationStore:
+    """
+    Persists EvaluationResults in an SQLite database, keyed by genome content
+    hash (see Genome.get_content_hash()) and environment (see
+    FitnessCache.get_environment()), so that genomes scored in earlier runs
+    don't have to be simulated again.
+    Several processes may read and write the same database at once, e.g. the
+    worker processes storing their results. Each process opens its own
+    connection, so instances can be sent to worker processes.
+    """
+
+    # Seconds to wait for the write lock held by another process
+    TIMEOUT = 60
+
+    # Maximum number of hashes per query, SQLite limits the number of parameters
+    QUERY_CHUNK_SIZE = 500
+
+    COLUMNS = "genome_hash, environment, fitness, ticks, max_ticks, culled, " \
+        "final_x, final_y, wall_time, parent_hash, generation_idx, created"
+
+    def __init__(self, location):
+        # location (str): Path of the database file, created if missing
+        self.location = location
+        self._connection = None
+        self._connection_pid = None
+
+    def __getstate__(self):
+        # Connections can't be shared between processes
+        return {"location": self.location}
+
+    def __setstate__(self, state):
+        self.__init__(state["location"])
+
+    def _connect(self):
+        if self._connection is not None and self._connection_pid == os.getpid():
+            return self._connection
+        directory = os.path.dirname(self.location)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = sqlite3.connect(self.location, timeout=self.TIMEOUT)
+        # Readers don't block writers and vice versa
+        connection.execute("PRAGMA journal_mode=WAL")
+        with connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS evaluations (" \
+                "genome_hash TEXT NOT NULL, environment TEXT NOT NULL, " \
+                "fitness REAL NOT NULL, ticks INTEGER NOT NULL, max_ticks INTEGER NOT NULL, " \
+                "culled TEXT, final_x REAL, final_y REAL, wall_time REAL, " \
+                "parent_hash TEXT, generation_idx INTEGER, created REAL NOT NULL, " \
+                "PRIMARY KEY (genome_hash, environment))")
+        self._connection, self._connection_pid = connection, os.getpid()
+        return connection
+
+    def close(self):
+        if self._connection is not None and self._connection_pid == os.getpid():
+            self._connection.close()
+        self._connection = None
+
+    def get_results(self, genome_hashes, environment):
+        # Returns a dict genome hash -> EvaluationResult of the specified
+        # genomes that are in the store, with genome_id None.
+        connection = self._connect()
+        genome_hashes = list(set(genome_hashes))
+        results = {}
+        for i in range(0, len(genome_hashes), self.QUERY_CHUNK_SIZE):
+            chunk = genome_hashes[i:i+self.QUERY_CHUNK_SIZE]
+            rows = connection.execute("SELECT genome_hash, fitness, ticks, max_ticks, culled, " \
+                "final_x, final_y, wall_time FROM evaluations " \
+                "WHERE environment = ? AND genome_hash IN ({})".format(", ".join(["?"] * len(chunk))), \
+                [repr(environment)] + chunk)
+            for genome_hash, fitness, ticks, max_ticks, culled, final_x, final_y, wall_time in rows:
+                final_center = None if final_x is None else Vec2d(final_x, final_y)
+                results[genome_hash] = EvaluationResult(None, fitness, ticks, max_ticks, \
+                    final_center, wall_time, culled)
+        return results
+
+    def put_results(self, generation, environment, results):
+        # Stores the results of the generation's genomes, replacing ones
+        # stored before.
+        # results (EvaluationResult[]): For each genome of the generation, in
+        #   the same order
+        rows = []
+        created = time.time()
+        for genome, result in zip(generation.genomes, results):
+            final_center = result.final_center
+            rows.append((genome.get_content_hash(), repr(environment), result.fitness, \
+                result.ticks, result.max_ticks, result.culled, \
+                None if final_center is None else final_center.x, \
+                None if final_center is None else final_center.y, \
+                result.wall_time, getattr(genome, "parent_hash", None), generation.idx, created))
+        connection = self._connect()
+        with connection:
+            connection.executemany("INSERT OR REPLACE INTO evaluations ({}) VALUES ({})".format( \
+                self.COLUMNS, ", ".join(["?"] * 12)), rows)
+
+    def get_count(self):
+        return self._connect().execute("SELECT COUNT(*) FROM evaluations").fetchone()[0]
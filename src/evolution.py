@@ -0,0 +1,474 @@
+import random
+import pickle
+from datetime import datetime
+
+from simulation import *
+from simulationClimber import *
+from simulationHopper import *
+from genotype import *
+from timer import *
+from generation import *
+from scheduler import *
+from fitnessCache import *
+from evaluationStore import *
+from checkpoint import *
+from genomeArchive import *
+from population import *
+from reproduction import *
+from steadyState import *
+from island import *
+from distributed import *
+from trajectory import *
+
+
+# The evolution core, shared by the pygame UI (main.py) and the headless
+# runner (headless.py). Must never import pygame.
+
+
+MAX_WORKERS = 6
+SIMULATION_TICKS = 7000
+GENERATION_SIZE = 140
+SURVIVORS_PER_GENERATION = 20
+RANDOMS_PER_GENERATION = 5
+GUARANTEE_CHAMPION_SURVIVAL_CHANCE = 0.95
+# Seed of the terrain for every generation, None for a new random terrain
+# each generation. All creatures of a generation share the same terrain.
+TERRAIN_SEED = None
+# Generate and mutate the genomes of a generation all at once in NumPy arrays
+# (see Population), instead of one by one. Uses other random draws, so seeded
+# runs differ between both ways.
+VECTORIZED_REPRODUCTION = False
+# Let the worker processes make the genomes of the next generation, each the
+# ones it simulates, instead of the main process making all of them between
+# generations (see ReproductionPlan). Only when simulating in parallel. Uses
+# other random draws, so seeded runs differ between both ways.
+PARALLEL_REPRODUCTION = True
+# Instead of evaluating generation after generation, breed a new genome as
+# soon as one is evaluated, to keep the workers busy (see
+# SteadyStateEvolution). Only in the UI, and only when simulating in
+# parallel. Such runs aren't recorded in checkpoints.
+STEADY_STATE = False
+# Number of islands that evolve a population of ISLAND_SIZE genomes each in
+# a worker process, instead of one population of GENERATION_SIZE genomes, 0
+# for one population (see IslandModel). Every MIGRATION_INTERVAL
+# generations, the best MIGRANTS genomes of each island move to the islands
+# it's connected to by MIGRATION_TOPOLOGY, one of IslandModel.TOPOLOGIES.
+# The islands' numbers of survivors and randoms are in the same proportion as
+# for one population. Island runs aren't recorded in checkpoints.
+ISLANDS = 0
+ISLAND_SIZE = 40
+MIGRATION_INTERVAL = 5
+MIGRANTS = 2
+MIGRATION_TOPOLOGY = "ring"
+
+# Overwrites:
+# GUARANTEE_CHAMPION_SURVIVAL_CHANCE
+# RANDOMS_PER_GENERATION
+# GENERATION_SIZE
+# SIMULATION_TICKS
+# To visualize the mutation factors with super-quick one-creature generations
+MUTATION_FACTORS_VISUALIZATION_MODE = False
+
+
+# ---------------------------------------------------------------------------
+
+if MUTATION_FACTORS_VISUALIZATION_MODE:
+    GENERATION_SIZE = 1
+    SIMULATION_TICKS = 50
+    RANDOMS_PER_GENERATION = 0
+
+SAVE_DIRECTORY = "./saved_generations/"
+
+# Results of all simulated genomes, shared across runs, see EvaluationStore.
+# None to not store them.
+EVALUATION_STORE_LOCATION = SAVE_DIRECTORY + "evaluations.sqlite"
+
+# Each run is recorded in a subdirectory, to be resumed after a crash, see
+# Checkpoint. None to not record runs.
+CHECKPOINT_DIRECTORY = SAVE_DIRECTORY + "checkpoints/"
+
+# Recordings of creatures to replay, see Trajectory
+TRAJECTORY_DIRECTORY = SAVE_DIRECTORY + "trajectories/"
+
+# The settings above that are restored when resuming a run
+CHECKPOINT_SETTINGS = ["SIMULATION_TICKS", "GENERATION_SIZE", "SURVIVORS_PER_GENERATION", \
+    "RANDOMS_PER_GENERATION", "GUARANTEE_CHAMPION_SURVIVAL_CHANCE", "TERRAIN_SEED", \
+    "VECTORIZED_REPRODUCTION", "PARALLEL_REPRODUCTION"]
+
+# How the generations of a run are evaluated, recorded along with the
+# CHECKPOINT_SETTINGS, see get_run_settings()
+RUN_SETTINGS = ["simulation_class", "max_ticks", "fidelity", "terrain_seed"]
+
+Genome.NODE_TYPE_CLASS = TimerNodeType
+Genome.MUSCLE_TYPE_CLASS = TimerMuscleType
+
+
+# ---------------------------------------------------------------------------
+
+def save(genomes, fitness_avg, fitness_max):
+    filename = "{}_avg_{}_best_{}{}".format( \
+        datetime.now().strftime("%Y-%m-%d_%H_%M_%S"), \
+        fitness_avg, fitness_max, GenomeArchive.FILE_EXTENSION)
+    location = SAVE_DIRECTORY + filename
+    GenomeArchive.write(location, genomes)
+    print("Generation saved as {}".format(location))
+
+def load(location):
+    # Note: Loaded generation may be larger or smaller than GENERATION_SIZE.
+    # Returns a generation of the loaded genomes.
+    # location (str): A GenomeArchive, or a generation saved as pickle by
+    #   earlier versions
+    gen = Generation(1, [])
+    if GenomeArchive.is_archive(location):
+        archive = GenomeArchive(location)
+        for genome in archive.iterate_genomes():
+            gen.add_genome(genome)
+        archive.close()
+    else:
+        for genome in load_pickle(location):
+            gen.add_genome(genome)
+    print("Loaded {} genomes".format(len(gen.genomes)))
+    return gen
+
+def load_pickle(location):
+    # Returns the genomes of a generation saved as pickle, the format of
+    # earlier versions, see convertGenerations.py.
+    f = open(location, 'rb')
+    up = pickle.Unpickler(f)
+    nb_genomes = up.load()
+    genomes = [up.load() for i in range(nb_genomes)]
+    f.close()
+    return genomes
+
+
+def get_settings():
+    # Returns the CHECKPOINT_SETTINGS as a dict.
+    return {name: globals()[name] for name in CHECKPOINT_SETTINGS}
+
+def apply_settings(settings):
+    # Overwrites the CHECKPOINT_SETTINGS with the values of the dict.
+    for name in CHECKPOINT_SETTINGS:
+        if name in settings:
+            globals()[name] = settings[name]
+
+def get_run_settings(simulation_class, max_ticks, fidelity=None, terrain_seed=None):
+    # Returns the settings to record in a checkpoint, the CHECKPOINT_SETTINGS
+    # and the RUN_SETTINGS, so that any front end can resume the run.
+    # max_ticks (int): In ticks of the standard timestep
+    # fidelity (FidelityProfile|None): See Simulation
+    # terrain_seed (int|None): See generate_ground()
+    return dict(get_settings(), simulation_class=simulation_class, max_ticks=max_ticks, \
+        fidelity=fidelity, terrain_seed=terrain_seed)
+
+def configure_process(settings, timer_engine_class):
+    # Makes this process evaluate like the one that sent the arguments, e.g.
+    # a worker of a DistributedPool.
+    # settings (dict): See get_settings()
+    # timer_engine_class (class|None): Of all simulation classes
+    apply_settings(settings)
+    for simulation_class in (SimulationHopper, SimulationClimber):
+        simulation_class.TIMER_ENGINE_CLASS = timer_engine_class
+
+def create_checkpoint(directory=CHECKPOINT_DIRECTORY):
+    # Returns None if directory is None.
+    return None if directory is None else Checkpoint.create(directory)
+
+def resume_checkpoint(directory=None):
+    # Continues the run recorded in the checkpoint directory, the most recent
+    # one in CHECKPOINT_DIRECTORY if None. Restores the random state and the
+    # settings, and returns a tuple (checkpoint, ResumedState).
+    if directory is None:
+        directory = Checkpoint.find_latest(CHECKPOINT_DIRECTORY)
+        if directory is None:
+            raise FileNotFoundError("No checkpoint found in {}".format(CHECKPOINT_DIRECTORY))
+    checkpoint, state = Checkpoint.resume(directory)
+    missing = [name for name in CHECKPOINT_SETTINGS + RUN_SETTINGS if name not in state.settings]
+    if len(missing) > 0:
+        checkpoint.close()
+        raise ValueError("Checkpoint {} lacks the settings {}".format(directory, ", ".join(missing)))
+    apply_settings(state.settings)
+    print("Resuming {} at generation {}".format(directory, state.next_generation.idx))
+    return checkpoint, state
+
+
+# ---------------------------------------------------------------------------
+
+def make_initial_generation():
+    initial_generation = Generation(1, [])
+    if VECTORIZED_REPRODUCTION:
+        initial_generation.genomes = Population.generate_random(GENERATION_SIZE, 50, 80).to_genomes()
+    else:
+        initial_generation.add_random_genomes(GENERATION_SIZE)
+    return initial_generation
+
+def make_next_generation(parent_gen, generation_size=None, nb_survivors=None, nb_randoms=None):
+    # Generate the next generation from the specified FinishedGeneration and return it.
+    # generation_size, nb_survivors, nb_randoms (int|None): Override
+    #   GENERATION_SIZE, SURVIVORS_PER_GENERATION and RANDOMS_PER_GENERATION
+    generation_size = GENERATION_SIZE if generation_size is None else generation_size
+    nb_survivors = SURVIVORS_PER_GENERATION if nb_survivors is None else nb_survivors
+    nb_randoms = RANDOMS_PER_GENERATION if nb_randoms is None else nb_randoms
+    reproducing_genomes = [rg[1] for rg in parent_gen.ranked_genomes[0:nb_survivors]]
+    next_generation = Generation(parent_gen.idx+1, [])
+    guarantee_champion_survival = False if MUTATION_FACTORS_VISUALIZATION_MODE else \
+        random.uniform(0, 1) <= GUARANTEE_CHAMPION_SURVIVAL_CHANCE
+    if VECTORIZED_REPRODUCTION:
+        _make_children_vectorized(next_generation, reproducing_genomes, parent_gen.ranked_genomes[0][1], \
+            guarantee_champion_survival, generation_size - nb_randoms, nb_randoms)
+        return next_generation
+    while len(next_generation.genomes) < generation_size - nb_randoms:
+        if guarantee_champion_survival and len(next_generation.genomes) == 0:
+            next_generation.add_genome(parent_gen.ranked_genomes[0][1])
+        else:
+            parent_genome = random.choice(reproducing_genomes)
+            next_generation.add_children(parent_genome, 1)
+    next_generation.add_random_genomes(nb_randoms)
+    return next_generation
+
+def reproduce(parent_gen, in_parallel):
+    # Returns what to evaluate next, a ReproductionPlan if the genomes shall
+    # be made by the worker processes (see PARALLEL_REPRODUCTION), a
+    # Generation otherwise.
+    # in_parallel (bool): Whether the next generation is simulated by
+    #   worker processes
+    if PARALLEL_REPRODUCTION and in_parallel:
+        return plan_next_generation(parent_gen)
+    return make_next_generation(parent_gen)
+
+def plan_next_generation(parent_gen):
+    # Like make_next_generation(), but returns a ReproductionPlan, for the
+    # worker processes to make the genomes, see reproduce_and_simulate().
+    reproducing_genomes = [rg[1] for rg in parent_gen.ranked_genomes[0:SURVIVORS_PER_GENERATION]]
+    guarantee_champion_survival = False if MUTATION_FACTORS_VISUALIZATION_MODE else \
+        random.uniform(0, 1) <= GUARANTEE_CHAMPION_SURVIVAL_CHANCE
+    nb_children = GENERATION_SIZE - RANDOMS_PER_GENERATION
+    parent_positions = [random.randrange(len(reproducing_genomes)) for i in range(nb_children)]
+    mutate = [True] * nb_children
+    if guarantee_champion_survival and nb_children > 0:
+        parent_positions[0], mutate[0] = 0, False     # the champion is the first reproducing genome
+    parent_positions += [None] * RANDOMS_PER_GENERATION
+    mutate += [False] * RANDOMS_PER_GENERATION
+    return ReproductionPlan(parent_gen.idx+1, reproducing_genomes, parent_positions, mutate, \
+        random.getrandbits(64), vectorized=VECTORIZED_REPRODUCTION)
+
+def start_steady_state(initial_generation, simulation_class, workers):
+    # Returns a SteadyStateEvolution that starts with the genomes of the
+    # specified generation, on its terrain.
+    # initial_generation (Generation|ReproductionPlan): See reproduce()
+    if isinstance(initial_generation, ReproductionPlan):
+        initial_generation = initial_generation.make_generation()
+    generate_ground(initial_generation, simulation_class)
+    return SteadyStateEvolution(initial_generation, GENERATION_SIZE, SURVIVORS_PER_GENERATION, \
+        RANDOMS_PER_GENERATION, workers)
+
+def start_islands(initial_generation, nb_islands=None):
+    # Returns an IslandModel whose islands start with the genomes of the
+    # specified generation.
+    # initial_generation (Generation|ReproductionPlan): See reproduce()
+    # nb_islands (int|None): Overrides ISLANDS
+    if isinstance(initial_generation, ReproductionPlan):
+        initial_generation = initial_generation.make_generation()
+    return IslandModel(initial_generation, ISLANDS if nb_islands is None else nb_islands, ISLAND_SIZE, \
+        max(1, SURVIVORS_PER_GENERATION * ISLAND_SIZE // GENERATION_SIZE), \
+        RANDOMS_PER_GENERATION * ISLAND_SIZE // GENERATION_SIZE, MIGRANTS, MIGRATION_TOPOLOGY)
+
+def _make_children_vectorized(next_generation, reproducing_genomes, champion, guarantee_champion_survival, \
+        nb_children, nb_randoms):
+    # Like the loop of make_next_generation(), but mutates all children at
+    # once, see Population.
+    if guarantee_champion_survival and nb_children > 0:
+        next_generation.add_genome(champion)
+        nb_children -= 1
+    parent_positions = [random.randrange(len(reproducing_genomes)) for i in range(nb_children)]
+    children = Population.from_genomes(reproducing_genomes).take(parent_positions)
+    children.mutate()
+    parent_hashes = [genome.get_content_hash() for genome in reproducing_genomes]
+    for position, child in zip(parent_positions, children.to_genomes()):
+        child.parent_hash = parent_hashes[position]
+        next_generation.add_genome(child)
+    next_generation.genomes += Population.generate_random(nb_randoms, 50, 80).to_genomes()
+
+def generate_ground(generation, simulation_class, terrain_seed=None):
+    # Generates the ground of the generation once, before it is split and
+    # shipped to the worker processes, so that all its creatures run on the
+    # same terrain and the workers don't generate it themselves.
+    # terrain_seed (int|None): Overrides the generation's terrain_seed, which
+    #   overrides TERRAIN_SEED
+    if terrain_seed is None:
+        terrain_seed = generation.terrain_seed
+    if terrain_seed is None:
+        terrain_seed = TERRAIN_SEED
+    if terrain_seed is None:
+        terrain_seed = random.getrandbits(32)
+    generation.terrain_seed = terrain_seed
+    generation.ground = simulation_class.generate_ground(terrain_seed)
+
+# Spaces and pymunk objects of the previous simulate() calls of this process.
+# The worker processes live as long as their pool, so they reuse their worlds
+# for every generation.
+_world_cache = WorldCache()
+
+# Results of the previous reproduce_and_simulate() calls of this process
+_worker_fitness_cache = FitnessCache()
+
+def reproduce_and_simulate(plan, simulation_class, max_ticks, fidelity=None, evaluation_store=None, \
+        snapshot_queue=None, snapshot_source=None):
+    # Makes the genomes of the plan and simulates the ones whose results
+    # aren't known yet. This is what runs in the worker processes with
+    # PARALLEL_REPRODUCTION. Returns a tuple (genomes, results, simulated):
+    # genomes (Genome[]): In the order of the plan
+    # results (EvaluationResult[]): For each genome, genome ids are the
+    #   plan's genome ids
+    # simulated (EvaluationResult[]): The ones of results that were
+    #   simulated, the others weren't and didn't take their wall time
+    # plan (ReproductionPlan): A part of the plan, with ground
+    # snapshot_queue, snapshot_source: See simulate()
+    part = plan.make_generation()
+    generation = Generation(part.idx, part.genomes, terrain_seed=part.terrain_seed)
+    generation.ground = part.ground
+    environment = FitnessCache.get_environment(generation.ground, simulation_class, max_ticks, fidelity)
+    _worker_fitness_cache.store = evaluation_store
+    _worker_fitness_cache.add_results(generation, environment, plan.get_known_results())
+    cached_results, missing = _worker_fitness_cache.get_results(generation, environment)
+    simulated = [] if len(missing.genomes) == 0 else \
+        simulate(missing, simulation_class, max_ticks, fidelity, evaluation_store, snapshot_queue, \
+            snapshot_source)
+    results = _worker_fitness_cache.complete_results(generation, environment, cached_results + simulated)
+    for result in results:
+        result.genome_id = part.get_genome_id(result.genome_id)
+    return part.genomes, results, simulated
+
+def evolve_island(island, nb_generations, immigrants, simulation_class, max_ticks, fidelity=None, \
+        evaluation_store=None, terrain_seed=None):
+    # Evolves the island for nb_generations generations in this process. This
+    # is what runs in the worker processes with ISLANDS. Returns a tuple
+    # (island, summaries, best_genomes):
+    # island (Island): With the generation to evaluate next
+    # summaries (GenerationSummary[]): Of the evaluated generations
+    # best_genomes (Genome[]): The island's survivors of the last generation,
+    #   best first
+    # immigrants (Genome[]): Take the places of the last genomes of the
+    #   island's next generation, the random ones and the last children
+    # terrain_seed (int|None): See generate_ground()
+    state = random.getstate()
+    random.setstate(island.random_state)
+    generation = island.next_generation
+    if len(immigrants) > 0:
+        generation.genomes = generation.genomes[0:len(generation.genomes) - len(immigrants)] + immigrants
+    _worker_fitness_cache.store = evaluation_store
+    summaries = []
+    for i in range(nb_generations):
+        generate_ground(generation, simulation_class, terrain_seed)
+        environment = FitnessCache.get_environment(generation.ground, simulation_class, max_ticks, fidelity)
+        cached_results, missing = _worker_fitness_cache.get_results(generation, environment)
+        results = [] if len(missing.genomes) == 0 else \
+            simulate(missing, simulation_class, max_ticks, fidelity, evaluation_store)
+        results = _worker_fitness_cache.complete_results(generation, environment, cached_results + results)
+        fg = FinishedGeneration(generation, results, nb_cached=len(generation.genomes) - len(missing.genomes))
+        summaries.append(GenerationSummary(fg))
+        generation = make_next_generation(fg, island.generation_size, island.nb_survivors, island.nb_randoms)
+    island.next_generation = generation
+    island.random_state = random.getstate()
+    random.setstate(state)
+    return island, summaries, [rg[1] for rg in fg.ranked_genomes[0:island.nb_survivors]]
+
+def assemble_generation(plan, batches, batch_outputs):
+    # Puts together the genomes that the worker processes made from the
+    # batches of the plan. Returns a tuple (generation, results,
+    # batch_generations, batch_results, nb_cached):
+    # generation (Generation): With the genomes of the plan, terrain and ground
+    # results (EvaluationResult[]): For each genome, genome ids are positions
+    #   in the generation
+    # batch_generations (Generation[]): With the simulated genomes of each
+    #   batch, see BatchScheduler.finish_generation()
+    # batch_results (EvaluationResult[][]): Of the simulated genomes of each
+    #   batch
+    # nb_cached (int): Number of results that weren't simulated
+    # batch_outputs (tuple[]): What reproduce_and_simulate() returned for each batch
+    genomes = [None] * len(plan)
+    results, batch_results, nb_cached = [], [], 0
+    for batch, (batch_genomes, batch_all_results, simulated) in zip(batches, batch_outputs):
+        for position, genome in enumerate(batch_genomes):
+            genomes[batch.get_genome_id(position)] = genome
+        results += batch_all_results
+        batch_results.append(simulated)
+        nb_cached += len(batch_genomes) - len(simulated)
+    generation = Generation(plan.idx, genomes, terrain_seed=plan.terrain_seed)
+    generation.ground = plan.ground
+    batch_generations = [Generation(plan.idx, [genomes[result.genome_id] for result in simulated]) \
+        for simulated in batch_results]
+    return generation, results, batch_generations, batch_results, nb_cached
+
+def simulate(generation, simulation_class, max_ticks, fidelity=None, evaluation_store=None, \
+        snapshot_queue=None, snapshot_source=None):
+    # Simulates all genomes of the generation until done and returns their
+    # EvaluationResults. This is what runs in the worker processes.
+    # fidelity (FidelityProfile|None): Physics settings, None for the
+    #   simulation class' defaults. Note that max_ticks is not adjusted.
+    # evaluation_store (EvaluationStore|None): Where to store the results
+    # snapshot_queue (Queue|None): Where to send Snapshots of the creatures
+    #   while simulating, to watch them, see SnapshotStream
+    # snapshot_source (int|None): Tags the Snapshots, e.g. with the position
+    #   of the generation's batch
+    sim = simulation_class(generation, max_ticks, fidelity, _world_cache)
+    stream = None if snapshot_queue is None else \
+        SnapshotStream(sim, snapshot_queue, source=snapshot_source)
+    while not sim.is_done():
+        sim.do_timestep()
+        if stream is not None:
+            stream.update()
+    if stream is not None:
+        stream.update(force=True)
+    sim.evaluate()
+    results = sim.get_results()
+    if evaluation_store is not None:
+        environment = FitnessCache.get_environment(sim.ground, simulation_class, max_ticks, fidelity)
+        evaluation_store.put_results(generation, environment, results)
+    sim.release()
+    return results
+
+def record_trajectories(generation, simulation_class, max_ticks, location, fidelity=None):
+    # Simulates all genomes of the generation like simulate() and records
+    # them to a Trajectory at location. This is what runs in a worker process
+    # to replay creatures, e.g. the best of a generation. As creatures don't
+    # interact, they move exactly like in the generation they were evaluated
+    # in. Returns location.
+    sim = simulation_class(generation, max_ticks, fidelity, _world_cache)
+    recorder = TrajectoryRecorder(sim)
+    recorder.record()
+    while not sim.is_done():
+        sim.do_timestep()
+        recorder.record()
+    sim.evaluate()
+    fitnesses = {id(creature): fitness for fitness, creature in sim.ranked_creatures}
+    Trajectory.write(location, recorder, [fitnesses[id(creature)] for creature in sim.creatures], \
+        sim.ground, sim.fidelity.timestep_delta, generation.idx)
+    sim.release()
+    return location
+
+def open_evaluation_store(location=EVALUATION_STORE_LOCATION):
+    # Returns None if location is None.
+    return None if location is None else EvaluationStore(location)
+
+def print_island_stats(summary, nb_finished_generations):
+    # Prints the stats of an IslandGenerationSummary, and the best fitness of
+    # each island.
+    fitness_min, fitness_avg, fitness_max = summary.get_stats()
+    island_maxima = " ".join([str(island_summary.get_stats()[2]) for island_summary in summary.island_summaries])
+    if nb_finished_generations % 10 == 0:
+        print("{:<5} {:<8} {:<8} {:<8} {}".format("#Gen", "Fit min", "Fit avg", "Fit max", "Fit max per island"))
+    print("{:<5} {:<8} {:<8} {:<8} {}".format(summary.idx, fitness_min, fitness_avg, fitness_max, island_maxima))
+
+def print_generation_stats(finished_generation, nb_finished_generations):
+    fitness_min, fitness_avg, fitness_max = finished_generation.get_stats()
+    culled = "{} ({}%)".format(finished_generation.nb_culled, finished_generation.get_culled_percent())
+    cached = "{} ({}%)".format(finished_generation.nb_cached, finished_generation.get_cached_percent())
+    utilization = "-" if finished_generation.utilization is None else \
+        "{}%".format(int(finished_generation.utilization * 100))
+    main_cpu = "-" if finished_generation.main_cpu is None else \
+        "{}%".format(int(finished_generation.main_cpu * 100))
+    if nb_finished_generations % 10 == 0:
+        print("{:<5} {:<8} {:<8} {:<8} {:<10} {:<10} {:<5} {:<5}".format( \
+            "#Gen", "Fit min", "Fit avg", "Fit max", "Culled", "Cached", "Util", "Main"))
+    print("{:<5} {:<8} {:<8} {:<8} {:<10} {:<10} {:<5} {:<5}".format(finished_generation.idx, \
+        fitness_min, fitness_avg, fitness_max, culled, cached, utilization, main_cpu))
@@ -0,0 +1,148 @@
+
+import copy
+import hashlib
+import collections
+
+
+class FitnessCache:
+    """
+    Remembers the EvaluationResults of genomes by their content hash (see
+    Genome.get_content_hash()), so that genomes that were already simulated
+    in the same environment aren't simulated again, e.g. the champion that is
+    copied into the next generation, or children without any mutation. The
+    simulation is deterministic, so a cached result is the same as a new one.
+    """
+
+    # Number of results to keep, the least recently used ones are dropped
+    MAX_ENTRIES = 10000
+
+    def __init__(self, max_entries=None, store=None):
+        # store (EvaluationStore|None): Where to look up genomes that aren't
+        #   in the cache, before simulating them
+        self.max_entries = max_entries if max_entries is not None else self.MAX_ENTRIES
+        self.store = store
+        self._results = collections.OrderedDict()     # (genome hash, environment) -> EvaluationResult
+        self.nb_hits = 0
+        self.nb_misses = 0
+
+    @staticmethod
+    def get_environment(ground, simulation_class, max_ticks, fidelity):
+        # Returns what, besides the genome, determines the result of a
+        # simulation. Stored results are only used in the same environment, so
+        # everything that changes fitnesses belongs here, e.g. culling.
+        # ground (array): See Simulation.generate_ground()
+        # fidelity (FidelityProfile|None): See Simulation
+        cls = simulation_class
+        if fidelity is None:
+            physics = (cls.ITERATIONS, cls.TIMESTEMP_DELTA)
+        else:
+            physics = (fidelity.iterations, fidelity.timestep_delta)
+        physics += (cls.DAMPING, tuple(cls.GRAVITY), cls.GROUND_FRICTION)
+        culling = (cls.CULL_CHECK_TICKS, cls.CULL_STUCK_WINDOW_TICKS, cls.CULL_STUCK_MIN_DISTANCE, \
+            cls.CULL_MAX_COORDINATE, cls.CULL_MAX_VELOCITY)
+        ground_hash = hashlib.sha256(ground.tobytes()).hexdigest()
+        return (cls.__name__, cls.VERSION, max_ticks, physics, culling, ground_hash)
+
+    def _get(self, key):
+        result = self._results.get(key)
+        if result is not None:
+            self._results.move_to_end(key)
+        return result
+
+    def _put(self, key, result):
+        self._results[key] = result
+        self._results.move_to_end(key)
+        while len(self._results) > self.max_entries:
+            self._results.popitem(last=False)
+
+    def get_results(self, generation, environment):
+        # Returns a tuple (results, missing):
+        # results (EvaluationResult[]): Of the genomes found in the cache,
+        #   genome ids are positions in the generation
+        # missing (Generation): Part of the generation (see Generation.split_at)
+        #   with the genomes to simulate. Genomes with the same content appear
+        #   only once, see complete_results().
+        results = []
+        missing_positions = []
+        missing_hashes = set()
+        genome_hashes = [genome.get_content_hash() for genome in generation.genomes]
+        if self.store is not None:
+            # One query for all genomes that aren't cached
+            unknown_hashes = [genome_hash for genome_hash in genome_hashes \
+                if (genome_hash, environment) not in self._results]
+            for genome_hash, result in self.store.get_results(unknown_hashes, environment).items():
+                self._put((genome_hash, environment), result)
+        for position, genome_hash in enumerate(genome_hashes):
+            result = self._get((genome_hash, environment))
+            if result is not None:
+                results.append(self._copy_result(result, position))
+                self.nb_hits += 1
+            elif genome_hash in missing_hashes:
+                self.nb_hits += 1
+            else:
+                missing_positions.append(position)
+                missing_hashes.add(genome_hash)
+                self.nb_misses += 1
+        return results, generation.split_at([missing_positions])[0]
+
+    def add_known_results(self, plan, environment):
+        # Sets the known results of the plan's unchanged copies (see
+        # ReproductionPlan) that are in the cache or its store. Their genome
+        # ids are the plan's. Returns the number of results found.
+        copies = [pos for pos in range(len(plan)) \
+            if plan.parent_positions[pos] is not None and not plan.mutate[pos]]
+        parent_hashes = {parent_pos: plan.parents[parent_pos].get_content_hash() \
+            for parent_pos in set([plan.parent_positions[pos] for pos in copies])}
+        if self.store is not None:
+            unknown_hashes = [genome_hash for genome_hash in parent_hashes.values() \
+                if (genome_hash, environment) not in self._results]
+            for genome_hash, result in self.store.get_results(unknown_hashes, environment).items():
+                self._put((genome_hash, environment), result)
+        nb_found = 0
+        for pos in copies:
+            result = self._get((parent_hashes[plan.parent_positions[pos]], environment))
+            if result is not None:
+                plan.known_results[pos] = self._copy_result(result, plan.get_genome_id(pos))
+                self.nb_hits += 1
+                nb_found += 1
+            else:
+                self.nb_misses += 1
+        return nb_found
+
+    def add_results(self, generation, environment, results):
+        # Caches results of genomes of the generation, genome ids are
+        # positions in the generation.
+        for result in results:
+            self._put((generation.genomes[result.genome_id].get_content_hash(), environment), result)
+
+    def complete_results(self, generation, environment, results):
+        # Caches the results of the simulated genomes and returns the results
+        # for all genomes of the generation.
+        # results (EvaluationResult[]): The cached ones of get_results() and the
+        #   ones of simulating its missing genomes, genome ids are positions in
+        #   the generation
+        genome_hashes = [genome.get_content_hash() for genome in generation.genomes]
+        results_by_hash = {}
+        for result in results:
+            genome_hash = genome_hashes[result.genome_id]
+            self._put((genome_hash, environment), result)
+            results_by_hash[genome_hash] = result
+        done_positions = set([result.genome_id for result in results])
+        results = list(results)
+        for position, genome_hash in enumerate(genome_hashes):
+            if position not in done_positions:
+                # Same content as a genome that was simulated
+                results.append(self._copy_result(results_by_hash[genome_hash], position))
+        return results
+
+    def _copy_result(self, result, genome_id):
+        result = copy.copy(result)
+        result.genome_id = genome_id
+        return result
+
+    def get_hit_percent(self):
+        # Percentage of all looked up genomes that weren't simulated
+        total = self.nb_hits + self.nb_misses
+        if total == 0:
+            return 0
+        return int(self.nb_hits / total * 100)
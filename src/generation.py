@@ -6,9 +6,24 @@ from genotype import *
 
 class Generation:
 
-    def __init__(self, idx, genomes):
+    def __init__(self, idx, genomes, genome_ids=None, terrain_seed=None):
+        # genome_ids (int[]|None): Identifies each genome within the generation
+        #   this one was split from, defaults to the genomes' positions
+        # terrain_seed (int|None): Seed of the ground all genomes are simulated
+        #   on, see Simulation.generate_ground()
         self.idx = idx
         self.genomes = genomes
+        self.genome_ids = genome_ids
+        self.terrain_seed = terrain_seed
+        # Ground generated from terrain_seed by the simulation class, so that
+        # the parts of a split generation don't have to generate it again.
+        # None to let the simulation generate it.
+        self.ground = None
+
+    def get_genome_id(self, position):
+        if self.genome_ids is None:
+            return position
+        return self.genome_ids[position]
 
     def add_genome(self, genome):
         self.genomes.append(genome)
@@ -22,40 +37,69 @@ class Generation:
         # Adds the specified number of children of the specfied parent genome,
         # i.e., mutations of that genome, to this generation.
 
+        parent_hash = parent_genome.get_content_hash()
         for i in range(count):
-            new_genome = copy.deepcopy(parent_genome)
+            new_genome = parent_genome.clone()
+            new_genome.parent_hash = parent_hash
             new_genome.mutate()
             self.genomes.append(new_genome)
 
     def split(self, nb_parts):
-        split_genomes = [[] for i in range(nb_parts)]
+        # The genome ids of the parts are the genomes' positions in this generation.
+        split_positions = [[] for i in range(nb_parts)]
         # Distribute randomly round-robin
         distribution_order = list(range(len(self.genomes)))
         random.shuffle(distribution_order)
         for i in range(len(self.genomes)):
-            split_genomes[i%nb_parts].append(self.genomes[distribution_order[i]])
-        return [Generation(self.idx, split_genomes[i]) for i in range(nb_parts)]
+            split_positions[i%nb_parts].append(distribution_order[i])
+        return self.split_at(split_positions)
+
+    def split_at(self, split_positions):
+        # Returns a part for each list of positions, containing the genomes at
+        # these positions. Their genome ids are the genome ids of these
+        # positions, so parts of parts still refer to the original generation.
+        parts = []
+        for positions in split_positions:
+            part = Generation(self.idx, [self.genomes[pos] for pos in positions], \
+                [self.get_genome_id(pos) for pos in positions], self.terrain_seed)
+            part.ground = self.ground
+            parts.append(part)
+        return parts
 
 
 class FinishedGeneration(Generation):
 
-    def __init__(self, sims):
+    def __init__(self, generation, results, utilization=None, nb_cached=0, main_cpu=None):
+        # generation (Generation): The evaluated generation
+        # results (EvaluationResult[]): For each genome of the generation,
+        #   genome ids must refer to positions in the generation.
+        # utilization (float|None): Share of the workers' time spent
+        #   simulating, from 0 to 1, None if not measured
+        # nb_cached (int): Number of genomes whose results were taken from the
+        #   fitness cache instead of simulating them
+        # main_cpu (float|None): Share of one core the main process used while
+        #   the generation was evaluated, None if not measured
+        super().__init__(generation.idx, generation.genomes, terrain_seed=generation.terrain_seed)
+        self.ground = generation.ground
+        self.results = results
+        self.utilization = utilization
+        self.nb_cached = nb_cached
+        self.main_cpu = main_cpu
 
         # Each element is a tuple (fitness, genome).
-        # Sorted descendingly, best to worst fitness.
-        self.ranked_genomes = []
-
-        # Merge genomes and self.ranked_genomes
-        genomes = []
-        for sim in sims:
-            genomes.extend(sim.generation.genomes)
-            ranked_genomes = [(fitness, creature.genome) for fitness, creature in sim.ranked_creatures]
-            self.ranked_genomes.extend(ranked_genomes)
-            self.ranked_genomes.sort(key=lambda rg: rg[0], reverse=True)
-
-        # Construct superclass
-        generation_idx = sims[0].generation.idx
-        super().__init__(generation_idx, genomes)
+        # Sorted descendingly, best to worst fitness. Genomes with the same
+        # fitness keep their order in the generation, regardless of the order
+        # the results arrived in.
+        self.ranked_genomes = [(result.fitness, generation.genomes[result.genome_id]) \
+            for result in sorted(results, key=lambda result: result.genome_id)]
+        self.ranked_genomes.sort(key=lambda rg: rg[0], reverse=True)
+
+        # Number of creatures removed from the simulation early, and the
+        # creature ticks that were saved by that
+        culled_results = [result for result in results if result.culled is not None]
+        self.nb_culled = len(culled_results)
+        self.culled_ticks = sum([result.max_ticks - result.ticks for result in culled_results])
+        self.total_ticks = sum([result.max_ticks for result in results])
 
     def get_stats(self):
         ranked_fitnesses = [rc[0] for rc in self.ranked_genomes]
@@ -65,3 +109,14 @@ class FinishedGeneration(Generation):
         fitness_avg = int(sum(ranked_fitnesses) / len(ranked_fitnesses))
         fitness_max = int(max(ranked_fitnesses))
         return fitness_min, fitness_avg, fitness_max
+
+    def get_cached_percent(self):
+        if len(self.genomes) == 0:
+            return 0
+        return int(self.nb_cached / len(self.genomes) * 100)
+
+    def get_culled_percent(self):
+        # Percentage of creature ticks saved by culling
+        if self.total_ticks == 0:
+            return 0
+        return int(self.culled_ticks / self.total_ticks * 100)
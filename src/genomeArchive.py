@@ -0,0 +1,149 @@
+
+import struct
+
+import numpy as np
+from pymunk.vec2d import Vec2d
+
+from timer import *
+
+
+class GenomeArchive:
+    """
+    A file of genomes in a compact binary format, that is memory-mapped
+    instead of read, so opening it takes the same time regardless of the
+    number of genomes, and single genomes can be read in any order.
+    The parameters are stored as arrays with one column per parameter
+    (struct of arrays), the genomes' nodes and muscles one after another:
+
+    header          MAGIC, VERSION, number of genomes, nodes and muscles
+    node_offsets    int64[genomes + 1], first node of each genome
+    muscle_offsets  int64[genomes + 1], first muscle of each genome
+    nodes           float64[NODE_COLUMNS][nodes]
+    muscle_nodes    int64[2][muscles], node indices within the genome
+    muscles         float64[MUSCLE_COLUMNS][muscles]
+
+    Node indices are the positions in Genome.node_types, and muscles are in
+    the order of Genome.matrix.iterate_all_muscles(). Only genomes of
+    TimerNodeTypes and TimerMuscleTypes can be stored.
+    """
+
+    MAGIC = b"EVOGENOM"
+    VERSION = 1
+
+    FILE_EXTENSION = ".genomes"
+
+    # magic, version, number of genomes, nodes, muscles
+    HEADER_FORMAT = "<8sIIqq"
+
+    NODE_COLUMNS = ["bb_x", "bb_y", "mass", "tt_start", "tt_step", "tt_true_from", "tt_false_from"]
+    MUSCLE_COLUMNS = ["max_force", "damping", "stiffness", "contract_factor", \
+        "tt_start", "tt_step", "tt_true_from", "tt_false_from"]
+
+    def __init__(self, location):
+        # Opens an existing archive, see write() for creating one.
+        self.location = location
+        self._data = np.memmap(location, dtype=np.uint8, mode="r")
+        header_size = struct.calcsize(self.HEADER_FORMAT)
+        magic, version, nb_genomes, nb_nodes, nb_muscles = struct.unpack( \
+            self.HEADER_FORMAT, self._data[:header_size].tobytes())
+        if magic != self.MAGIC:
+            raise ValueError("{} is not a genome archive".format(location))
+        if version != self.VERSION:
+            raise ValueError("{} has version {}, supported is {}".format(location, version, self.VERSION))
+        self.nb_genomes = nb_genomes
+        for name, dtype, shape, offset in self._get_layout(nb_genomes, nb_nodes, nb_muscles):
+            size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            setattr(self, "_" + name, self._data[offset:offset+size].view(dtype).reshape(shape))
+
+    @classmethod
+    def _get_layout(cls, nb_genomes, nb_nodes, nb_muscles):
+        # Returns a list of tuples (name, dtype, shape, offset) of the arrays
+        # following the header. All elements have 8 bytes, so the arrays stay
+        # aligned.
+        arrays = [
+            ("node_offsets", np.int64, (nb_genomes + 1,)),
+            ("muscle_offsets", np.int64, (nb_genomes + 1,)),
+            ("nodes", np.float64, (len(cls.NODE_COLUMNS), nb_nodes)),
+            ("muscle_nodes", np.int64, (2, nb_muscles)),
+            ("muscles", np.float64, (len(cls.MUSCLE_COLUMNS), nb_muscles)),
+        ]
+        layout = []
+        offset = struct.calcsize(cls.HEADER_FORMAT)
+        for name, dtype, shape in arrays:
+            layout.append((name, dtype, shape, offset))
+            offset += int(np.prod(shape)) * np.dtype(dtype).itemsize
+        return layout
+
+    @classmethod
+    def is_archive(cls, location):
+        # Returns whether the file starts like a genome archive, e.g. to tell
+        # it apart from generations saved as pickle.
+        f = open(location, "rb")
+        magic = f.read(len(cls.MAGIC))
+        f.close()
+        return magic == cls.MAGIC
+
+    @classmethod
+    def write(cls, location, genomes):
+        # Writes the genomes to a new archive, replacing the file if it exists.
+        # genomes (Genome[]): With TimerNodeTypes and TimerMuscleTypes
+        node_offsets, muscle_offsets = [0], [0]
+        nodes, muscle_nodes, muscles = [], [], []
+        for genome in genomes:
+            for node_type in genome.node_types:
+                tt = node_type.tt
+                nodes.append((node_type.bb_position.x, node_type.bb_position.y, node_type.mass, \
+                    tt.start, tt.step, tt.true_from, tt.false_from))
+            for muscle_type in genome.matrix.iterate_all_muscles():
+                tt = muscle_type.tt
+                muscle_nodes.append((muscle_type.node_idx_1, muscle_type.node_idx_2))
+                muscles.append((muscle_type.max_force, muscle_type.damping, muscle_type.stiffness, \
+                    muscle_type.contract_factor, tt.start, tt.step, tt.true_from, tt.false_from))
+            node_offsets.append(len(nodes))
+            muscle_offsets.append(len(muscles))
+        arrays = {
+            "node_offsets": np.array(node_offsets, dtype=np.int64),
+            "muscle_offsets": np.array(muscle_offsets, dtype=np.int64),
+            # Transposed, one row per column
+            "nodes": np.array(nodes, dtype=np.float64).reshape(-1, len(cls.NODE_COLUMNS)).T,
+            "muscle_nodes": np.array(muscle_nodes, dtype=np.int64).reshape(-1, 2).T,
+            "muscles": np.array(muscles, dtype=np.float64).reshape(-1, len(cls.MUSCLE_COLUMNS)).T,
+        }
+        f = open(location, "wb")
+        f.write(struct.pack(cls.HEADER_FORMAT, cls.MAGIC, cls.VERSION, len(genomes), len(nodes), len(muscles)))
+        for name, dtype, shape, offset in cls._get_layout(len(genomes), len(nodes), len(muscles)):
+            assert f.tell() == offset
+            f.write(np.ascontiguousarray(arrays[name], dtype=dtype).tobytes())
+        f.close()
+
+    def __len__(self):
+        return self.nb_genomes
+
+    def get_genome(self, position):
+        # Returns a new Genome with the parameters of the genome at the
+        # position, the first one is at 0.
+        if not 0 <= position < self.nb_genomes:
+            raise IndexError("genome {} of {}".format(position, self.nb_genomes))
+        genome = Genome()
+        n_start, n_end = self._node_offsets[position:position+2].tolist()
+        for idx, (x, y, mass, start, step, true_from, false_from) in \
+                enumerate(zip(*self._nodes[:, n_start:n_end].tolist())):
+            genome.node_types.append(TimerNodeType(idx, Vec2d(x, y), mass, \
+                TimerType(start, step, true_from, false_from)))
+        m_start, m_end = self._muscle_offsets[position:position+2].tolist()
+        for (idx_1, idx_2), (max_force, damping, stiffness, contract_factor, start, step, true_from, false_from) in \
+                zip(zip(*self._muscle_nodes[:, m_start:m_end].tolist()), zip(*self._muscles[:, m_start:m_end].tolist())):
+            genome.matrix.set_muscle_type(genome.node_types[idx_1], genome.node_types[idx_2], TimerMuscleType(idx_1, idx_2, \
+                max_force, damping, stiffness, contract_factor, TimerType(start, step, true_from, false_from)))
+        return genome
+
+    def iterate_genomes(self):
+        for position in range(self.nb_genomes):
+            yield self.get_genome(position)
+
+    def close(self):
+        # Genomes that were read stay valid. The file is unmapped once the
+        # arrays aren't referenced anymore.
+        for name, dtype, shape, offset in self._get_layout(0, 0, 0):
+            setattr(self, "_" + name, None)
+        self._data = None
@@ -1,15 +1,20 @@
 import random
 import math
 import copy
+import hashlib
 
 import pymunk
 from pymunk.vec2d import Vec2d
 
-from utils import stay_in_bounds
+from utils import stay_in_bounds, set_slots_state
 
 
 class NodeType:
     # There is exactly one NodeType (genotype) for each Node (phenotype).
+    # Node types may be shared by several genomes, see Genome.clone(), so
+    # only mutate copies of them.
+
+    __slots__ = ("idx", "bb_position", "mass")
 
     # When mutating, the value can be incremented/decremented by at most
     # that percentage of the diameter of the bounding box.
@@ -27,6 +32,12 @@ class NodeType:
         self.bb_position = bb_position
         self.mass = mass
 
+    def __setstate__(self, state):
+        set_slots_state(self, state)
+
+    def copy(self):
+        return NodeType(self.idx, self.bb_position, self.mass)
+
     @staticmethod
     def generate_random(idx):
         bb_pos = Vec2d(random.uniform(0, Genome.BB_WIDTH), random.uniform(0, Genome.BB_HEIGHT))
@@ -37,6 +48,12 @@ class NodeType:
         return "idx={}, mass={}, bb_pos={}".format(\
             self.idx, self.mass, self.bb_position)
 
+    def get_content(self):
+        # Returns a tuple of all values that define this node type, see
+        # Genome.get_content_hash(). Values are floats even where they were
+        # clamped to an int bound, like when read from a GenomeArchive.
+        return (self.idx, float(self.bb_position.x), float(self.bb_position.y), float(self.mass))
+
     def mutate(self):
         # Make position completely random
         if random.randint(1, 100) <= 5:
@@ -79,8 +96,12 @@ class NodeType:
 
 class MuscleType:
     # There is exactly one MuscleType (genotype) for each Muscle (phenotype).
+    # Muscle types may be shared by several genomes, see Genome.clone(), so
+    # only mutate copies of them.
     # TODO Support error_bias (non-instantaneous error correction)
 
+    __slots__ = ("node_idx_1", "node_idx_2", "max_force", "damping", "stiffness", "contract_factor")
+
     # When mutating, the value can be incremented/decremented by at most
     # that percentage of the size of the value range.
     MUTATE_RANGE_PERCENT = 15
@@ -98,21 +119,41 @@ class MuscleType:
     CONTRACT_FACTOR_MIN = 0.5
     CONTRACT_FACTOR_MAX = 1
 
-    def __init__(self, node_type_1, node_type_2, max_force, damping, stiffness, contract_factor):
+    def __init__(self, node_idx_1, node_idx_2, max_force, damping, stiffness, contract_factor):
+        # node_idx_1, node_idx_2 (int): The idx of the connected node types,
+        #   so that node types can be replaced by mutated copies
         # damping (float): How much the spring "wiggles" (smaller=more)
-        self.node_type_1 = node_type_1
-        self.node_type_2 = node_type_2
+        self.node_idx_1 = node_idx_1
+        self.node_idx_2 = node_idx_2
         self.max_force = max_force
         self.damping = damping
         self.stiffness = stiffness
         self.contract_factor = contract_factor
 
+    def __setstate__(self, state):
+        if isinstance(state, dict) and "node_type_1" in state:
+            # Pickled before muscle types only kept the idx of their node types
+            state = dict(state)
+            state["node_idx_1"] = state.pop("node_type_1").idx
+            state["node_idx_2"] = state.pop("node_type_2").idx
+        set_slots_state(self, state)
+
     @staticmethod
     def generate_random(node_type_1, node_type_2):
-        muscle_type = MuscleType(node_type_1, node_type_2, None, None, None, None)
+        muscle_type = MuscleType(node_type_1.idx, node_type_2.idx, None, None, None, None)
         muscle_type.randomize()
         return muscle_type
 
+    def copy(self):
+        return MuscleType(self.node_idx_1, self.node_idx_2, \
+            self.max_force, self.damping, self.stiffness, self.contract_factor)
+
+    def get_content(self):
+        # Returns a tuple of all values that define this muscle type, see
+        # Genome.get_content_hash().
+        return (min(self.node_idx_1, self.node_idx_2), max(self.node_idx_1, self.node_idx_2), \
+            float(self.max_force), float(self.damping), float(self.stiffness), float(self.contract_factor))
+
     def randomize(self):
         self.max_force = random.uniform(MuscleType.MAX_FORCE_MIN, MuscleType.MAX_FORCE_MAX)
         self.damping = random.uniform(MuscleType.DAMPING_MIN, MuscleType.DAMPING_MAX)
@@ -154,41 +195,123 @@ class MuscleType:
 
 
 class MuscleMatrix:
-    # This matrix has an internal dict of all muscles that exist between pairs of nodes.
-    # The value of the dict are the muscle types, the keys of the dict is a concatenation
-    # of the node indices, the smaller one first, separated by an underscore character.
+    # This matrix has an internal dict of all muscles that exist between pairs
+    # of nodes. The values of the dict are the muscle types, the keys are the
+    # positions of the node index pairs in the upper triangle of the matrix,
+    # see get_key(). Besides the dict, the keys of connected pairs are kept
+    # in a list, and, once needed, the keys of unconnected pairs too, each
+    # with a dict of their positions, so that a random pair of either kind is
+    # picked in constant time.
+
+    __slots__ = ("_data", "_keys", "_key_positions", "_free_keys", "_free_key_positions", "_free_nb_nodes")
+
+    _pairs = []     # key -> (smaller node idx, larger node idx), see get_pair()
 
     def __init__(self):
         self._data = {}
+        self._keys = []             # of connected pairs, in no particular order
+        self._key_positions = {}    # key -> position in self._keys
+        # Keys of the unconnected pairs of the first _free_nb_nodes nodes, see
+        # _update_free_keys(). None until an unconnected pair is needed.
+        self._free_keys = None
+        self._free_key_positions = None
+        self._free_nb_nodes = None
+
+    def __getstate__(self):
+        return {"_data": self._data}
+
+    def __setstate__(self, state):
+        set_slots_state(self, state)
+        data = self._data
+        self.__init__()
+        for key, muscle_type in data.items():
+            if isinstance(key, str):
+                # Pickled when the keys were strings "<smaller idx>_<larger idx>"
+                key = self.get_key(*[int(idx) for idx in key.split("_")])
+            self._add_key(key)
+            self._data[key] = muscle_type
 
     def __repr__(self):
-        return ', '.join(self._data.keys())
+        return ', '.join(["{}_{}".format(*self.get_pair(key)) for key in self._data.keys()])
+
+    def clone(self):
+        # Returns a matrix with the same muscle types, which aren't copied.
+        matrix = MuscleMatrix()
+        matrix._data = dict(self._data)
+        matrix._keys = list(self._keys)
+        matrix._key_positions = dict(self._key_positions)
+        return matrix
+
+    @staticmethod
+    def get_key(idx_1, idx_2):
+        # The pairs of nodes 0..n-1 have the keys 0..n*(n-1)/2-1, regardless
+        # of the number of nodes.
+        if idx_1 > idx_2:
+            idx_1, idx_2 = idx_2, idx_1
+        return idx_2 * (idx_2 - 1) // 2 + idx_1
+
+    @classmethod
+    def get_pair(cls, key):
+        # Returns the tuple of node indices (smaller, larger) of the key.
+        pairs = cls._pairs
+        while len(pairs) <= key:
+            idx_2 = (1 + math.isqrt(1 + 8 * len(pairs))) // 2     # of the next row
+            pairs.extend([(idx_1, idx_2) for idx_1 in range(idx_2)])
+        return pairs[key]
+
+    @staticmethod
+    def _add_to(key, keys, positions):
+        positions[key] = len(keys)
+        keys.append(key)
 
-    def _get_key(self, node_type_1, node_type_2):
-        return "{}_{}".format( \
-            min(node_type_1.idx, node_type_2.idx), \
-            max(node_type_1.idx, node_type_2.idx))
+    @staticmethod
+    def _remove_from(key, keys, positions):
+        # Moves the last key into the gap.
+        position = positions.pop(key)
+        last_key = keys.pop()
+        if last_key != key:
+            keys[position] = last_key
+            positions[last_key] = position
+
+    def _add_key(self, key):
+        self._add_to(key, self._keys, self._key_positions)
+        if self._free_key_positions is not None and key in self._free_key_positions:
+            self._remove_from(key, self._free_keys, self._free_key_positions)
+
+    def _remove_key(self, key):
+        self._remove_from(key, self._keys, self._key_positions)
+        if self._free_keys is not None and key < self.get_key(0, self._free_nb_nodes):
+            self._add_to(key, self._free_keys, self._free_key_positions)
+
+    def _update_free_keys(self, nb_nodes):
+        # Makes self._free_keys contain the unconnected pairs of nb_nodes nodes.
+        if self._free_nb_nodes == nb_nodes:
+            return
+        self._free_keys, self._free_key_positions, self._free_nb_nodes = [], {}, nb_nodes
+        for key in range(self.get_key(0, nb_nodes)):
+            if key not in self._data:
+                self._add_to(key, self._free_keys, self._free_key_positions)
 
     def get_muscle_type(self, node_type_1, node_type_2):
         # Swapping the given nodes gives the same result.
         # Returns NodeType or None if there's no muscle between the nodes.
-        key = self._get_key(node_type_1, node_type_2)
-        if key in self._data:
-            return self._data[key]
-        else:
-            return None
+        return self._data.get(self.get_key(node_type_1.idx, node_type_2.idx))
 
     def set_muscle_type(self, node_type_1, node_type_2, muscle_type):
         # Swapping the given nodes gives the same result.
         # muscle_type (MuscleType|None): The new matrix entry
         assert(node_type_1 != node_type_2)
-        key = self._get_key(node_type_1, node_type_2)
+        key = self.get_key(node_type_1.idx, node_type_2.idx)
         if muscle_type == None:
             del self._data[key]
+            self._remove_key(key)
         else:
+            if key not in self._data:
+                self._add_key(key)
             self._data[key] = muscle_type
 
     def iterate_all_muscles(self):
+        # In the order the muscles were added.
         for muscle_type in self._data.values():
             yield muscle_type
 
@@ -200,25 +323,16 @@ class MuscleMatrix:
         if self.get_count() == 0:
             return None
         else:
-            key = random.choice(list(self._data.keys()))
-            return self._data[key]
+            return self._data[random.choice(self._keys)]
 
     def get_random_unconnected_pair(self, node_types):
         # node_types (NodeType[]): All node types in the creature
         # Returns (None, None) if all possible pairs are connected by a muscle.
-        # TODO very inefficient, because we're just guessing!
-        # 
-        nb_nodes = len(node_types)
-        nb_possible_muscles = (nb_nodes * (nb_nodes - 1)) / 2
-        if self.get_count() == nb_possible_muscles:
+        self._update_free_keys(len(node_types))
+        if len(self._free_keys) == 0:
             return None, None
-        while True:
-            node_type_1 = random.choice(node_types)
-            node_type_2 = random.choice(node_types)
-            if node_type_1 == node_type_2:
-                continue
-            if self.get_muscle_type(node_type_1, node_type_2) == None:
-                return (node_type_1, node_type_2)
+        idx_1, idx_2 = self.get_pair(random.choice(self._free_keys))
+        return (node_types[idx_1], node_types[idx_2])
 
 
 class Genome:
@@ -232,9 +346,25 @@ class Genome:
     NODE_TYPE_CLASS = NodeType      # will be overwritten
     MUSCLE_TYPE_CLASS = MuscleType  # will be overwritten
 
+    __slots__ = ("node_types", "matrix", "parent_hash")
+
     def __init__(self):
         self.node_types = [] # List position and node's idx must match for every node
         self.matrix = MuscleMatrix()
+        self.parent_hash = None # content hash of the genome this one is a mutation of
+
+    def __setstate__(self, state):
+        self.parent_hash = None     # missing in genomes pickled before it existed
+        set_slots_state(self, state)
+
+    def clone(self):
+        # Returns a genome that shares the node types and muscle types with
+        # this one. They are copied when mutate() changes them (copy on
+        # write), so clones are cheap and use little memory.
+        genome = Genome()
+        genome.node_types = list(self.node_types)
+        genome.matrix = self.matrix.clone()
+        return genome
 
     @staticmethod
     def generate_random(percentage_muscles_min, percentage_muscles_max):
@@ -248,46 +378,64 @@ class Genome:
             genome.node_types.append(node_type)
 
         # Create muscles
-        # TODO inefficient for many muscles because guessing not-yet connected pairs
         nb_possible_muscles = (nb_nodes * (nb_nodes - 1)) / 2
         nb_muscles = int(nb_possible_muscles * random.randint(percentage_muscles_min, percentage_muscles_max) / 100)
         while genome.matrix.get_count() < nb_muscles:
-            node_type_1 = random.choice(genome.node_types)
-            node_type_2 = random.choice(genome.node_types)
-            if node_type_1 == node_type_2:
-                continue
-            if genome.matrix.get_muscle_type(node_type_1, node_type_2) == None:
-                muscle = Genome.MUSCLE_TYPE_CLASS.generate_random(node_type_1, node_type_2)
-                genome.matrix.set_muscle_type(node_type_1, node_type_2, muscle)
+            node_type_1, node_type_2 = genome.matrix.get_random_unconnected_pair(genome.node_types)
+            muscle = Genome.MUSCLE_TYPE_CLASS.generate_random(node_type_1, node_type_2)
+            genome.matrix.set_muscle_type(node_type_1, node_type_2, muscle)
 
         return genome
 
+    def get_content_hash(self):
+        # Returns a hex string that is the same for genomes with the same
+        # node types, muscle types and their parameters, regardless of object
+        # identity, e.g. for an unchanged copy of a genome.
+        node_contents = [node_type.get_content() for node_type in self.node_types]
+        muscle_contents = sorted([muscle_type.get_content() \
+            for muscle_type in self.matrix.iterate_all_muscles()])
+        # The repr of floats is exact
+        content = repr((type(self).__name__, node_contents, muscle_contents))
+        return hashlib.sha256(content.encode()).hexdigest()
+
     def mutate(self):
         # TODO: Creating/Cloning and deleting nodes, but that requires keeping their idx
         # in sync with the muscle matrix, maybe make idx management more clean first...
 
+        # Node types and muscle types may be shared with other genomes, so
+        # mutated ones are replaced by copies, see clone()
+
         # Mutate some node types
-        for node_type in self.node_types:
+        for idx, node_type in enumerate(self.node_types):
             if random.randint(1, 10) <= 4:
+                node_type = node_type.copy()
                 node_type.mutate()
+                self.node_types[idx] = node_type
 
         # Mutate some muscle types
         scale_all_timers = random.randint(1, 10) <= 1
         if scale_all_timers:
             factor = random.uniform(0.5, 1.5)
-            for muscle_type in self.matrix.iterate_all_muscles():
+        all_muscle_types = list(self.matrix.iterate_all_muscles())
+        for i, muscle_type in enumerate(all_muscle_types):
+            if not scale_all_timers and random.randint(1, 10) > 6:
+                continue
+            muscle_type = muscle_type.copy()
+            # Muscle types may copy the parameters of this one when mutating
+            all_muscle_types[i] = muscle_type
+            if scale_all_timers:
                 muscle_type.scale_timer_step(factor)
-        else:
-            all_muscle_types = list(self.matrix.iterate_all_muscles())
-            for muscle_type in self.matrix.iterate_all_muscles():
-                if random.randint(1, 10) <= 6:
-                    muscle_type.mutate(all_muscle_types)
+            else:
+                muscle_type.mutate(all_muscle_types)
+            self.matrix.set_muscle_type(self.node_types[muscle_type.node_idx_1], \
+                self.node_types[muscle_type.node_idx_2], muscle_type)
 
         # Delete some muscle types
         if random.randint(1, 100) <= 5:
             muscle = self.matrix.get_random_muscle()
             if muscle != None:
-                self.matrix.set_muscle_type(muscle.node_type_1, muscle.node_type_2, None)
+                self.matrix.set_muscle_type(self.node_types[muscle.node_idx_1], \
+                    self.node_types[muscle.node_idx_2], None)
 
         # Create a muscle type
         if random.randint(1, 100) <= 5:
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+
+# Runs the evolution without any user interface, e.g. on machines without a
+# display. Uses the same core as the pygame UI (see evolution.py), but never
+# imports pygame. Can be used from the command line or as a library.
+
+import sys
+import argparse
+import pathos
+
+from evolution import *
+
+
+SIMULATION_CLASSES = {
+    "hopper": SimulationHopper,
+    "climber": SimulationClimber,
+}
+
+# (host, port) to listen on for workers to evaluate with (see worker.py),
+# instead of starting worker processes, None for local worker processes
+DISTRIBUTED_ADDRESS = None
+DISTRIBUTED_AUTHKEY = DEFAULT_AUTHKEY
+
+TIMER_ENGINE_CLASSES = {
+    "objects": None,
+    "vector": VectorTimerEngine,
+    "scheduled": ScheduledTimerEngine,
+}
+
+
+# ---------------------------------------------------------------------------
+
+def _evaluate_generation(generation, simulation_class, max_ticks, fidelity, pool, scheduler, \
+        terrain_seed, fitness_cache):
+    # Returns a FinishedGeneration. Runs in-process if no pool is given.
+    # Only the genomes not in the fitness cache or its store are simulated.
+    generate_ground(generation, simulation_class, terrain_seed)
+    environment = FitnessCache.get_environment(generation.ground, simulation_class, max_ticks, fidelity)
+    cached_results, missing = fitness_cache.get_results(generation, environment)
+    utilization = None
+    if len(missing.genomes) == 0:
+        results = []
+    elif pool is None:
+        results = simulate(missing, simulation_class, max_ticks, fidelity, fitness_cache.store)
+    else:
+        batches = scheduler.make_batches(missing)
+        jobs = [pool.apipe(simulate, batch, simulation_class, max_ticks, fidelity, fitness_cache.store) \
+            for batch in batches]
+        batch_results = [job.get() for job in jobs]
+        utilization = scheduler.finish_generation(batches, batch_results)
+        results = [result for results in batch_results for result in results]
+    results = fitness_cache.complete_results(generation, environment, cached_results + results)
+    return FinishedGeneration(generation, results, utilization, \
+        len(generation.genomes) - len(missing.genomes))
+
+def _reproduce_and_evaluate(plan, simulation_class, max_ticks, fidelity, pool, scheduler, \
+        terrain_seed, fitness_cache):
+    # Like _evaluate_generation(), but the worker processes make the genomes
+    # of the plan before simulating them. Makes them in-process if no pool
+    # is given.
+    if pool is None:
+        return _evaluate_generation(plan.make_generation(), simulation_class, max_ticks, fidelity, \
+            pool, scheduler, terrain_seed, fitness_cache)
+    generate_ground(plan, simulation_class, terrain_seed)
+    environment = FitnessCache.get_environment(plan.ground, simulation_class, max_ticks, fidelity)
+    fitness_cache.add_known_results(plan, environment)
+    batches = scheduler.make_batches(plan, plan.estimate_costs(scheduler.cost_model))
+    jobs = [pool.apipe(reproduce_and_simulate, batch, simulation_class, max_ticks, fidelity, \
+        fitness_cache.store) for batch in batches]
+    generation, results, batch_generations, batch_results, nb_cached = \
+        assemble_generation(plan, batches, [job.get() for job in jobs])
+    utilization = scheduler.finish_generation(batch_generations, batch_results)
+    # Keep the results for genomes that are evaluated again in-process
+    results = fitness_cache.complete_results(generation, environment, results)
+    return FinishedGeneration(generation, results, utilization, nb_cached)
+
+def _get_ticks(standard_ticks, fidelity):
+    return standard_ticks if fidelity is None else fidelity.get_ticks(standard_ticks)
+
+def _open_pool(workers):
+    # Returns None if evaluation shall be done in-process.
+    if DISTRIBUTED_ADDRESS is not None:
+        # The workers can connect at any time, and get the settings of the run
+        pool = DistributedPool(DISTRIBUTED_ADDRESS, DISTRIBUTED_AUTHKEY, configure_process, \
+            (get_settings(), SimulationHopper.TIMER_ENGINE_CLASS))
+        print("Waiting for workers on {}:{}".format(*pool.address))
+        return pool
+    if workers <= 1:
+        return None
+    return pathos.pools.ProcessPool(ncpus=workers)
+
+def _close_pool(pool):
+    if pool is not None:
+        pool.close()
+        pool.join()
+        pool.clear()
+
+def evaluate_genomes(genomes, simulation_class=SimulationHopper, \
+        max_ticks=SIMULATION_TICKS, workers=MAX_WORKERS, generation_idx=1, fidelity=None, \
+        terrain_seed=None, evaluation_store=None):
+    # Simulates the specified genomes and returns a FinishedGeneration,
+    # whose ranked_genomes is a list of tuples (fitness, genome), best first.
+    # genomes (Genome[]): The genomes to evaluate
+    # simulation_class (class): SimulationHopper or SimulationClimber
+    # max_ticks (int): Number of ticks to simulate each genome for, in ticks of
+    #   the standard timestep, is converted to ticks of the fidelity profile
+    # workers (int): Number of worker processes, 1 to evaluate in-process
+    # fidelity (FidelityProfile|None): Physics settings, see FIDELITY_PROFILES
+    # terrain_seed (int|None): Seed of the terrain, see generate_ground()
+    # evaluation_store (EvaluationStore|None): Where to look up the genomes
+    #   before simulating them, and to store the results of simulating them
+    generation = Generation(generation_idx, list(genomes))
+    pool = _open_pool(workers)
+    try:
+        return _evaluate_generation(generation, simulation_class, \
+            _get_ticks(max_ticks, fidelity), fidelity, pool, BatchScheduler(workers), terrain_seed, \
+            FitnessCache(store=evaluation_store))
+    finally:
+        _close_pool(pool)
+
+def run_evolution(nb_generations, initial_generation=None, simulation_class=SimulationHopper, \
+        max_ticks=SIMULATION_TICKS, workers=MAX_WORKERS, callback=None, fidelity=None, \
+        terrain_seed=None, evaluation_store=None, checkpoint=None):
+    # Evolves nb_generations generations and returns the list of
+    # FinishedGeneration instances, oldest first.
+    # initial_generation (Generation|ReproductionPlan|None): Where to start, a
+    #   random generation is created if None
+    # max_ticks, fidelity, evaluation_store: See evaluate_genomes()
+    # terrain_seed (int|None): Seed of the terrain of every generation,
+    #   TERRAIN_SEED if None
+    # callback (function|None): Invoked with each FinishedGeneration as soon as
+    #   it is done, e.g. to print or save it
+    # checkpoint (Checkpoint|None): Where to record the run, see resume_run()
+    settings = get_run_settings(simulation_class, max_ticks, fidelity, terrain_seed)
+    generation = initial_generation if initial_generation is not None \
+        else make_initial_generation()
+    finished_generations = []
+    pool = _open_pool(workers)
+    scheduler = BatchScheduler(workers)     # calibrates itself over the generations
+    fitness_cache = FitnessCache(store=evaluation_store)
+    try:
+        for i in range(nb_generations):
+            evaluate = _reproduce_and_evaluate if isinstance(generation, ReproductionPlan) \
+                else _evaluate_generation
+            fg = evaluate(generation, simulation_class, \
+                _get_ticks(max_ticks, fidelity), fidelity, pool, scheduler, terrain_seed, fitness_cache)
+            finished_generations.append(fg)
+            if callback is not None:
+                callback(fg)
+            generation = reproduce(fg, pool is not None)
+            if checkpoint is not None:
+                checkpoint.add_generation(fg, generation, settings)
+    finally:
+        _close_pool(pool)
+    return finished_generations
+
+def run_islands(nb_generations, nb_islands, initial_generation=None, simulation_class=SimulationHopper, \
+        max_ticks=SIMULATION_TICKS, workers=MAX_WORKERS, callback=None, fidelity=None, \
+        terrain_seed=None, evaluation_store=None):
+    # Like run_evolution(), but evolves nb_islands islands of ISLAND_SIZE
+    # genomes in parallel, one job per island and epoch of MIGRATION_INTERVAL
+    # generations, see IslandModel. Returns the list of
+    # IslandGenerationSummary instances, oldest first.
+    model = start_islands(initial_generation if initial_generation is not None \
+        else make_initial_generation(), nb_islands)
+    summaries = []
+    pool = _open_pool(workers)
+    try:
+        while len(summaries) < nb_generations:
+            nb_epoch_generations = min(MIGRATION_INTERVAL, nb_generations - len(summaries))
+            args = [(island, nb_epoch_generations, immigrants, simulation_class, _get_ticks(max_ticks, fidelity), \
+                fidelity, evaluation_store, terrain_seed) for island, immigrants in zip(model.islands, model.immigrants)]
+            if pool is None:
+                outputs = [evolve_island(*island_args) for island_args in args]
+            else:
+                jobs = [pool.apipe(evolve_island, *island_args) for island_args in args]
+                outputs = [job.get() for job in jobs]
+            for summary in model.finish_epoch(outputs):
+                summaries.append(summary)
+                if callback is not None:
+                    callback(summary)
+    finally:
+        _close_pool(pool)
+    return summaries
+
+def resume_run(nb_generations, directory=None, workers=MAX_WORKERS, callback=None, \
+        evaluation_store=None):
+    # Continues a run of run_evolution() from its checkpoint, for another
+    # nb_generations generations, with the settings of that run.
+    # directory (str|None): See resume_checkpoint()
+    checkpoint, state = resume_checkpoint(directory)
+    settings = state.settings
+    try:
+        return run_evolution(nb_generations, state.next_generation, settings["simulation_class"], \
+            settings["max_ticks"], workers, callback, settings["fidelity"], settings["terrain_seed"], \
+            evaluation_store, checkpoint)
+    finally:
+        checkpoint.close()
+
+
+# ---------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the evolution without user interface.")
+    parser.add_argument("-load", metavar="LOCATION",
+        help="Start with the genomes of a saved generation instead of random ones")
+    parser.add_argument("-environment", choices=SIMULATION_CLASSES.keys(), default="hopper",
+        help="Which simulation to evaluate the creatures in")
+    parser.add_argument("-generations", type=int, default=100,
+        help="Number of generations to evolve")
+    parser.add_argument("-ticks", type=int, default=SIMULATION_TICKS,
+        help="Number of ticks to simulate each generation for, at the standard timestep")
+    parser.add_argument("-workers", type=int, default=MAX_WORKERS,
+        help="Number of worker processes, 1 to simulate in-process")
+    parser.add_argument("-listen", metavar="HOST:PORT",
+        help="Evaluate with workers that connect to this address (see worker.py) instead of local "
+            "worker processes, -workers is then the number of workers to plan for")
+    parser.add_argument("-authkey",
+        help="Key that the workers must know to connect, a random one is printed if not given and "
+            "-listen isn't a loopback address")
+    parser.add_argument("-timers", choices=TIMER_ENGINE_CLASSES.keys(), default="vector",
+        help="How to advance the timers of the creatures each tick")
+    parser.add_argument("-fidelity", choices=FIDELITY_PROFILES.keys(),
+        help="Physics settings, the simulation's own if not given")
+    parser.add_argument("-terrain", type=int, metavar="SEED",
+        help="Seed of the terrain of every generation, a new one each generation if not given")
+    parser.add_argument("-store", metavar="LOCATION", default=EVALUATION_STORE_LOCATION,
+        help="Database of evaluated genomes to skip simulating, shared across runs")
+    parser.add_argument("-nostore", action="store_true",
+        help="Simulate all genomes, without using the database")
+    parser.add_argument("-resume", metavar="DIRECTORY", nargs="?", const="",
+        help="Continue a recorded run with its settings, the most recent one if no directory is given")
+    parser.add_argument("-nocheckpoint", action="store_true",
+        help="Don't record the run, so it can't be resumed")
+    parser.add_argument("-islands", type=int, default=ISLANDS,
+        help="Number of islands to evolve in parallel, 0 to evolve one population")
+    parser.add_argument("-save", action="store_true",
+        help="Save the genomes of the last generation when done")
+    args = parser.parse_args()
+
+    global DISTRIBUTED_ADDRESS, DISTRIBUTED_AUTHKEY
+    if args.listen is not None:
+        DISTRIBUTED_ADDRESS = parse_address(args.listen)
+        DISTRIBUTED_AUTHKEY = get_listen_authkey(DISTRIBUTED_ADDRESS[0], \
+            None if args.authkey is None else args.authkey.encode())
+        if args.authkey is None and DISTRIBUTED_AUTHKEY != DEFAULT_AUTHKEY:
+            print("Workers must connect with -authkey {}".format(DISTRIBUTED_AUTHKEY.decode()))
+
+    initial_generation = load(args.load) if args.load is not None else None
+    simulation_class = SIMULATION_CLASSES[args.environment]
+    for cls in SIMULATION_CLASSES.values():     # a resumed run may use another one
+        cls.TIMER_ENGINE_CLASS = TIMER_ENGINE_CLASSES[args.timers]
+    evaluation_store = None if args.nostore else open_evaluation_store(args.store)
+
+    def on_generation_finished(fg):
+        on_generation_finished.count += 1
+        if args.islands > 0:
+            print_island_stats(fg, on_generation_finished.count)
+        else:
+            print_generation_stats(fg, on_generation_finished.count)
+    on_generation_finished.count = 0
+
+    checkpoint = None
+    try:
+        if args.resume is not None and args.islands > 0:
+            parser.error("island runs can't be resumed")
+        elif args.islands > 0:
+            finished_generations = run_islands(args.generations, args.islands, initial_generation, \
+                simulation_class, args.ticks, args.workers, on_generation_finished, \
+                FIDELITY_PROFILES.get(args.fidelity), args.terrain, evaluation_store)
+        elif args.resume is not None:
+            finished_generations = resume_run(args.generations, args.resume or None, \
+                args.workers, on_generation_finished, evaluation_store)
+        else:
+            checkpoint = None if args.nocheckpoint else create_checkpoint()
+            finished_generations = run_evolution(args.generations, initial_generation, \
+                simulation_class, args.ticks, args.workers, on_generation_finished, \
+                FIDELITY_PROFILES.get(args.fidelity), args.terrain, evaluation_store, checkpoint)
+    except KeyboardInterrupt:
+        sys.exit(0)
+    finally:
+        if evaluation_store is not None:
+            evaluation_store.close()
+        if checkpoint is not None:
+            checkpoint.close()
+
+    if args.save and len(finished_generations) > 0:
+        fg = finished_generations[-1]
+        fitness_min, fitness_avg, fitness_max = fg.get_stats()
+        save(fg.genomes, fitness_avg, fitness_max)
+
+
+if __name__ == "__main__":
+    main()
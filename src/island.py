@@ -0,0 +1,116 @@
+
+import random
+
+from generation import *
+
+
+class Island:
+    """
+    A population that evolves on its own in a worker process, see
+    evolve_island() in evolution.py. Is sent to a worker for every epoch of
+    generations and back, with its random state, so that an island evolves
+    the same regardless of which worker it lands on.
+    """
+
+    def __init__(self, idx, generation, seed, nb_survivors, nb_randoms):
+        # idx (int): Position of the island in its IslandModel
+        # generation (Generation): The first one to evaluate, its size is the
+        #   size of the island's generations
+        # seed (int): Of the island's random draws
+        # nb_survivors, nb_randoms (int): Like SURVIVORS_PER_GENERATION and
+        #   RANDOMS_PER_GENERATION, for the island's generations
+        self.idx = idx
+        self.next_generation = generation
+        self.generation_size = len(generation.genomes)
+        self.nb_survivors = nb_survivors
+        self.nb_randoms = nb_randoms
+        self.random_state = random.Random(seed).getstate()
+
+
+class IslandGenerationSummary:
+    # Statistics of a generation of all islands. Can be used in place of a
+    # FinishedGeneration for charts.
+
+    def __init__(self, idx, island_summaries, genomes=None):
+        # island_summaries (GenerationSummary[]): Of each island
+        # genomes (Genome[]|None): The best genomes of each island, only of
+        #   the last generation of an epoch
+        self.idx = idx
+        self.island_summaries = island_summaries
+        self.genomes = [] if genomes is None else genomes
+
+    def get_stats(self):
+        stats = [summary.get_stats() for summary in self.island_summaries]
+        if len(stats) == 0:
+            return 0, 0, 0
+        return min([s[0] for s in stats]), int(sum([s[1] for s in stats]) / len(stats)), max([s[2] for s in stats])
+
+
+class IslandModel:
+    """
+    Evolves several islands in parallel, in epochs of a number of
+    generations. After each epoch, the best genomes of each island migrate to
+    the islands it's connected to. The main process only routes the migrants
+    and gathers the statistics, see finish_epoch().
+    """
+
+    # How the islands are connected:
+    # ring: Each island sends its migrants to the next one
+    # all: Each island sends its migrants to all others
+    # random: Each island sends its migrants to another random one each epoch
+    TOPOLOGIES = ("ring", "all", "random")
+
+    def __init__(self, initial_generation, nb_islands, island_size, nb_survivors, nb_randoms, \
+            nb_migrants, topology="ring"):
+        # initial_generation (Generation): Its genomes are dealt to the
+        #   islands, which are filled up with random genomes
+        # island_size (int): Number of genomes per island and generation
+        # nb_survivors, nb_randoms (int): See Island
+        # nb_migrants (int): Number of the best genomes of each island to send
+        #   to each connected island after each epoch
+        # topology (str): One of TOPOLOGIES
+        if topology not in self.TOPOLOGIES:
+            raise ValueError("Unknown migration topology {}".format(topology))
+        self.nb_migrants = nb_migrants
+        self.topology = topology
+        self.islands = []
+        for idx in range(nb_islands):
+            genomes = initial_generation.genomes[idx::nb_islands][0:island_size]
+            generation = Generation(initial_generation.idx, genomes)
+            generation.add_random_genomes(island_size - len(generation.genomes))
+            self.islands.append(Island(idx, generation, random.getrandbits(64), nb_survivors, nb_randoms))
+        # The genomes that each island receives at the start of the next epoch
+        self.immigrants = [[] for island in self.islands]
+
+    def get_targets(self, idx):
+        # Returns the positions of the islands that the specified island
+        # sends its migrants to.
+        nb_islands = len(self.islands)
+        if nb_islands < 2:
+            return []
+        if self.topology == "ring":
+            return [(idx + 1) % nb_islands]
+        if self.topology == "all":
+            return [target for target in range(nb_islands) if target != idx]
+        return [random.choice([target for target in range(nb_islands) if target != idx])]
+
+    def finish_epoch(self, outputs):
+        # Takes the islands back from the workers, and routes the migrants.
+        # Returns an IslandGenerationSummary for each generation of the epoch.
+        # outputs (tuple[]): What evolve_island() returned for each island
+        immigrants = [[] for island in self.islands]
+        for island, summaries, best_genomes in outputs:
+            self.islands[island.idx] = island
+            for target in self.get_targets(island.idx):
+                immigrants[target] += best_genomes[0:self.nb_migrants]
+        # Immigrants may take at most half of an island's places
+        self.immigrants = [genomes[0:island.generation_size // 2] \
+            for island, genomes in zip(self.islands, immigrants)]
+
+        generation_summaries = []
+        for generation_position in range(len(outputs[0][1])):
+            island_summaries = [summaries[generation_position] for island, summaries, best_genomes in outputs]
+            generation_summaries.append(IslandGenerationSummary(island_summaries[0].idx, island_summaries))
+        generation_summaries[-1].genomes = [genome for island, summaries, best_genomes in outputs \
+            for genome in best_genomes]
+        return generation_summaries
@@ -10,22 +10,16 @@
 # Aufteilung die dann für M Generationen simulieren (z.B. M=10), dann drei Mutationen der besten Konfiguration
 # als neue Generation von Konfigurationen
 
-import sys, random, copy, os
+import sys, copy, os, time, queue, asyncio
 import pygame
 import pymunk
 import pymunk.pygame_util
-import pickle
-import datetime
 import pathos
 
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 
-from simulation import *
-from simulationClimber import *
-from simulationHopper import *
-from genotype import *
-from timer import *
-from generation import *
+from evolution import *
 from drawing import *
 from lineChart import *
 
@@ -34,62 +28,6 @@ from lineChart import *
 #random.seed(1)
 
 
-MAX_WORKERS = 6
-SIMULATION_TICKS = 7000
-GENERATION_SIZE = 140
-SURVIVORS_PER_GENERATION = 20
-RANDOMS_PER_GENERATION = 5
-GUARANTEE_CHAMPION_SURVIVAL_CHANCE = 0.95
-
-# Overwrites:
-# GUARANTEE_CHAMPION_SURVIVAL_CHANCE
-# RANDOMS_PER_GENERATION
-# GENERATION_SIZE
-# SIMULATION_TICKS
-# To visualize the mutation factors with super-quick one-creature generations
-MUTATION_FACTORS_VISUALIZATION_MODE = False
-
-
-# ---------------------------------------------------------------------------
-
-if MUTATION_FACTORS_VISUALIZATION_MODE:
-    GENERATION_SIZE = 1
-    SIMULATION_TICKS = 50
-    RANDOMS_PER_GENERATION = 0
-
-SAVE_DIRECTORY = "./saved_generations/"
-
-
-# ---------------------------------------------------------------------------
-
-def save(genomes, fitness_avg, fitness_max):
-    filename = "{}_avg_{}_best_{}.pickle".format( \
-        datetime.now().strftime("%Y-%m-%d_%H_%M_%S"), \
-        fitness_avg, fitness_max)
-    location = SAVE_DIRECTORY + filename
-    f = open(location, 'wb')
-    p = pickle.Pickler(f)
-    p.dump(len(genomes))
-    for genome in genomes:
-        p.dump(genome)
-    f.close()
-    print("Generation saved as {}".format(location))
-
-def load(location):
-    # Note: Loaded generation may be larger or smaller than GENERATION_SIZE.
-    # Returns a generation of the loaded genomes.
-    global genomes
-    f = open(location, 'rb')
-    up = pickle.Unpickler(f)
-    nb_genomes = up.load()
-    gen = Generation(1, [])
-    for i in range(nb_genomes):
-        genome = up.load()
-        gen.add_genome(genome)
-    print("Loaded {} genomes".format(nb_genomes))
-    return gen
-
-
 # ---------------------------------------------------------------------------
 
 class UI(ABC):
@@ -98,7 +36,8 @@ class UI(ABC):
         self.game = game
 
     def update(self):
-        # General UI update method, shall be invoked each frame, regardless of current mode.
+        # General UI update method, shall be invoked each frame, regardless of current mode,
+        # see Game.FRAME_RATE.
         # Handles mode switching, flips buffers and clears screen, so you're ready to render.
 
         # Events
@@ -125,7 +64,7 @@ class UI(ABC):
         # text (str): What to say
         # pos (int, int): Position of the text
         # center (bool): Treat pos as desired center rather than top left
-        surface, rect = self.game.font.render(text, (255,255,255))
+        surface, rect = self.game.render_text(text)
         if center:
             pos = (pos[0] - rect.w/2, pos[1] - rect.h/2)
         self.game.screen.blit(surface, pos, None)
@@ -191,23 +130,25 @@ class UIMenu(UI):
                 self.game.is_simulation_running = not self.game.is_simulation_running
             if event.key == pygame.K_s:
                 self.game.save_pending = True
-            if event.key == pygame.K_w:
-                # We can only display sequential generations. So remember to make the
-                # next one sequential, to display it.
-                self.game.next_generation_sequential = True
+            if event.key == pygame.K_w and self.game.steady_state is None and self.game.islands is None:
+                # The generation in progress has no live feed, so the next one
+                # will be the first to watch
+                self.game.watch_requested = True
             if event.key == pygame.K_e:
                 self.game.set_mode(Game.MODE_EDIT)
+            if event.key == pygame.K_r:
+                self.game.request_replay()
 
     def _update(self):
         self._last_percent_done = self._cur_percent_done
-        if self.game.sequential_sim is None:
-            self._cur_percent_done = 0 if self.game.jobs is None else \
-                int(self.game.count_jobs_done() / len(self.game.jobs) * 100)
+        if self.game.steady_state is not None:
+            self._cur_percent_done = self.game.steady_state.get_percent_done()
         else:
-            self._cur_percent_done = self.game.sequential_sim.get_percent_done()
+            self._cur_percent_done = 0 if not self.game.jobs else \
+                int(self.game.count_jobs_done() / len(self.game.jobs) * 100)
 
-        # The sequential generation requested earlier is there, switch to watch mode now.
-        if self.game.next_generation_sequential and self.game.sequential_sim is not None \
+        # The live feed requested earlier is there, switch to watch mode now.
+        if self.game.watch_requested and self.game.snapshot is not None \
             and self.game.mode != Game.MODE_WATCH:
             self.game.set_mode(Game.MODE_WATCH)
 
@@ -220,13 +161,20 @@ class UIMenu(UI):
         else:
             text = "[p] Continue simulation"
         self._draw_text(text, (self.game.SCREEN_WIDTH/2, self.game.SCREEN_HEIGHT/4-40), True)
-        pending_text = " (Pending...)" if self.game.next_generation_sequential else ""
+        pending_text = " (Pending...)" if self.game.watch_requested else ""
+        if self.game.steady_state is not None or self.game.islands is not None:
+            pending_text = " (Unavailable in this mode)"
         self._draw_text("[w] Watch generation{}".format(pending_text),
             (self.game.SCREEN_WIDTH/2, self.game.SCREEN_HEIGHT/4-0), True)
         pending_text = " (Pending...)" if self.game.save_pending else ""
         self._draw_text("[s] Save genomes{}".format(pending_text),
             (self.game.SCREEN_WIDTH/2, self.game.SCREEN_HEIGHT/4+40), True)
         self._draw_text("[e] Edit genome", (self.game.SCREEN_WIDTH/2, self.game.SCREEN_HEIGHT/4+80), True)
+        pending_text = " (Recording...)" if self.game.recording_job is not None else ""
+        if not self.game.can_replay():
+            pending_text = " (Unavailable in this mode)"
+        self._draw_text("[r] Replay best of last generation{}".format(pending_text),
+            (self.game.SCREEN_WIDTH/2, self.game.SCREEN_HEIGHT/4+120), True)
 
         # Prepare datasets
         datasets = [
@@ -242,7 +190,9 @@ class UIMenu(UI):
         # Render simulation info
         self.linechart.set_datasets(datasets)
         self.linechart.render()
-        generation_number = self.game.cur_generation.idx \
+        generation_number = self.game.steady_state.idx \
+            if self.game.steady_state is not None \
+            else self.game.cur_generation.idx \
             if self.game.cur_generation is not None \
             else 0 if len(self.game.old_generations) == 0 \
                 else self.game.old_generations[-1].idx
@@ -303,16 +253,29 @@ class UIGame(UI):
 
 
 class UIWatch(UIGame):
+    # Shows the live feed of the current generation, see Game.snapshot, or
+    # plays back the game's trajectory if it has one, see
+    # Game.request_replay(). Nothing is simulated in the main process.
+
+    # Playback speeds, in ticks per frame
+    REPLAY_SPEEDS = (0.25, 0.5, 1, 2, 4, 8, 16)
+    # Seconds of simulated time to skip per seek
+    REPLAY_SEEK_SECONDS = 5
 
     def __init__(self, game):
         super().__init__(game)
         self._show_only_best = False
-        self._show_specs = False
         self._is_paused = False
+        self._snapshot = None       # the one shown, kept while paused
+        self._snapshot_ground = None
+        self._replay_tick = 0.0
+        self._replay_speed_idx = self.REPLAY_SPEEDS.index(1)
 
     def _on_escape(self):
-        if not MUTATION_FACTORS_VISUALIZATION_MODE:
-            self.game.next_generation_sequential = False
+        if self.game.trajectory is not None:
+            self.game.close_replay()
+        elif not MUTATION_FACTORS_VISUALIZATION_MODE:
+            self.game.watch_requested = False
         self.game.set_mode(Game.MODE_MENU)
 
     def _needs_redraw(self):
@@ -322,55 +285,100 @@ class UIWatch(UIGame):
         if event.type == pygame.KEYDOWN:
             if event.key == pygame.K_b:
                 self._show_only_best = not self._show_only_best
-            if event.key == pygame.K_i:
-                self._show_specs = not self._show_specs
             if event.key == pygame.K_p:
                 self._is_paused = not self._is_paused
             if event.key == pygame.K_s:
                 self.game.save_pending = True
+            if self.game.trajectory is not None:
+                self._process_replay_event(event)
+
+    def _process_replay_event(self, event):
+        trajectory = self.game.trajectory
+        if event.key in (pygame.K_PLUS, pygame.K_EQUALS, pygame.K_KP_PLUS):
+            self._replay_speed_idx = min(self._replay_speed_idx + 1, len(self.REPLAY_SPEEDS) - 1)
+        if event.key in (pygame.K_MINUS, pygame.K_KP_MINUS):
+            self._replay_speed_idx = max(self._replay_speed_idx - 1, 0)
+        seek_ticks = self.REPLAY_SEEK_SECONDS / trajectory.timestep
+        if event.key == pygame.K_LEFTBRACKET:
+            self._replay_tick -= seek_ticks
+        if event.key == pygame.K_RIGHTBRACKET:
+            self._replay_tick += seek_ticks
+        if pygame.K_0 <= event.key <= pygame.K_9:
+            self._replay_tick = (event.key - pygame.K_0) / 10 * trajectory.nb_ticks
+        self._replay_tick = min(max(self._replay_tick, 0), trajectory.nb_ticks - 1)
 
     def _update(self):
-        pass
+        if self._is_paused:
+            return
+        if self.game.trajectory is not None:
+            self._replay_tick = min(self._replay_tick + self.REPLAY_SPEEDS[self._replay_speed_idx], \
+                self.game.trajectory.nb_ticks - 1)
+        else:
+            self._snapshot, self._snapshot_ground = self.game.snapshot, self.game.snapshot_ground
 
     def _render(self):
         self._screen_flip_fill()
         self._update_camera()
 
-        if self.game.sequential_sim is None:
-            return
-        self.game.sequential_sim.evaluate()
-
-        # Determine best creature, if needed
-        if self._show_only_best:
-            best_creature = self.game.sequential_sim.ranked_creatures[0][1]
+        if self.game.trajectory is not None:
+            self._render_replay()
+        elif self._snapshot is not None:
+            self._render_live()
         else:
-            best_creature = None
+            self._draw_text("Waiting for the live feed...", (self.game.SCREEN_WIDTH/2, self.game.SCREEN_HEIGHT/2))
+
+    def _render_live(self):
+        # The snapshot is of the creatures of all batches of the generation,
+        # which the workers stream while simulating them, see
+        # Game._receive_snapshots().
+        snapshot = self._snapshot
+        visible = [idx for idx in range(snapshot.nb_creatures) if not snapshot.culled[idx]]
+        best_idx = max(visible, key=lambda idx: snapshot.fitnesses[idx], default=None)
+        self.drawing.draw_ground_points(self._snapshot_ground)
+        self._render_creatures(snapshot, snapshot.positions, snapshot.sticky, snapshot.contracted, \
+            [best_idx] if self._show_only_best and best_idx is not None else visible)
 
-        # Render pymunk objects
-        self.drawing.draw_ground(self.game.sequential_sim.segments)
-        if self._show_only_best and best_creature is not None:
-            self.drawing.draw_creature(best_creature, self._show_specs)
-        else:
-            for creature in self.game.sequential_sim.creatures:
-                self.drawing.draw_creature(creature, self._show_specs)
+        # Render info text
+        info_text_str = "Generation #{}, {:>3}% done, best score: {}".format(snapshot.generation_idx, \
+            snapshot.get_percent_done(), 0 if best_idx is None else int(snapshot.fitnesses[best_idx]))
+        info_text, _ = self.game.render_text(info_text_str)
+        self.game.screen.blit(info_text, (5,5), None)
+
+        # Render controls text
+        controls_text_str = "[b] Show only best, [p] Pause"
+        controls_text, _ = self.game.render_text(controls_text_str)
+        self.game.screen.blit(controls_text, (self.game.SCREEN_WIDTH-5-controls_text.get_width(),5), None)
+
+    def _render_replay(self):
+        # Reads the current tick of the trajectory, nothing is simulated.
+        trajectory = self.game.trajectory
+        tick = int(self._replay_tick)
+        positions, sticky, contracted = trajectory.get_frame(tick)
+        best_idx = int(trajectory.fitnesses.argmax())
+        self.drawing.draw_ground_points(trajectory.ground)
+        self._render_creatures(trajectory, positions, sticky, contracted, [idx for idx \
+            in range(trajectory.nb_creatures) if not trajectory.is_culled(idx, tick) \
+            and (not self._show_only_best or idx == best_idx)])
 
         # Render info text
-        percent_done = self.game.sequential_sim.get_percent_done()
-        info_text_str = "{:>3}% done, best score: {}".format(
-            percent_done, int(self.game.sequential_sim.ranked_creatures[0][0]))
-        info_text, _ = self.game.font.render(info_text_str, (255,255,255))
+        info_text_str = "Replay of generation #{}, {:.1f}/{:.1f}s, speed {}x, best score: {}".format(
+            trajectory.generation_idx, tick * trajectory.timestep, (trajectory.nb_ticks - 1) * trajectory.timestep,
+            self.REPLAY_SPEEDS[self._replay_speed_idx], int(trajectory.fitnesses[best_idx]))
+        info_text, _ = self.game.render_text(info_text_str)
         self.game.screen.blit(info_text, (5,5), None)
 
         # Render controls text
-        controls_text_str = "[b] Show only best, [p] Pause, [i] Show infos"
-        controls_text, _ = self.game.font.render(controls_text_str, (255,255,255))
+        controls_text_str = "[b] Show only best, [p] Pause, [+/-] Speed, [[/]] Seek, [0-9] Jump"
+        controls_text, _ = self.game.render_text(controls_text_str)
         self.game.screen.blit(controls_text, (self.game.SCREEN_WIDTH-5-controls_text.get_width(),5), None)
 
-        # Draw current centers
-        for idx, creature in enumerate(self.game.sequential_sim.creatures):
-            if not self._show_only_best or creature == best_creature:
-                center = creature.get_average_node_position()
-                pygame.draw.circle(self.game.screen, (0,128,0), self.draw_options.transform @ center, 5)
+    def _render_creatures(self, frames, positions, sticky, contracted, creature_indices):
+        # Draws the creatures of a frame and their centers.
+        # frames (Trajectory|Snapshot): Where the frame is from
+        self.drawing.draw_recorded_creatures(frames, positions, sticky, contracted, creature_indices)
+        centers = self.drawing.transform_points(frames.get_centers(positions)).tolist()
+        for idx in creature_indices:
+            pygame.draw.circle(self.game.screen, (0,128,0), centers[idx], 5)
 
 
 class UIEditor(UIGame):
@@ -400,6 +408,10 @@ class UIEditor(UIGame):
 class Game:
     """
     Simulating of generations can run independently of the current UI mode.
+    run() only does something when a job finishes or a frame is due, and
+    sleeps otherwise, to leave the CPU to the workers. Generations are always
+    simulated by the workers, a watched one streams a live feed, see
+    _start_generation().
     """
 
     SCREEN_WIDTH = 1600
@@ -411,12 +423,31 @@ class Game:
 
     SIMULATION_CLASS = SimulationHopper
 
+    # Maximum number of UI updates per second
+    FRAME_RATE = 60
+
+    # Number of snapshots of a watched generation's live feed that may wait
+    # for the main process per worker, see SnapshotStream
+    SNAPSHOT_QUEUE_SIZE = 4
+
+    # Number of rendered texts to keep, see render_text()
+    TEXT_CACHE_SIZE = 256
+
+    # Number of jobs per worker in steady-state mode, see STEADY_STATE. More
+    # than one, so that the workers don't wait for new genomes.
+    STEADY_STATE_JOBS_PER_WORKER = 2
+
+    # Number of the best creatures of a generation to record for a replay,
+    # see request_replay()
+    RECORDED_CREATURES = 10
+
     def __init__(self):
 
         # Pygame
         pygame.init()
         self.screen = pygame.display.set_mode((self.SCREEN_WIDTH, self.SCREEN_HEIGHT))
         self.font = pygame.freetype.SysFont("Calibri", 20)
+        self._text_cache = {}   # tuples (surface, rect) by tuple (text, color)
         pygame.display.set_caption("Locomotion Evolution Simulator 1.1")
 
         # User interface
@@ -429,27 +460,87 @@ class Game:
         # https://stackoverflow.com/questions/48990688/pathos-parallel-processing-options-could-someone-explain-the-differences
         #self.pool = pathos.pools.ParallelPool(inodes=MAX_WORKERS)
         self.pool = pathos.pools.ProcessPool(ncpus=MAX_WORKERS)
-        self.jobs = None            # None while not processing
-        self.done_sims = None       #  " "
+        self.scheduler = BatchScheduler(MAX_WORKERS)
+        self.evaluation_store = open_evaluation_store()
+        self.fitness_cache = FitnessCache(store=self.evaluation_store)
+        self.cache_environment = None   # None while not processing
+        self.cached_results = None      #  " "
+        self.nb_cached = None           #  " "
+        self.batches = None         # None while not processing
+        self.jobs = None            #  " ", asyncio futures of the pool's jobs
+        # Threads that wait for the pool's jobs, see _watch_job()
+        self.job_waiters = ThreadPoolExecutor(max_workers=MAX_WORKERS * BatchScheduler.BATCHES_PER_WORKER)
+        self.wakeup = None          # asyncio.Event, set when run() shall update the generations
+        self.start_times = None     # (CPU time, wall time) of the main process when the
+                                    #   current generation was started
 
         # Simulation members
         self.old_generations = []       # List of FinishedGeneration instances
         self.cur_generation = None      # None while not processing
         self.next_generation = None     # Only set between finishing one generation and starting the next
-        self.next_generation_sequential = False     # If True, the next generation will be started as sequential
-        self.sequential_sim = None      # Only set while processing a sequential generation
+        self.watch_requested = False    # If True, generations are started with a live feed to watch
+        self.snapshot_manager = None    # Process of the snapshot queue, started when first watching
+        self.snapshot_queue = None      # Where the workers send the Snapshots of the watched batches
+        self.batch_snapshots = {}       # The latest Snapshot of each batch of a watched generation
+        self.snapshot = None            # The batch snapshots merged, None if none
+        self.snapshot_ground = None     #  " ", the ground of its generation
+        self.steady_state = None        # Only set in steady-state mode, see STEADY_STATE
+        self.islands = None             # Only set in island mode, see ISLANDS
         self.is_simulation_running = True
+        self.recording_job = None       # Only set while the creatures of a replay are recorded
+        self.trajectory = None          # Only set while replaying, see request_replay()
         if MUTATION_FACTORS_VISUALIZATION_MODE:
-            self.next_generation_sequential = True
+            self.watch_requested = True
 
         # Make an initial generation and set it to be the next one
-        initial_generation = Generation(1, [])
-        initial_generation.add_random_genomes(GENERATION_SIZE)
-        self.next_generation = initial_generation
+        self.next_generation = make_initial_generation()
+
+        # Created when the first generation is finished, see resume()
+        self.checkpoint = None
 
     def exit(self):
         self.pool.close()
         self.pool.join()
+        self.job_waiters.shutdown()
+        self.close_replay()
+        if self.snapshot_manager is not None:
+            self.snapshot_manager.shutdown()
+        if self.evaluation_store is not None:
+            self.evaluation_store.close()
+        if self.checkpoint is not None:
+            self.checkpoint.close()
+
+    def resume(self, directory=None):
+        # Continues a recorded run instead of starting with the initial
+        # generation, with the settings of the run, see get_run_settings().
+        # directory (str|None): See resume_checkpoint()
+        self.checkpoint, state = resume_checkpoint(directory)
+        settings = state.settings
+        if settings["fidelity"] is not None:
+            self.checkpoint.close()
+            raise ValueError("Runs with a fidelity profile can only be resumed by headless.py")
+        # Evaluate like the run did, e.g. a headless one with other ticks
+        Game.SIMULATION_CLASS = settings["simulation_class"]
+        run_settings = {"SIMULATION_TICKS": settings["max_ticks"]}
+        if settings["terrain_seed"] is not None:
+            run_settings["TERRAIN_SEED"] = settings["terrain_seed"]
+        apply_settings(run_settings)
+        globals().update(get_settings())
+        # The workers were forked with the settings before resuming, new ones
+        # are started with the first job
+        self.pool.clear()
+        self.old_generations = state.old_generations
+        self.next_generation = state.next_generation
+
+    def render_text(self, text, color=(255,255,255)):
+        # Returns a tuple (surface, rect) like font.render(), rendered only
+        # the first time, as most texts are drawn again every frame.
+        key = (text, color)
+        if key not in self._text_cache:
+            if len(self._text_cache) >= self.TEXT_CACHE_SIZE:
+                self._text_cache.clear()
+            self._text_cache[key] = self.font.render(text, color)
+        return self._text_cache[key]
 
     def set_mode(self, mode):
         self.mode = mode
@@ -460,111 +551,273 @@ class Game:
         elif mode == self.MODE_EDIT:
             self.ui = UIEditor(self)
 
-    def update(self):
-        if self.cur_generation is not None:
-            if self.sequential_sim is not None:
-                # This is a sequential generation
-                if self.sequential_sim.is_done():
-                    self.sequential_sim.evaluate()
-                    self._finish_generation([self.sequential_sim])
-                    self.next_generation = self._make_next_generation()
-                else:
-                    # TODO Not nice to access mode-specific stuff here
-                    if not (self.mode == self.MODE_WATCH and self.ui._is_paused):
-                        self.sequential_sim.do_timestep()
-
-            else:
-                # This is a parallel generation
+    def run(self):
+        # The main loop, returns when the program shall exit.
+        asyncio.run(self._run())
 
-                # Collect finished jobs (non-blocking)
-                for job_idx, job in enumerate(self.jobs):
-                    if self.done_sims[job_idx] is None and job.ready():
-                        self.done_sims[job_idx] = job.get()
+    async def _run(self):
+        self.wakeup = asyncio.Event()
+        frame_duration = 1 / self.FRAME_RATE
+        next_frame_time = time.perf_counter()
+        while True:
+            self.wakeup.clear()
+            self.update()
 
-                # All jobs finished?
-                if self.count_jobs_done() == len(self.jobs):
-                    self._finish_generation(self.done_sims)
-                    self.next_generation = self._make_next_generation()
+            now = time.perf_counter()
+            if now >= next_frame_time:
+                self.ui.update()
+                next_frame_time = max(next_frame_time + frame_duration, now)
 
-        else:
-            if self.is_simulation_running \
-                and self.cur_generation is None \
-                and self.next_generation is not None:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), next_frame_time - time.perf_counter())
+            except asyncio.TimeoutError:
+                pass
 
-                # Start the next generation
+    def update(self):
+        # Starts, advances and finishes generations, without blocking.
+        self._receive_snapshots()
+
+        if self.steady_state is not None:
+            self._update_steady_state()
+
+        elif self.islands is not None:
+            self._update_islands()
+
+        elif self.cur_generation is not None:
+            if self.count_jobs_done() == len(self.jobs):
+                # All jobs are finished
+                batch_outputs = [job.result() for job in self.jobs]
+                if isinstance(self.cur_generation, ReproductionPlan):
+                    # The workers made the genomes
+                    self.cur_generation, results, self.batches, batch_outputs, self.nb_cached = \
+                        assemble_generation(self.cur_generation, self.batches, batch_outputs)
+                else:
+                    results = [result for results in batch_outputs for result in results]
+                utilization = None if len(self.jobs) == 0 else \
+                    self.scheduler.finish_generation(self.batches, batch_outputs)
+                self._finish_generation(results, utilization)
+                self.next_generation = self._make_next_generation()
+
+        elif self.is_simulation_running and self.next_generation is not None:
+            # Start the next generation
+            if ISLANDS > 0 and not self.watch_requested:
+                self.islands = start_islands(self.next_generation)
+                self._start_epoch()
+            elif STEADY_STATE and not self.watch_requested:
+                self._start_steady_state(self.next_generation)
+            else:
                 self._start_generation(self.next_generation)
-                self.next_generation = None
-
-                # Save, if pending
-                if self.save_pending:
-                    gen = self.old_generations[-1]
-                    fitness_min, fitness_avg, fitness_max = gen.get_stats()
-                    save(gen.genomes, fitness_avg, fitness_max)
-                    self.save_pending = False
-
-        # Update UI
-        self.ui.update()
+            self.next_generation = None
+
+        if self.recording_job is not None and self.recording_job.done():
+            self.close_replay()
+            self.trajectory = Trajectory(self.recording_job.result())
+            self.recording_job = None
+            self.set_mode(self.MODE_WATCH)
+
+        # Save as soon as requested, if there's a generation to save
+        if self.save_pending and len(self.old_generations) > 0:
+            gen = self.old_generations[-1]
+            fitness_min, fitness_avg, fitness_max = gen.get_stats()
+            save(gen.genomes, fitness_avg, fitness_max)
+            self.save_pending = False
+
+    def _receive_snapshots(self):
+        # Keeps the latest of the snapshots each batch's worker sent, and
+        # merges them into one of the whole generation.
+        if self.snapshot_queue is None:
+            return
+        is_updated = False
+        while True:
+            try:
+                snapshot = self.snapshot_queue.get_nowait()
+            except queue.Empty:
+                break
+            if self.cur_generation is not None and snapshot.generation_idx == self.cur_generation.idx:
+                self.batch_snapshots[snapshot.source] = snapshot
+                is_updated = True
+        if is_updated:
+            self.snapshot = Snapshot.merge([self.batch_snapshots[position] \
+                for position in sorted(self.batch_snapshots)], len(self.batches))
+            self.snapshot_ground = self.cur_generation.ground
+
+    def _get_snapshot_queue(self):
+        # Starts the manager process of the queue the first time, as the
+        # workers can't share a plain multiprocessing queue.
+        if self.snapshot_queue is None:
+            self.snapshot_manager = pathos.helpers.mp.Manager()
+            self.snapshot_queue = self.snapshot_manager.Queue(self.SNAPSHOT_QUEUE_SIZE * MAX_WORKERS)
+        return self.snapshot_queue
+
+    def can_replay(self):
+        # Only generations with genomes can be replayed, not the summaries of
+        # island mode or of resumed runs.
+        return self.islands is None and (len(self.old_generations) == 0 \
+            or isinstance(self.old_generations[-1], FinishedGeneration))
+
+    def request_replay(self):
+        # Records the RECORDED_CREATURES best creatures of the last generation
+        # in a worker, and plays them back in watch mode once recorded, see
+        # UIWatch. The generation keeps evolving meanwhile.
+        if self.recording_job is not None or len(self.old_generations) == 0 or not self.can_replay():
+            return
+        fg = self.old_generations[-1]
+        generation = Generation(fg.idx, [rg[1] for rg in fg.ranked_genomes[0:self.RECORDED_CREATURES]], \
+            terrain_seed=fg.terrain_seed)
+        generation.ground = fg.ground
+        os.makedirs(TRAJECTORY_DIRECTORY, exist_ok=True)
+        location = TRAJECTORY_DIRECTORY + "generation{}{}".format(fg.idx, Trajectory.FILE_EXTENSION)
+        self.recording_job = self._watch_job(self.pool.apipe(Game.record_func, generation, location))
+
+    def close_replay(self):
+        if self.trajectory is not None:
+            self.trajectory.close()
+            self.trajectory = None
 
     def count_jobs_done(self):
-        return 0 if self.done_sims is None else \
-            sum([1 for s in self.done_sims if s is not None])
+        return 0 if self.jobs is None else sum([1 for job in self.jobs if job.done()])
+
+    def _watch_job(self, pathos_job):
+        # Returns an asyncio future of the job's result, which wakes up run()
+        # when the job is finished. A thread waits for the job, so the main
+        # thread doesn't need to poll it.
+        future = asyncio.get_running_loop().run_in_executor(self.job_waiters, pathos_job.get)
+        future.add_done_callback(lambda future: self.wakeup.set())
+        return future
 
     def _make_next_generation(self):
         # Generate the next generation from the last and return it.
-        parent_gen = self.old_generations[-1]
-        reproducing_genomes = [rg[1] for rg in parent_gen.ranked_genomes[0:SURVIVORS_PER_GENERATION]]
-        next_generation = Generation(parent_gen.idx+1, [])
-        guarantee_champion_survival = False if MUTATION_FACTORS_VISUALIZATION_MODE else \
-            random.uniform(0, 1) <= GUARANTEE_CHAMPION_SURVIVAL_CHANCE
-        while len(next_generation.genomes) < GENERATION_SIZE - RANDOMS_PER_GENERATION:
-            if guarantee_champion_survival and len(next_generation.genomes) == 0:
-                next_generation.add_genome(parent_gen.ranked_genomes[0][1])
-            else:
-                parent_genome = random.choice(reproducing_genomes)
-                next_generation.add_children(parent_genome, 1)
-        next_generation.add_random_genomes(RANDOMS_PER_GENERATION)
+        next_generation = reproduce(self.old_generations[-1], True)
+        if self.checkpoint is None:
+            self.checkpoint = create_checkpoint()
+        if self.checkpoint is not None:
+            self.checkpoint.add_generation(self.old_generations[-1], next_generation, \
+                get_run_settings(self.SIMULATION_CLASS, SIMULATION_TICKS))
         return next_generation
 
-    def sim_func(generation):
-        #print("Simulation started")
-        sim = Game.SIMULATION_CLASS(generation, SIMULATION_TICKS)
-        while not sim.is_done():
-            sim.do_timestep()
-        sim.evaluate()
-        #print("Simulation done")
-        return sim
+    def sim_func(generation, evaluation_store, snapshot_queue=None, snapshot_source=None):
+        return simulate(generation, Game.SIMULATION_CLASS, SIMULATION_TICKS, None, evaluation_store, \
+            snapshot_queue, snapshot_source)
+
+    def record_func(generation, location):
+        return record_trajectories(generation, Game.SIMULATION_CLASS, SIMULATION_TICKS, location)
+
+    def reproduce_func(plan, evaluation_store, snapshot_queue=None, snapshot_source=None):
+        return reproduce_and_simulate(plan, Game.SIMULATION_CLASS, SIMULATION_TICKS, None, evaluation_store, \
+            snapshot_queue, snapshot_source)
 
     def _start_generation(self, new_generation):
-        if self.next_generation_sequential:
-            self.sequential_sim = self.SIMULATION_CLASS(new_generation, SIMULATION_TICKS)
+        # new_generation (Generation|ReproductionPlan): See reproduce()
+        self.start_times = (time.process_time(), time.perf_counter())
+        generate_ground(new_generation, self.SIMULATION_CLASS)
+        self.cache_environment = FitnessCache.get_environment( \
+            new_generation.ground, self.SIMULATION_CLASS, SIMULATION_TICKS, None)
+        if isinstance(new_generation, ReproductionPlan):
+            # The workers make the genomes, look them up in their fitness
+            # cache, and simulate them, see assemble_generation(). Unchanged
+            # copies may be in this process' cache already.
+            self.fitness_cache.add_known_results(new_generation, self.cache_environment)
+            self.cached_results, self.nb_cached = [], 0
+            self.batches = self.scheduler.make_batches(new_generation, \
+                new_generation.estimate_costs(self.scheduler.cost_model))
+            job_func = Game.reproduce_func
         else:
-            split_generations = new_generation.split(MAX_WORKERS)
-            self.jobs, self.done_sims = [], []
-            for split_generation in split_generations:
-                pathos_job = self.pool.apipe(Game.sim_func, split_generation)
-                self.jobs.append(pathos_job)
-                self.done_sims.append(None)
+            # Only simulate the genomes that aren't in the fitness cache
+            self.cached_results, missing = self.fitness_cache.get_results( \
+                new_generation, self.cache_environment)
+            self.nb_cached = len(new_generation.genomes) - len(missing.genomes)
+            self.batches = self.scheduler.make_batches(missing)
+            job_func = Game.sim_func
+        # The pool hands the batches to the workers as they become idle. When
+        # watched, every batch streams a live feed of its creatures, tagged
+        # with its position, see _receive_snapshots(). The last snapshot of
+        # the previous generation is shown until the first one arrives.
+        if not self.watch_requested:
+            self.snapshot, self.snapshot_ground = None, None
+        self.batch_snapshots = {}
+        snapshot_queue = self._get_snapshot_queue() if self.watch_requested else None
+        self.jobs = []
+        for position, batch in enumerate(self.batches):
+            pathos_job = self.pool.apipe(job_func, batch, self.evaluation_store, snapshot_queue, position)
+            self.jobs.append(self._watch_job(pathos_job))
         self.cur_generation = new_generation
 
-    def _finish_generation(self, sims):
-        fg = FinishedGeneration(sims)
+    def _start_steady_state(self, initial_generation):
+        # Switches to steady-state mode for the rest of the run, starting
+        # with the genomes of the generation, see STEADY_STATE.
+        self.steady_state = start_steady_state(initial_generation, self.SIMULATION_CLASS, MAX_WORKERS)
+        self.cache_environment = FitnessCache.get_environment( \
+            self.steady_state.ground, self.SIMULATION_CLASS, SIMULATION_TICKS, None)
+        self.jobs = {}      # tuples (batch, cached results) by job
+
+    def _update_steady_state(self):
+        # Adds the genomes of finished jobs to the population, and breeds new
+        # genomes to keep STEADY_STATE_JOBS_PER_WORKER jobs per worker.
+        for job in [job for job in self.jobs if job.done()]:
+            batch, cached_results = self.jobs.pop(job)
+            self._add_steady_state_results(batch, cached_results, job.result())
+
+        if not self.is_simulation_running:
+            return
+        for i in range(MAX_WORKERS * self.STEADY_STATE_JOBS_PER_WORKER - len(self.jobs)):
+            batch = self.steady_state.breed()
+            if batch is None:
+                break
+            cached_results, missing = self.fitness_cache.get_results(batch, self.cache_environment)
+            if len(missing.genomes) == 0:
+                self._add_steady_state_results(batch, cached_results, [])
+            else:
+                pathos_job = self.pool.apipe(Game.sim_func, missing, self.evaluation_store)
+                self.jobs[self._watch_job(pathos_job)] = (batch, cached_results)
+
+    def _add_steady_state_results(self, batch, cached_results, simulated_results):
+        results = self.fitness_cache.complete_results(batch, self.cache_environment, \
+            cached_results + simulated_results)
+        busy_time = sum([result.wall_time for result in simulated_results])
+        for fg in self.steady_state.add_results(batch, results, \
+                len(batch.genomes) - len(simulated_results), busy_time):
+            self.old_generations.append(fg)
+            print_generation_stats(fg, len(self.old_generations))
+
+    def island_func(island, nb_generations, immigrants, evaluation_store):
+        return evolve_island(island, nb_generations, immigrants, Game.SIMULATION_CLASS, SIMULATION_TICKS, \
+            None, evaluation_store)
+
+    def _start_epoch(self):
+        # Evolves each island for MIGRATION_INTERVAL generations in a job, see
+        # ISLANDS.
+        self.jobs = [self._watch_job(self.pool.apipe(Game.island_func, island, MIGRATION_INTERVAL, \
+            immigrants, self.evaluation_store)) for island, immigrants in zip(self.islands.islands, \
+            self.islands.immigrants)]
+
+    def _update_islands(self):
+        if self.jobs is not None and self.count_jobs_done() == len(self.jobs):
+            # Only the islands' stats and migrants come back to the main process
+            for summary in self.islands.finish_epoch([job.result() for job in self.jobs]):
+                self.old_generations.append(summary)
+                print_island_stats(summary, len(self.old_generations))
+            self.jobs = None
+        if self.jobs is None and self.is_simulation_running:
+            self._start_epoch()
+
+    def _finish_generation(self, results, utilization=None):
+        results = self.fitness_cache.complete_results(self.cur_generation, \
+            self.cache_environment, self.cached_results + results)
+        cpu_time, wall_time = (time.process_time(), time.perf_counter())
+        main_cpu = None if wall_time == self.start_times[1] else \
+            (cpu_time - self.start_times[0]) / (wall_time - self.start_times[1])
+        fg = FinishedGeneration(self.cur_generation, results, utilization, self.nb_cached, main_cpu)
         self.old_generations.append(fg)
-        self.jobs, self.done_sims = None, None
+        self.batches, self.jobs, self.start_times = None, None, None
+        self.cache_environment, self.cached_results, self.nb_cached = None, None, None
         self.cur_generation = None
-        self.sequential_sim = None
 
         # Show statistics
-        fitness_min, fitness_avg, fitness_max = fg.get_stats()
-        if len(self.old_generations) % 10 == 0:
-            print("{:<5} {:<8} {:<8} {:<8}".format("#Gen", "Fit min", "Fit avg", "Fit max"))
-        print("{:<5} {:<8} {:<8} {:<8}".format(self.old_generations[-1].idx, fitness_min, fitness_avg, fitness_max))
+        print_generation_stats(fg, len(self.old_generations))
 
 
 # ---------------------------------------------------------------------------
 
-Genome.NODE_TYPE_CLASS = TimerNodeType
-Genome.MUSCLE_TYPE_CLASS = TimerMuscleType
-
 game = Game()
 
 # ---------------------------------------------------------------------------
@@ -578,6 +831,8 @@ for arg in sys.argv[1:]:
         HELP=True
     elif arg.startswith("-load="):
         game.next_generation = load(arg.split("=")[1])
+    elif arg == "-resume" or arg.startswith("-resume="):
+        game.resume(arg.split("=")[1] if "=" in arg else None)
     else:
         print("Invalid arguments given")
         HELP=True
@@ -585,15 +840,14 @@ for arg in sys.argv[1:]:
 
 if HELP:
     print("Usage:")
-    print("{} [-load=<location>]")
+    print("{} [-load=<location>] [-resume[=<checkpoint directory>]]")
     sys.exit(0)
 
 # ---------------------------------------------------------------------------
 
 # The main loop
 try:
-    while True:
-        game.update()
+    game.run()
 except KeyboardInterrupt:
     game.exit()
     sys.exit(0)
@@ -1,6 +1,7 @@
 import random
 import math
 import copy
+import collections
 
 import pymunk
 from pymunk.vec2d import Vec2d
@@ -19,9 +20,13 @@ class Muscle:
         self.is_contracted = False
 
         self.update_rest_length()
-        self.constraint = pymunk.constraints.DampedSpring( \
-            node_1.body, node_2.body, (0, 0), (0, 0), \
-            self.length, muscle_type.stiffness, muscle_type.damping)
+        if creature.body_pool is not None:
+            self.constraint = creature.body_pool.get_spring(node_1.body, node_2.body, \
+                self.length, muscle_type.stiffness, muscle_type.damping)
+        else:
+            self.constraint = pymunk.constraints.DampedSpring( \
+                node_1.body, node_2.body, (0, 0), (0, 0), \
+                self.length, muscle_type.stiffness, muscle_type.damping)
         self.constraint.max_force = muscle_type.max_force
 
         self.node_1.muscles.append(self)
@@ -64,9 +69,12 @@ class Node:
         mass_radius_factor = 1 + self.node_type.mass / 5
         self.radius = self.MIN_RADIUS * mass_radius_factor
         inertia = pymunk.moment_for_circle(self.node_type.mass, 0, self.radius, (0,0))
-        self.body = pymunk.Body(self.node_type.mass, inertia)
+        if creature.body_pool is not None:
+            self.body, self.shape = creature.body_pool.get_body(self.node_type.mass, inertia, self.radius)
+        else:
+            self.body = pymunk.Body(self.node_type.mass, inertia)
+            self.shape = pymunk.Circle(self.body, self.radius, (0,0))
         self.body.position = position
-        self.shape = pymunk.Circle(self.body, self.radius, (0,0))
         self.shape.filter = pymunk.ShapeFilter(group=1)
 
         # Set initial stickyness
@@ -105,6 +113,70 @@ class Node:
                 self.shape.friction = self.FRICTION_NONSTICKY
 
 
+class BodyPool:
+    """
+    Recycles the pymunk bodies, shapes and springs of deleted creatures, so
+    that consecutive simulations in the same process don't allocate new ones
+    for every node and muscle. Pooled objects are reset and re-parameterized
+    when taken from the pool.
+    """
+
+    # Springs can't be moved to other bodies, so they are pooled per pair of
+    # bodies. The pool is cleared if it grows beyond that many springs.
+    MAX_SPRINGS = 20000
+
+    def __init__(self):
+        self._bodies = collections.deque()  # tuples (body, shape)
+        self._springs = {}                  # (id(body_a), id(body_b)) -> list of springs
+        self._nb_springs = 0
+
+    def get_body(self, mass, moment, radius):
+        # Returns a tuple (body, shape) of a body at rest and its circle shape.
+        # The caller sets the position and the shape's filter and friction.
+        if len(self._bodies) == 0:
+            body = pymunk.Body(mass, moment)
+            return body, pymunk.Circle(body, radius, (0,0))
+        body, shape = self._bodies.popleft()
+        # The solver's bias velocities aren't accessible, but are reset when
+        # the position is updated.
+        pymunk.Body.update_position(body, 0)
+        body.mass = mass
+        body.moment = moment
+        body.angle = 0
+        body.velocity = (0, 0)
+        body.angular_velocity = 0
+        body.force = (0, 0)
+        body.torque = 0
+        shape.unsafe_set_radius(radius)
+        return body, shape
+
+    def get_spring(self, body_a, body_b, rest_length, stiffness, damping):
+        # Returns a DampedSpring between the centers of the two bodies.
+        # The caller sets max_force.
+        springs = self._springs.get((id(body_a), id(body_b)))
+        if not springs:
+            return pymunk.constraints.DampedSpring( \
+                body_a, body_b, (0, 0), (0, 0), rest_length, stiffness, damping)
+        self._nb_springs -= 1
+        spring = springs.pop()
+        spring.rest_length = rest_length
+        spring.stiffness = stiffness
+        spring.damping = damping
+        return spring
+
+    def release_body(self, body, shape):
+        # body, shape: Must not be in a space anymore
+        self._bodies.append((body, shape))
+
+    def release_spring(self, spring):
+        # spring (DampedSpring): Must not be in a space anymore
+        if self._nb_springs >= self.MAX_SPRINGS:
+            self._springs.clear()
+            self._nb_springs = 0
+        self._springs.setdefault((id(spring.a), id(spring.b)), []).append(spring)
+        self._nb_springs += 1
+
+
 class Creature:
 
     MAX_NODES = 50
@@ -112,13 +184,17 @@ class Creature:
     NODE_CLASS = Node       # will be overwritten
     MUSCLE_CLASS = Muscle   # will be overwritten
 
-    def __init__(self, space, genome, initial_position):
+    def __init__(self, space, genome, initial_position, body_pool=None):
         # genome (CreatureGenome): The building plan for the creature
         # initial_position (Vec2d): Top left corner of bounding box
+        # body_pool (BodyPool|None): Where to take pymunk objects from and
+        #   return them to on delete(), None to always create new ones
         self.space = space
+        self.body_pool = body_pool
         self.genome = genome
         self.nodes = []     # list positions and node's idx match
         self.muscles = []
+        self.frozen_fitness = None  # set if removed from the simulation early
         self._build(initial_position)
         self.center_initial = self.get_average_node_position()
 
@@ -134,18 +210,24 @@ class Creature:
 
         # Create muscles
         for muscle_type in self.genome.matrix.iterate_all_muscles():
-            node_1 = self.nodes[muscle_type.node_type_1.idx]
-            node_2 = self.nodes[muscle_type.node_type_2.idx]
+            node_1 = self.nodes[muscle_type.node_idx_1]
+            node_2 = self.nodes[muscle_type.node_idx_2]
             muscle = self.MUSCLE_CLASS(self, muscle_type, node_1, node_2)
             self.muscles.append(muscle)
             self.space.add(muscle.constraint)
 
     def delete(self):
         # Removes the creature's bodies and constraints from space.
+        # If pooled, they are returned to the pool, so don't use them afterwards.
         for node in self.nodes:
             self.space.remove(node.body, node.shape)
         for muscle in self.muscles:
             self.space.remove(muscle.constraint)
+        if self.body_pool is not None:
+            for muscle in self.muscles:
+                self.body_pool.release_spring(muscle.constraint)
+            for node in self.nodes:
+                self.body_pool.release_body(node.body, node.shape)
 
     def get_average_node_position(self):
         sum_x, sum_y = 0, 0
@@ -0,0 +1,268 @@
+
+import math
+import random
+
+import numpy as np
+
+from timer import *
+
+
+class Population:
+    """
+    The parameters of many genomes in NumPy arrays, one array per parameter
+    (struct of arrays), so that random genomes are generated and genomes are
+    mutated for the whole population at once, with batched random draws.
+    The arrays are padded to the largest number of nodes, masks tell which
+    entries exist. Muscles are indexed by node pair like in MuscleMatrix (see
+    MuscleMatrix.get_key()).
+    Generating and mutating uses the same probabilities and bounds as
+    Genome.generate_random(), Genome.mutate() and the mutate() methods of the
+    node, muscle and timer types. Only genomes of TimerNodeTypes and
+    TimerMuscleTypes are supported.
+
+    nb_nodes        int64[genomes]
+    nodes           float64[NODE_COLUMNS][genomes][nodes]
+    muscle_mask     bool[genomes][pairs], whether the pair is connected
+    muscle_order    int64[genomes][pairs], muscles are created in this order
+    muscle_swapped  bool[genomes][pairs], whether node_idx_1 is the larger idx
+    muscles         float64[MUSCLE_COLUMNS][genomes][pairs]
+    """
+
+    # Columns of nodes and muscles, the last four are the timer type's
+    NODE_X, NODE_Y, NODE_MASS = 0, 1, 2
+    NODE_COLUMNS = 7
+    MUSCLE_MAX_FORCE, MUSCLE_DAMPING, MUSCLE_STIFFNESS, MUSCLE_CONTRACT_FACTOR = 0, 1, 2, 3
+    MUSCLE_COLUMNS = 8
+    TIMER_START, TIMER_STEP, TIMER_TRUE_FROM, TIMER_FALSE_FROM = 0, 1, 2, 3
+    TIMER_COLUMNS = 4
+
+    # Lower and upper bounds of the muscle columns
+    MUSCLE_BOUNDS = [
+        (MuscleType.MAX_FORCE_MIN, MuscleType.MAX_FORCE_MAX),
+        (MuscleType.DAMPING_MIN, MuscleType.DAMPING_MAX),
+        (MuscleType.STIFFNESS_MIN, MuscleType.STIFFNESS_MAX),
+        (MuscleType.CONTRACT_FACTOR_MIN, MuscleType.CONTRACT_FACTOR_MAX),
+    ]
+
+    def __init__(self, nb_genomes, max_nodes, rng=None):
+        # Creates a population of genomes without nodes, see generate_random()
+        # and from_genomes().
+        # max_nodes (int): Number of nodes the arrays are padded to
+        # rng (numpy.random.Generator|None): None for one seeded from the
+        #   random module, so that seeding it makes runs reproducible
+        self.rng = rng if rng is not None else np.random.default_rng(random.getrandbits(64))
+        nb_pairs = max_nodes * (max_nodes - 1) // 2
+        self.max_nodes = max_nodes
+        self.nb_nodes = np.zeros(nb_genomes, dtype=np.int64)
+        self.nodes = np.zeros((self.NODE_COLUMNS, nb_genomes, max_nodes), dtype=np.float64)
+        self.muscle_mask = np.zeros((nb_genomes, nb_pairs), dtype=bool)
+        self.muscle_order = np.zeros((nb_genomes, nb_pairs), dtype=np.int64)
+        self.muscle_swapped = np.zeros((nb_genomes, nb_pairs), dtype=bool)
+        self.muscles = np.zeros((self.MUSCLE_COLUMNS, nb_genomes, nb_pairs), dtype=np.float64)
+        pairs = [MuscleMatrix.get_pair(key) for key in range(nb_pairs)]
+        self._pair_idx_1 = np.array([pair[0] for pair in pairs], dtype=np.int64)
+        self._pair_idx_2 = np.array([pair[1] for pair in pairs], dtype=np.int64)
+
+    def __len__(self):
+        return len(self.nb_nodes)
+
+    def get_node_mask(self):
+        # Returns bool[genomes][nodes], whether the node exists.
+        return np.arange(self.max_nodes) < self.nb_nodes[:, None]
+
+    def get_pair_mask(self):
+        # Returns bool[genomes][pairs], whether both nodes of the pair exist.
+        return self._pair_idx_2 < self.nb_nodes[:, None]
+
+    @classmethod
+    def generate_random(cls, nb_genomes, percentage_muscles_min, percentage_muscles_max, rng=None):
+        # Returns a population of completely random genomes.
+        population = cls(nb_genomes, Genome.MAX_NODES, rng)
+        rng = population.rng
+        shape = (nb_genomes, Genome.MAX_NODES)
+        population.nb_nodes[:] = rng.integers(Genome.MIN_NODES, Genome.MAX_NODES, nb_genomes, endpoint=True)
+        node_mask = population.get_node_mask()
+        nodes = population.nodes
+        nodes[cls.NODE_X] = rng.uniform(0, Genome.BB_WIDTH, shape)
+        nodes[cls.NODE_Y] = rng.uniform(0, Genome.BB_HEIGHT, shape)
+        nodes[cls.NODE_MASS] = rng.uniform(NodeType.MASS_MIN, NodeType.MASS_MAX, shape)
+        population._randomize_timers(nodes[cls.NODE_COLUMNS-cls.TIMER_COLUMNS:], node_mask)
+        nodes[:, ~node_mask] = 0
+
+        # Connect a random subset of the pairs, in random order
+        pair_mask = population.get_pair_mask()
+        nb_possible_muscles = population.nb_nodes * (population.nb_nodes - 1) // 2
+        nb_muscles = nb_possible_muscles * rng.integers(percentage_muscles_min, \
+            percentage_muscles_max, nb_genomes, endpoint=True) // 100
+        scores = np.where(pair_mask, rng.random(pair_mask.shape), 2)
+        ranks = np.argsort(np.argsort(scores, axis=1), axis=1)
+        population.muscle_mask[:] = ranks < nb_muscles[:, None]
+        population.muscle_order[:] = ranks
+        population.muscle_swapped[:] = rng.random(pair_mask.shape) < 0.5
+        population._randomize_muscles(population.muscle_mask)
+        population._randomize_timers(population.muscles[cls.MUSCLE_COLUMNS-cls.TIMER_COLUMNS:], \
+            population.muscle_mask)
+        return population
+
+    @classmethod
+    def from_genomes(cls, genomes, rng=None):
+        max_nodes = max([2] + [len(genome.node_types) for genome in genomes])
+        population = cls(len(genomes), max_nodes, rng)
+        for i, genome in enumerate(genomes):
+            population.nb_nodes[i] = len(genome.node_types)
+            for idx, node_type in enumerate(genome.node_types):
+                population.nodes[:, i, idx] = (node_type.bb_position.x, node_type.bb_position.y, \
+                    node_type.mass) + node_type.tt.get_content()
+            for order, muscle_type in enumerate(genome.matrix.iterate_all_muscles()):
+                key = MuscleMatrix.get_key(muscle_type.node_idx_1, muscle_type.node_idx_2)
+                population.muscle_mask[i, key] = True
+                population.muscle_order[i, key] = order
+                population.muscle_swapped[i, key] = muscle_type.node_idx_1 > muscle_type.node_idx_2
+                population.muscles[:, i, key] = (muscle_type.max_force, muscle_type.damping, \
+                    muscle_type.stiffness, muscle_type.contract_factor) + muscle_type.tt.get_content()
+        return population
+
+    def to_genomes(self):
+        # Returns a new Genome for each genome of the population.
+        genomes = []
+        nodes = self.nodes.transpose(1, 2, 0).tolist()
+        muscles = self.muscles.transpose(1, 2, 0).tolist()
+        pair_idx_1, pair_idx_2 = self._pair_idx_1.tolist(), self._pair_idx_2.tolist()
+        for i, nb_nodes in enumerate(self.nb_nodes.tolist()):
+            genome = Genome()
+            for idx, (x, y, mass, start, step, true_from, false_from) in enumerate(nodes[i][:nb_nodes]):
+                genome.node_types.append(TimerNodeType(idx, Vec2d(x, y), mass, \
+                    TimerType(start, step, true_from, false_from)))
+            keys = np.flatnonzero(self.muscle_mask[i])
+            keys = keys[np.argsort(self.muscle_order[i, keys], kind="stable")].tolist()
+            swapped = self.muscle_swapped[i].tolist()
+            for key in keys:
+                idx_1, idx_2 = pair_idx_1[key], pair_idx_2[key]
+                if swapped[key]:
+                    idx_1, idx_2 = idx_2, idx_1
+                max_force, damping, stiffness, contract_factor, start, step, true_from, false_from = muscles[i][key]
+                genome.matrix.set_muscle_type(genome.node_types[idx_1], genome.node_types[idx_2], \
+                    TimerMuscleType(idx_1, idx_2, max_force, damping, stiffness, contract_factor, \
+                        TimerType(start, step, true_from, false_from)))
+            genomes.append(genome)
+        return genomes
+
+    def take(self, positions):
+        # Returns a population with copies of the genomes at the positions,
+        # e.g. of the parents of the children of a generation.
+        population = Population(len(positions), self.max_nodes, self.rng)
+        population.nb_nodes = self.nb_nodes[positions]
+        population.nodes = self.nodes[:, positions]
+        population.muscle_mask = self.muscle_mask[positions]
+        population.muscle_order = self.muscle_order[positions]
+        population.muscle_swapped = self.muscle_swapped[positions]
+        population.muscles = self.muscles[:, positions]
+        return population
+
+    def _chance(self, mask, percent):
+        # Returns a copy of the mask, each True entry stays True with the
+        # chance of percent.
+        return mask & (self.rng.random(mask.shape) < percent / 100)
+
+    def _set_uniform(self, values, mask, low, high):
+        # Overwrites the masked values with random ones.
+        values[mask] = self.rng.uniform(low, high, np.count_nonzero(mask))
+
+    def _add_uniform(self, values, mask, delta, low, high):
+        # Changes the masked values by at most delta and clamps them.
+        values[mask] = np.clip(values[mask] + self.rng.uniform(-delta, delta, np.count_nonzero(mask)), low, high)
+
+    def _choose_in_rows(self, mask):
+        # Returns for each row of the mask the column of a random True entry,
+        # 0 for rows without one.
+        return np.argmax(np.where(mask, self.rng.random(mask.shape), -1), axis=1)
+
+    def _randomize_timers(self, timers, mask):
+        # Like TimerType.generate_random()
+        # timers (array): The timer columns of the nodes or muscles
+        self._set_uniform(timers[self.TIMER_START], mask, 0, 2*math.pi)
+        self._set_uniform(timers[self.TIMER_STEP], mask, 0, TimerType.MAX_STEP)
+        self._set_uniform(timers[self.TIMER_TRUE_FROM], mask, 0, 2*math.pi)
+        self._set_uniform(timers[self.TIMER_FALSE_FROM], mask, 0, 2*math.pi)
+
+    def _randomize_muscles(self, mask):
+        # Like MuscleType.randomize()
+        for column, (low, high) in enumerate(self.MUSCLE_BOUNDS):
+            self._set_uniform(self.muscles[column], mask, low, high)
+
+    def _mutate_timers(self, timers, mask):
+        # Like TimerType.mutate()
+        delta = 2*math.pi * (TimerType.MUTATE_RANGE_PERCENT/100)
+        for column in [self.TIMER_START, self.TIMER_TRUE_FROM, self.TIMER_FALSE_FROM]:
+            self._add_uniform(timers[column], self._chance(mask, 40), delta, 0, 2*math.pi)
+        delta = (TimerType.MAX_STEP - TimerType.MIN_STEP) * (TimerType.MUTATE_RANGE_PERCENT/100)
+        self._add_uniform(timers[self.TIMER_STEP], self._chance(mask, 40), delta, \
+            TimerType.MIN_STEP, TimerType.MAX_STEP)
+
+    def mutate(self):
+        # Mutates every genome, like Genome.mutate(). As all muscles of a
+        # genome are mutated at once, muscles that copy the parameters of
+        # another one get that one's parameters from before this mutation.
+        rng = self.rng
+        nb_genomes = len(self)
+
+        # Mutate some node types, like NodeType.mutate()
+        mutated = self._chance(self.get_node_mask(), 40)
+        x, y, mass = self.nodes[self.NODE_X], self.nodes[self.NODE_Y], self.nodes[self.NODE_MASS]
+        mask = self._chance(mutated, 5)
+        self._set_uniform(x, mask, 0, Genome.BB_WIDTH)
+        self._set_uniform(y, mask, 0, Genome.BB_HEIGHT)
+        mask = self._chance(mutated, 50)
+        nb_moved = np.count_nonzero(mask)
+        angles = rng.uniform(0, 2*math.pi, nb_moved)
+        diameter = math.sqrt(Genome.BB_WIDTH**2 + Genome.BB_HEIGHT**2)
+        lengths = rng.uniform(0, diameter*(NodeType.MUTATE_BB_POSITION_MAX_PERCENTAGE/100), nb_moved)
+        x[mask] = np.clip(x[mask] + np.cos(angles) * lengths, 0, Genome.BB_WIDTH)
+        y[mask] = np.clip(y[mask] + np.sin(angles) * lengths, 0, Genome.BB_HEIGHT)
+        self._add_uniform(mass, self._chance(mutated, 25), 0.4, NodeType.MASS_MIN, NodeType.MASS_MAX)
+        self._mutate_timers(self.nodes[self.NODE_COLUMNS-self.TIMER_COLUMNS:], mutated)
+
+        # Mutate some muscle types, or scale the step of all their timers
+        muscle_timers = self.muscles[self.MUSCLE_COLUMNS-self.TIMER_COLUMNS:]
+        scale_all_timers = rng.random(nb_genomes) < 0.1
+        factors = np.broadcast_to(rng.uniform(0.5, 1.5, nb_genomes)[:, None], self.muscle_mask.shape)
+        mask = self.muscle_mask & scale_all_timers[:, None]
+        muscle_timers[self.TIMER_STEP][mask] = np.mod( \
+            muscle_timers[self.TIMER_STEP][mask] * factors[mask], TimerType.MAX_STEP)
+        mutated = self._chance(self.muscle_mask & ~scale_all_timers[:, None], 60)
+        # Like MuscleType.mutate()
+        self._randomize_muscles(self._chance(mutated, 5))
+        mask = self._chance(mutated, 10)
+        if np.any(mask):
+            # The k-th connected pair of each genome is at positions[k]
+            positions = np.argsort(~self.muscle_mask, axis=1, kind="stable")
+            counts = np.count_nonzero(self.muscle_mask, axis=1)
+            nth = (rng.random(mask.shape) * counts[:, None]).astype(np.int64)
+            sources = np.take_along_axis(positions, np.minimum(nth, positions.shape[1] - 1), axis=1)
+            genome_indices = np.broadcast_to(np.arange(nb_genomes)[:, None], mask.shape)
+            for column in range(len(self.MUSCLE_BOUNDS)):
+                values = self.muscles[column]
+                values[mask] = values[genome_indices[mask], sources[mask]]
+        changed = self._chance(mutated, 50)
+        for column, (low, high) in enumerate(self.MUSCLE_BOUNDS):
+            delta = (high - low) * (MuscleType.MUTATE_RANGE_PERCENT/100)
+            self._add_uniform(self.muscles[column], self._chance(changed, 50), delta, low, high)
+        self._mutate_timers(muscle_timers, mutated)
+
+        # Delete some muscle types
+        counts = np.count_nonzero(self.muscle_mask, axis=1)
+        genomes = np.flatnonzero((rng.random(nb_genomes) < 0.05) & (counts > 0))
+        keys = self._choose_in_rows(self.muscle_mask)[genomes]
+        self.muscle_mask[genomes, keys] = False
+
+        # Create a muscle type
+        unconnected = self.get_pair_mask() & ~self.muscle_mask
+        genomes = np.flatnonzero((rng.random(nb_genomes) < 0.05) & np.any(unconnected, axis=1))
+        keys = self._choose_in_rows(unconnected)[genomes]
+        mask = np.zeros_like(self.muscle_mask)
+        mask[genomes, keys] = True
+        self.muscle_mask |= mask
+        self.muscle_order[genomes, keys] = np.max(self.muscle_order, axis=1)[genomes] + 1
+        self.muscle_swapped[genomes, keys] = False
+        self._randomize_muscles(mask)
+        self._randomize_timers(muscle_timers, mask)
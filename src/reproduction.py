@@ -0,0 +1,138 @@
+
+import copy
+import random
+
+import numpy as np
+
+from generation import *
+from population import *
+
+
+class ReproductionPlan:
+    """
+    How to make the genomes of the next generation: which genome each one is
+    a child or copy of, or whether it's a new random genome. Making the plan
+    is cheap and done by the main process, while the worker processes make
+    the genomes from parts of it (see split_at() and make_generation()) and
+    simulate them right away.
+    Each genome gets its own random seed, derived from the plan's seed and
+    its genome id, so the genomes are the same regardless of how the plan
+    is split, except with vectorized reproduction, where each part draws
+    from one stream.
+    The main process can attach the results it already knows, e.g. of the
+    champion's unchanged copy (see FitnessCache.add_known_results()), so
+    that the worker processes don't simulate those genomes again.
+    """
+
+    def __init__(self, idx, parents, parent_positions, mutate, seed, genome_ids=None, \
+            terrain_seed=None, vectorized=False):
+        # idx (int): Of the next generation
+        # parents (Genome[]): The genomes to make children and copies of
+        # parent_positions (int|None[]): For each genome to make, the position
+        #   of its parent in parents, None for a new random genome
+        # mutate (bool[]): For each genome to make, whether it's a mutated
+        #   child or an unchanged copy of its parent
+        # seed (int): Of all random draws
+        # genome_ids (int[]|None): See Generation
+        # terrain_seed (int|None): See Generation
+        # vectorized (bool): Whether to use a Population, see
+        #   VECTORIZED_REPRODUCTION in evolution.py
+        self.idx = idx
+        self.parents = parents
+        self.parent_positions = parent_positions
+        self.mutate = mutate
+        self.seed = seed
+        self.genome_ids = genome_ids
+        self.terrain_seed = terrain_seed
+        self.ground = None      # see Generation
+        self.vectorized = vectorized
+        # For each genome to make, its EvaluationResult if known, else None
+        self.known_results = [None] * len(parent_positions)
+
+    def __len__(self):
+        return len(self.parent_positions)
+
+    def get_genome_id(self, position):
+        if self.genome_ids is None:
+            return position
+        return self.genome_ids[position]
+
+    def estimate_costs(self, cost_model):
+        # Returns the estimated simulation cost of each genome to make, see
+        # BatchScheduler.make_batches(). Children cost about as much as their
+        # parent, random genomes as much as an average parent, genomes with
+        # known results nothing.
+        parent_costs = [cost_model.estimate(parent) for parent in self.parents]
+        average_cost = sum(parent_costs) / len(parent_costs) if len(parent_costs) > 0 else 0
+        return [0 if result is not None else average_cost if pos is None else parent_costs[pos] \
+            for pos, result in zip(self.parent_positions, self.known_results)]
+
+    def get_known_results(self):
+        # Returns copies of the known results, genome ids are positions in
+        # the plan.
+        results = []
+        for position, result in enumerate(self.known_results):
+            if result is not None:
+                result = copy.copy(result)
+                result.genome_id = position
+                results.append(result)
+        return results
+
+    def split_at(self, split_positions):
+        # Like Generation.split_at(). All parts share the parents.
+        parts = []
+        for positions in split_positions:
+            part = ReproductionPlan(self.idx, self.parents, \
+                [self.parent_positions[pos] for pos in positions], [self.mutate[pos] for pos in positions], \
+                self.seed, [self.get_genome_id(pos) for pos in positions], self.terrain_seed, self.vectorized)
+            part.ground = self.ground
+            part.known_results = [self.known_results[pos] for pos in positions]
+            parts.append(part)
+        return parts
+
+    def make_generation(self):
+        # Returns a Generation with the genomes of the plan, with the plan's
+        # genome ids, terrain and ground. Leaves the state of the random
+        # module as it was.
+        if self.vectorized:
+            genomes = self._make_genomes_vectorized()
+        else:
+            state = random.getstate()
+            genomes = [self._make_genome(pos) for pos in range(len(self))]
+            random.setstate(state)
+        parent_hashes = {}
+        for genome, parent_pos, mutate in zip(genomes, self.parent_positions, self.mutate):
+            if parent_pos is not None and mutate:
+                if parent_pos not in parent_hashes:
+                    parent_hashes[parent_pos] = self.parents[parent_pos].get_content_hash()
+                genome.parent_hash = parent_hashes[parent_pos]
+        generation = Generation(self.idx, genomes, self.genome_ids, self.terrain_seed)
+        generation.ground = self.ground
+        return generation
+
+    def _make_genome(self, position):
+        random.seed(self.seed + self.get_genome_id(position))
+        parent_pos = self.parent_positions[position]
+        if parent_pos is None:
+            return Genome.generate_random(50, 80)
+        if not self.mutate[position]:
+            return self.parents[parent_pos]
+        genome = self.parents[parent_pos].clone()
+        genome.mutate()
+        return genome
+
+    def _make_genomes_vectorized(self):
+        rng = np.random.default_rng([self.seed, self.get_genome_id(0) if len(self) > 0 else 0])
+        children = [pos for pos in range(len(self)) if self.parent_positions[pos] is not None and self.mutate[pos]]
+        randoms = [pos for pos in range(len(self)) if self.parent_positions[pos] is None]
+        genomes = [self.parents[parent_pos] if parent_pos is not None else None \
+            for parent_pos in self.parent_positions]
+        if len(children) > 0:
+            population = Population.from_genomes(self.parents, rng).take( \
+                [self.parent_positions[pos] for pos in children])
+            population.mutate()
+            for pos, genome in zip(children, population.to_genomes()):
+                genomes[pos] = genome
+        for pos, genome in zip(randoms, Population.generate_random(len(randoms), 50, 80, rng).to_genomes()):
+            genomes[pos] = genome
+        return genomes
@@ -0,0 +1,119 @@
+
+import time
+import heapq
+import collections
+
+import numpy as np
+
+
+# Distributes the genomes of a generation over the worker processes. Instead of
+# one chunk per worker, the generation is cut into several smaller batches of
+# about the same estimated cost. The pool hands the batches to the workers as
+# they become idle, most expensive first, so that no worker is left with a lot
+# of work at the end while the others are idle.
+
+
+class CostModel:
+    """
+    Estimates how long simulating a genome takes, from its numbers of nodes
+    and muscles. The weights are calibrated from the measured wall times of
+    batches, by least squares over the most recent batches.
+    """
+
+    # Number of measured batches to calibrate from, older ones are forgotten
+    MAX_OBSERVATIONS = 500
+
+    # Initial weights in seconds, for (constant, per node, per muscle), until
+    # enough batches were measured
+    INITIAL_WEIGHTS = (0.001, 0.002, 0.001)
+
+    def __init__(self):
+        self.weights = np.array(self.INITIAL_WEIGHTS, dtype=np.float64)
+        self._observations = collections.deque(maxlen=self.MAX_OBSERVATIONS)    # tuples (features, wall time)
+
+    def get_features(self, genome):
+        return np.array([1, len(genome.node_types), genome.matrix.get_count()], dtype=np.float64)
+
+    def estimate(self, genome):
+        # Returns the estimated wall time in seconds.
+        return float(self.get_features(genome) @ self.weights)
+
+    def observe(self, genomes, wall_time):
+        # Adds a measurement and recalibrates.
+        # genomes (Genome[]): The genomes of a batch
+        # wall_time (float): How long simulating them took, in seconds
+        if len(genomes) == 0:
+            return
+        features = sum([self.get_features(genome) for genome in genomes])
+        self._observations.append((features, wall_time))
+        self._calibrate()
+
+    def _calibrate(self):
+        # Keeps the current weights if the measurements can't tell them apart
+        # yet or would give a negative cost.
+        if len(self._observations) < len(self.weights):
+            return
+        features = np.array([observation[0] for observation in self._observations])
+        wall_times = np.array([observation[1] for observation in self._observations])
+        if np.linalg.matrix_rank(features) < len(self.weights):
+            return
+        weights = np.linalg.lstsq(features, wall_times, rcond=None)[0]
+        if np.all(weights >= 0):
+            self.weights = weights
+
+
+class BatchScheduler:
+    """
+    Cuts generations into cost-balanced batches and keeps track of how well
+    the workers were utilized.
+    """
+
+    # Number of batches per worker. More batches balance better, but each one
+    # has some overhead for transferring it and setting up its simulation.
+    BATCHES_PER_WORKER = 4
+
+    def __init__(self, workers, cost_model=None):
+        # workers (int): Number of worker processes
+        # cost_model (CostModel|None): None for a new one
+        self.workers = workers
+        self.cost_model = cost_model if cost_model is not None else CostModel()
+        self._time_started = None
+
+    def make_batches(self, generation, costs=None):
+        # Returns the generation split into batches (Generation[]), most
+        # expensive first. Each genome is put into the batch with the lowest
+        # estimated cost so far, most expensive genomes first.
+        # generation (Generation|ReproductionPlan): Anything with split_at()
+        # costs (float[]|None): Estimated cost of each genome, from the cost
+        #   model if None, e.g. for a ReproductionPlan, which has no genomes
+        if costs is None:
+            costs = [self.cost_model.estimate(genome) for genome in generation.genomes]
+        nb_batches = min(len(costs), self.workers * self.BATCHES_PER_WORKER)
+        if nb_batches == 0:
+            return []
+        batches = [(0.0, i, []) for i in range(nb_batches)]     # tuples (cost, idx, positions)
+        for position in sorted(range(len(costs)), key=lambda pos: costs[pos], reverse=True):
+            cost, idx, positions = heapq.heappop(batches)
+            positions.append(position)
+            heapq.heappush(batches, (cost + costs[position], idx, positions))
+        batches.sort(key=lambda batch: batch[0], reverse=True)
+        self._time_started = time.perf_counter()
+        return generation.split_at([positions for cost, idx, positions in batches])
+
+    def finish_generation(self, batches, batch_results):
+        # Calibrates the cost model with the batches' measured times and
+        # returns the utilization of the workers since make_batches(), from 0
+        # to 1.
+        # batches (Generation[]): As returned by make_batches(), or the
+        #   genomes simulated of the ReproductionPlans it returned
+        # batch_results (EvaluationResult[][]): The results of simulating each
+        #   batch, without cached ones, which took none of the workers' time
+        duration = time.perf_counter() - self._time_started
+        busy = 0
+        for batch, results in zip(batches, batch_results):
+            wall_time = sum([result.wall_time for result in results])
+            self.cost_model.observe(batch.genomes, wall_time)
+            busy += wall_time
+        if duration <= 0:
+            return 1
+        return min(1, busy / (duration * self.workers))
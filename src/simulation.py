@@ -1,6 +1,108 @@
 
+import math
+import time
+import random
+import collections
 from abc import ABC, abstractmethod
 
+import numpy as np
+import pymunk
+
+from phenotype import Creature, BodyPool
+from genotype import Genome
+
+
+class FidelityProfile:
+    # A trade-off between physics accuracy and speed. Profiles with another
+    # timestep than the standard one simulate correspondingly more or fewer
+    # ticks, and scale the timers' steps, so that creatures behave the same
+    # in simulated time.
+
+    STANDARD_TIMESTEP_DELTA = 1/100.0
+
+    def __init__(self, name, iterations, timestep_delta):
+        # iterations (int): Solver iterations of the pymunk spaces
+        # timestep_delta (float): Simulated seconds per tick
+        self.name = name
+        self.iterations = iterations
+        self.timestep_delta = timestep_delta
+
+    def __repr__(self):
+        return "{} (iterations={}, timestep_delta={})".format( \
+            self.name, self.iterations, self.timestep_delta)
+
+    def get_tick_scale(self):
+        # How many ticks this profile needs for one tick of the standard timestep
+        return self.STANDARD_TIMESTEP_DELTA / self.timestep_delta
+
+    def get_ticks(self, standard_ticks):
+        # Returns the number of ticks that simulates as long as standard_ticks
+        # ticks with the standard timestep.
+        return int(round(standard_ticks * self.get_tick_scale()))
+
+
+FIDELITY_PROFILES = {profile.name: profile for profile in [
+    FidelityProfile("draft", 5, 1/50.0),
+    FidelityProfile("standard", 10, 1/100.0),
+    FidelityProfile("reference", 20, 1/200.0),
+]}
+
+
+class EvaluationResult:
+    # How a genome performed in a simulation. Small, so that it's cheap to send
+    # back from worker processes, unlike the simulation itself.
+
+    def __init__(self, genome_id, fitness, ticks, max_ticks, final_center=None, wall_time=None, culled=None):
+        # genome_id (int): See Generation.get_genome_id()
+        # ticks (int): For how many ticks the creature was simulated, of max_ticks
+        # final_center (Vec2d|None): Average node position at the end
+        # wall_time (float|None): Seconds spent on the creature, this is the
+        #   simulation's wall time split among its creatures by ticks simulated
+        # culled (str|None): Reason why the creature was removed early, if so
+        self.genome_id = genome_id
+        self.fitness = fitness
+        self.ticks = ticks
+        self.max_ticks = max_ticks
+        self.final_center = final_center
+        self.wall_time = wall_time
+        self.culled = culled
+
+    def __repr__(self):
+        return "genome_id={}, fitness={}, ticks={}".format(self.genome_id, self.fitness, self.ticks)
+
+
+class WorldCache:
+    """
+    Keeps the pymunk spaces with their static ground and the pymunk objects
+    of the creatures alive between simulations, e.g. within a worker process
+    that simulates a part of every generation. See Simulation.release().
+    """
+
+    # Number of distinct grounds (or physics settings) to keep spaces for.
+    # The least recently used ones are dropped.
+    MAX_WORLDS = 2
+
+    def __init__(self):
+        self.body_pool = BodyPool()
+        self._spaces = collections.OrderedDict()    # key -> list of tuples (space, segments)
+
+    def get_space(self, key, create_space):
+        # Returns a tuple (space, segments) of a space that contains only the
+        # ground, or the result of create_space() if none is cached.
+        # key (hashable): Identifies the ground and physics settings
+        spaces = self._spaces.get(key)
+        if not spaces:
+            return create_space()
+        self._spaces.move_to_end(key)
+        return spaces.pop()
+
+    def release_space(self, key, space, segments):
+        # space (Space): Must contain only the ground segments anymore
+        self._spaces.setdefault(key, []).append((space, segments))
+        self._spaces.move_to_end(key)
+        while len(self._spaces) > self.MAX_WORLDS:
+            self._spaces.popitem(last=False)
+
 
 class Simulation(ABC):
     """
@@ -8,24 +110,345 @@ class Simulation(ABC):
     for a set amount of time.
     """
 
-    def __init__(self, generation, max_ticks):
+    # Increase when a change of the simulation code changes results, so that
+    # results of older versions aren't taken from the evaluation store
+    VERSION = 2
+
+    # Advances the timers of all creatures at once (see VectorTimerEngine and
+    # ScheduledTimerEngine), None to update each node and muscle separately
+    TIMER_ENGINE_CLASS = None
+
+    # Creatures that are stuck or exploded are removed from the space early,
+    # with fitness 0. Checked every CULL_CHECK_TICKS ticks, 0 disables culling.
+    # Culling must not change the ranking, see validateCulling.py.
+    CULL_CHECK_TICKS = 100
+    # Stuck: Lay on the ground (fitness 0) at every check within that many
+    # ticks, and the average node position didn't move that far meanwhile,
+    # 0 disables it. Removing creatures from a space slightly changes the
+    # results of the others in it, so creatures that share a space are only
+    # culled as stuck together.
+    CULL_STUCK_WINDOW_TICKS = 3000
+    CULL_STUCK_MIN_DISTANCE = 5
+    # Exploded: Any body's position or velocity is non-finite or beyond these
+    CULL_MAX_COORDINATE = 1e6
+    CULL_MAX_VELOCITY = 1e5
+
+    CULL_REASON_STUCK = "stuck"
+    CULL_REASON_EXPLODED = "exploded"
+
+    # How many creatures share a pymunk space. Creatures never collide with
+    # each other, but the broadphase still considers their overlapping shapes,
+    # so smaller spaces are faster (see benchmark.py). Creatures in a shared
+    # space only affect each other through the order in which the solver
+    # iterates over them, so results can differ slightly between settings.
+    # The grouping is fixed before the first step.
+    # 0 puts all creatures in one space.
+    SPACE_PARTITIONING_SHARED = 0
+    SPACE_PARTITIONING_PER_CREATURE = 1
+    SPACE_PARTITIONING = 5
+
+    # Use pymunk's spatial hash instead of its bounding box tree for the
+    # broadphase. The cell size is derived from the node radii, the number of
+    # cells from the number of shapes in the space.
+    USE_SPATIAL_HASH = False
+    SPATIAL_HASH_CELLS_PER_SHAPE = 10
+    SPATIAL_HASH_MIN_CELLS = 1000
+
+    # To be set by subclasses
+    ITERATIONS = None
+    TIMESTEMP_DELTA = None
+    DAMPING = None
+    GRAVITY = None
+    GROUND_LEVEL = None
+    SPAWN_AREA_LENGTH = None
+    GROUND_FRICTION = None
+
+    def __init__(self, generation, max_ticks, fidelity=None, world_cache=None):
+        # generation (Generation): Among other things, contains genomes for creatures
+        # max_ticks (int): For how many ticks to simulate the creature before
+        #   measuring its fitness and terminating the simulation, see
+        #   FidelityProfile.get_ticks()
+        # fidelity (FidelityProfile|None): None for the ITERATIONS and
+        #   TIMESTEMP_DELTA of the class
+        # world_cache (WorldCache|None): Where to take spaces and pymunk objects
+        #   from, call release() when done to return them. None to create new ones.
         self.generation = generation
         self.max_ticks = max_ticks
         self.cur_ticks = 0  # number of timesteps simulated so far
+        self._time_created = time.perf_counter()
+
+        # Physics settings
+        if fidelity is None:
+            fidelity = FidelityProfile(None, self.ITERATIONS, self.TIMESTEMP_DELTA)
+        self.fidelity = fidelity
+        self._tick_scale = fidelity.get_tick_scale()
+
+        # The simulated world
+        self.creatures = []
+        self.ground = None      # array of points, see generate_ground()
+        self.spaces = []
+        self.space = None       # the first of self.spaces
+        self.segments = []      # ground segments of self.space
+        self.world_cache = world_cache
+        self._world_key = None
+        self._space_segments = []   # ground segments of each of self.spaces
+
+        # Each element is a tuple (fitness, creature).
+        # Sorted descendingly, best to worst fitness.
+        # Set by self.evaluate().
+        self.ranked_creatures = []
+
+        # Each element is a tuple (tick, reason, creature), in order of culling.
+        self.culled_creatures = []
+        self._cull_check_ticks = int(self.CULL_CHECK_TICKS * self._tick_scale)
+        self._cull_stuck_window_ticks = int(self.CULL_STUCK_WINDOW_TICKS * self._tick_scale)
+        self._next_cull_check = self._cull_check_ticks
+        self._stuck_anchors = {}    # creature -> tuple (tick, average node position)
+        self._space_creatures = []  # creatures of each of self.spaces
+
+        self._create_world()
+        self._create_timer_engine()
+
+    @classmethod
+    @abstractmethod
+    def _generate_ground(cls, rng):
+        # Returns the ground as a list of points (x, y), each segment of the
+        # ground starts at a point and ends at the next one.
+        # rng (Random): To draw random terrain from
+        pass
+
+    @classmethod
+    def generate_ground(cls, seed=None):
+        # Returns the ground as an array of shape (number of points, 2), see
+        # _generate_ground(). The same seed always gives the same ground.
+        # seed (int|None): None to draw from the global random generator
+        rng = random if seed is None else random.Random(seed)
+        return np.array(cls._generate_ground(rng), dtype=np.float64)
 
     @abstractmethod
     def get_fitness(self, creature):
         # Get the fitness of the specified creature
         pass
 
-    @abstractmethod
+    def _create_space(self, ground):
+        # Returns a new space, containing only the ground, and the ground segments.
+        ground_points = ground.tolist()
+        space = pymunk.Space()
+        space.iterations = self.fidelity.iterations
+        space.damping = self.DAMPING
+        space.gravity = self.GRAVITY
+        segments = []
+        for i in range(len(ground_points)-1):
+            segment = pymunk.Segment(space.static_body, ground_points[i], ground_points[i+1], 1.0)
+            segment.friction = self.GROUND_FRICTION
+            space.add(segment)
+            segments.append(segment)
+        return space, segments
+
+    def _get_world_key(self, ground):
+        # Returns what identifies a space of this simulation in the world
+        # cache, or None if spaces can't be reused.
+        if self.world_cache is None or self.USE_SPATIAL_HASH:
+            # Switching to the spatial hash can't be undone
+            return None
+        return (type(self).__name__, ground.tobytes(), \
+            self.fidelity.iterations, self.DAMPING, tuple(self.GRAVITY), self.GROUND_FRICTION)
+
+    def _get_space(self, ground):
+        if self._world_key is None:
+            return self._create_space(ground)
+        return self.world_cache.get_space(self._world_key, \
+            lambda: self._create_space(ground))
+
+    def _use_spatial_hash(self, space, creatures):
+        radii = [node.radius for creature in creatures for node in creature.nodes]
+        if len(radii) == 0:
+            return
+        dim = 2 * sum(radii) / len(radii)
+        count = max(self.SPATIAL_HASH_MIN_CELLS, self.SPATIAL_HASH_CELLS_PER_SHAPE * len(space.shapes))
+        space.use_spatial_hash(dim, count)
+
+    def _create_world(self):
+        # Creates the spaces with the ground and the creatures in them.
+        # The ground is usually generated once for the whole generation, see
+        # Generation.ground
+        self.ground = self.generation.ground
+        if self.ground is None:
+            self.ground = self.generate_ground(self.generation.terrain_seed)
+        self._world_key = self._get_world_key(self.ground)
+        body_pool = None if self.world_cache is None else self.world_cache.body_pool
+        creatures_per_space = self.SPACE_PARTITIONING
+        if creatures_per_space <= 0:
+            creatures_per_space = max(1, len(self.generation.genomes))
+
+        x = -self.SPAWN_AREA_LENGTH/2 - Genome.BB_WIDTH/2
+        y = self.GROUND_LEVEL - Genome.BB_HEIGHT - 20
+        space_creatures = self._space_creatures
+        for idx, genome in enumerate(self.generation.genomes):
+            if idx % creatures_per_space == 0:
+                space, segments = self._get_space(self.ground)
+                self.spaces.append(space)
+                self._space_segments.append(segments)
+                space_creatures.append([])
+                if self.space is None:
+                    self.space, self.segments = space, segments
+            creature = Creature(space, genome, (x, y), body_pool)
+            self.creatures.append(creature)
+            space_creatures[-1].append(creature)
+
+        if self.space is None:
+            self.space, self.segments = self._get_space(self.ground)
+            self.spaces.append(self.space)
+            self._space_segments.append(self.segments)
+        if self.USE_SPATIAL_HASH:
+            for space, creatures in zip(self.spaces, space_creatures):
+                self._use_spatial_hash(space, creatures)
+
     def evaluate(self):
         # Updates the evaluation member variables.
-        pass
+        tups = []
+        for creature in self.creatures:
+            if creature.frozen_fitness is not None:
+                fitness = creature.frozen_fitness
+            else:
+                fitness = self.get_fitness(creature)
+            tups.append((fitness, creature))
+        tups.sort(key = lambda tup: tup[0], reverse=True)
+        self.ranked_creatures = tups
 
-    @abstractmethod
     def _do_timestep_impl(self):
-        pass
+        # Runs the next timestep
+
+        # Update timers
+        self._update_timers()
+
+        # Update physics
+        for space in self.spaces:
+            space.step(self.fidelity.timestep_delta)
+
+        # Goto next tick
+        self.cur_ticks += 1
+
+    def get_results(self):
+        # Returns an EvaluationResult for each creature, in order of the
+        # generation's genomes. Call evaluate() first.
+        fitnesses = {id(creature): fitness for fitness, creature in self.ranked_creatures}
+        culls = {id(creature): (tick, reason) for tick, reason, creature in self.culled_creatures}
+        ticks = [culls[id(creature)][0] if id(creature) in culls else self.cur_ticks \
+            for creature in self.creatures]
+        wall_time = time.perf_counter() - self._time_created
+        total_ticks = max(1, sum(ticks))
+        results = []
+        for idx, creature in enumerate(self.creatures):
+            cull = culls.get(id(creature))
+            results.append(EvaluationResult(self.generation.get_genome_id(idx), \
+                fitnesses[id(creature)], ticks[idx], self.max_ticks, \
+                creature.get_average_node_position(), wall_time * ticks[idx] / total_ticks, \
+                None if cull is None else cull[1]))
+        return results
+
+    def release(self):
+        # Removes all creatures and returns the spaces and pymunk objects to
+        # the world cache. Call get_results() first, the simulation can't be
+        # used anymore afterwards.
+        if self.world_cache is None:
+            return
+        for creature in self.creatures:
+            if creature.frozen_fitness is None:     # culled ones are deleted already
+                creature.delete()
+        if self._world_key is not None:
+            for space, segments in zip(self.spaces, self._space_segments):
+                self.world_cache.release_space(self._world_key, space, segments)
+        self.spaces, self._space_segments = [], []
+        self.space, self.segments = None, []
+
+    def _iterate_timers(self, creature):
+        for node in creature.nodes:
+            yield node.timer
+        for muscle in creature.muscles:
+            yield muscle.timer
+
+    def _create_timer_engine(self):
+        # Needs to be called once, after all creatures were created.
+        if self._tick_scale != 1:
+            for creature in self.creatures:
+                for timer in self._iterate_timers(creature):
+                    timer.set_step_scale(1 / self._tick_scale)
+        self.timer_engine = None
+        if self.TIMER_ENGINE_CLASS is None:
+            return
+        self.timer_engine = self.TIMER_ENGINE_CLASS()
+        for creature in self.creatures:
+            for timer in self._iterate_timers(creature):
+                self.timer_engine.add(timer)
+
+    def _update_timers(self):
+        if self.timer_engine is None:
+            for creature in self.creatures:
+                if creature.frozen_fitness is not None:
+                    continue
+                for node in creature.nodes:
+                    node.update()
+                for muscle in creature.muscles:
+                    muscle.update()
+        else:
+            self.timer_engine.update()
+
+    def sync_timers(self):
+        # Makes the timer objects' values up to date, needed for drawing them.
+        if self.timer_engine is not None:
+            self.timer_engine.sync()
+
+    def _is_exploded(self, creature):
+        for node in creature.nodes:
+            pos, vel = node.body.position, node.body.velocity
+            if not (math.isfinite(pos.x) and math.isfinite(pos.y) \
+                and math.isfinite(vel.x) and math.isfinite(vel.y)):
+                return True
+            if abs(pos.x) > self.CULL_MAX_COORDINATE or abs(pos.y) > self.CULL_MAX_COORDINATE \
+                or vel.length > self.CULL_MAX_VELOCITY:
+                return True
+        return False
+
+    def _is_stuck(self, creature):
+        if self._cull_stuck_window_ticks <= 0:
+            return False
+        if self.get_fitness(creature) != 0:
+            self._stuck_anchors.pop(creature, None)
+            return False
+        center = creature.get_average_node_position()
+        anchor = self._stuck_anchors.get(creature)
+        if anchor is None or center.get_distance(anchor[1]) >= self.CULL_STUCK_MIN_DISTANCE:
+            self._stuck_anchors[creature] = (self.cur_ticks, center)
+            return False
+        return self.cur_ticks - anchor[0] >= self._cull_stuck_window_ticks
+
+    def _cull_creatures(self):
+        # Removes stuck and exploded creatures from the simulation.
+        for creatures in self._space_creatures:
+            stuck = []
+            all_stuck = True
+            for creature in creatures:
+                if creature.frozen_fitness is not None:
+                    continue
+                if self._is_exploded(creature):
+                    self._cull(creature, self.CULL_REASON_EXPLODED)
+                elif self._is_stuck(creature):
+                    stuck.append(creature)
+                else:
+                    all_stuck = False
+            if all_stuck:
+                for creature in stuck:
+                    self._cull(creature, self.CULL_REASON_STUCK)
+
+    def _cull(self, creature, reason):
+        creature.frozen_fitness = 0
+        creature.delete()
+        if self.timer_engine is not None:
+            for timer in self._iterate_timers(creature):
+                self.timer_engine.remove(timer)
+        self._stuck_anchors.pop(creature, None)
+        self.culled_creatures.append((self.cur_ticks, reason, creature))
 
     def get_percent_done(self):
         return int(self.cur_ticks / self.max_ticks * 100)
@@ -37,4 +460,7 @@ class Simulation(ABC):
         # Runs the next timestep
         self.cur_ticks += 1
         self._do_timestep_impl()
+        if self._cull_check_ticks > 0 and self.cur_ticks >= self._next_cull_check:
+            self._next_cull_check = self.cur_ticks + self._cull_check_ticks
+            self._cull_creatures()
 
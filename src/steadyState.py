@@ -0,0 +1,112 @@
+
+import copy
+import time
+import random
+import bisect
+
+from generation import *
+
+
+class SteadyStateEvolution:
+    """
+    Evolution without a barrier between generations: each evaluated genome
+    joins a ranked population of bounded size right away, and a new genome is
+    bred from the best ones of the population whenever one is needed, so the
+    workers never wait for the slowest genome of a generation.
+    Progress is reported in generation equivalents, a FinishedGeneration of
+    every population_size evaluated genomes, see add_results().
+    All genomes are simulated on the terrain of the initial generation, to
+    keep the fitnesses in the population comparable.
+    """
+
+    def __init__(self, initial_generation, population_size, nb_survivors, nb_randoms, workers):
+        # initial_generation (Generation): Its genomes are evaluated first, it
+        #   must have a ground, see generate_ground()
+        # population_size (int): Number of genomes in the ranked population,
+        #   and of evaluated genomes per generation equivalent
+        # nb_survivors (int): The best genomes of the population that children
+        #   are bred from
+        # nb_randoms (int): Number of random genomes per population_size bred
+        #   genomes, on average
+        # workers (int): Number of worker processes, to measure utilization
+        self.idx = initial_generation.idx     # of the current generation equivalent
+        self.terrain_seed = initial_generation.terrain_seed
+        self.ground = initial_generation.ground
+        self.population_size = population_size
+        self.nb_survivors = nb_survivors
+        self.nb_randoms = nb_randoms
+        self.workers = workers
+        # Each element is a tuple (fitness, genome), best to worst fitness.
+        # Genomes with the same fitness keep the order they were evaluated in.
+        self.ranked_genomes = []
+        self._initial_genomes = list(initial_generation.genomes)
+        self._nb_initial_bred = 0
+        # The genomes evaluated since the current generation equivalent started
+        self._genomes = []
+        self._results = []
+        self._nb_cached = 0
+        self._busy_time = 0
+        self._start_times = (time.process_time(), time.perf_counter())
+
+    def breed(self):
+        # Returns a Generation with a new genome to evaluate, with the ground,
+        # or None while there's nothing to breed from. The genomes of the
+        # initial generation come first.
+        if self._nb_initial_bred < len(self._initial_genomes):
+            genome = self._initial_genomes[self._nb_initial_bred]
+            self._nb_initial_bred += 1
+        elif len(self.ranked_genomes) == 0:
+            return None
+        elif random.randrange(self.population_size) < self.nb_randoms:
+            genome = Genome.generate_random(50, 80)
+        else:
+            parent_genome = random.choice(self.ranked_genomes[0:self.nb_survivors])[1]
+            genome = parent_genome.clone()
+            genome.parent_hash = parent_genome.get_content_hash()
+            genome.mutate()
+        batch = Generation(self.idx, [genome], terrain_seed=self.terrain_seed)
+        batch.ground = self.ground
+        return batch
+
+    def add_results(self, batch, results, nb_cached=0, busy_time=0):
+        # Adds the evaluated genomes to the population. Returns the
+        # FinishedGenerations of the generation equivalents that were
+        # completed by them, usually none.
+        # batch (Generation): As returned by breed()
+        # results (EvaluationResult[]): For each genome of the batch, genome
+        #   ids are positions in the batch
+        # nb_cached (int): Number of results that weren't simulated
+        # busy_time (float): Seconds the workers spent simulating the batch
+        finished_generations = []
+        self._nb_cached += nb_cached
+        self._busy_time += busy_time
+        for result in results:
+            genome = batch.genomes[result.genome_id]
+            position = bisect.bisect_right(self.ranked_genomes, -result.fitness, key=lambda rg: -rg[0])
+            self.ranked_genomes.insert(position, (result.fitness, genome))
+            del self.ranked_genomes[self.population_size:]
+
+            result = copy.copy(result)
+            result.genome_id = len(self._genomes)
+            self._genomes.append(genome)
+            self._results.append(result)
+            if len(self._genomes) == self.population_size:
+                finished_generations.append(self._finish_generation())
+        return finished_generations
+
+    def get_percent_done(self):
+        # Of the current generation equivalent
+        return int(len(self._genomes) / self.population_size * 100)
+
+    def _finish_generation(self):
+        cpu_time, wall_time = (time.process_time(), time.perf_counter())
+        elapsed = wall_time - self._start_times[1]
+        utilization, main_cpu = (None, None) if elapsed == 0 else \
+            (min(1, self._busy_time / (self.workers * elapsed)), (cpu_time - self._start_times[0]) / elapsed)
+        generation = Generation(self.idx, self._genomes, terrain_seed=self.terrain_seed)
+        generation.ground = self.ground
+        fg = FinishedGeneration(generation, self._results, utilization, self._nb_cached, main_cpu)
+        self.idx += 1
+        self._genomes, self._results, self._nb_cached, self._busy_time = [], [], 0, 0
+        self._start_times = (cpu_time, wall_time)
+        return fg
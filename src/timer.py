@@ -1,10 +1,13 @@
 import random
 
 import math
+import heapq
+
+import numpy as np
 
 from genotype import *
 from phenotype import *
-from utils import stay_in_bounds
+from utils import stay_in_bounds, set_slots_state
 
 
 # The classes in this file extend the genotype/phenotype base classes with code
@@ -22,6 +25,10 @@ from utils import stay_in_bounds
 
 
 class TimerType:
+    # Like node types and muscle types, timer types may be shared by several
+    # genomes, so only mutate copies of them.
+
+    __slots__ = ("start", "step", "true_from", "false_from")
 
     MIN_STEP = math.pi / 200
     MAX_STEP = math.pi / 20
@@ -38,6 +45,12 @@ class TimerType:
         self.true_from = true_from
         self.false_from = false_from
 
+    def __setstate__(self, state):
+        set_slots_state(self, state)
+
+    def copy(self):
+        return TimerType(self.start, self.step, self.true_from, self.false_from)
+
     @staticmethod
     def generate_random():
         start = random.uniform(0, 2*math.pi)
@@ -46,6 +59,9 @@ class TimerType:
         false_from = random.uniform(0, 2*math.pi)
         return TimerType(start, step, true_from, false_from)
 
+    def get_content(self):
+        return (float(self.start), float(self.step), float(self.true_from), float(self.false_from))
+
     def scale_step(self, factor):
         # A special form of mutation
         self.step *= factor
@@ -76,11 +92,17 @@ class Timer:
         #   Gets passed a bool that indicates which zone was entered.
         self.timer_type = timer_type
         self.value = timer_type.start
+        self.step = timer_type.step     # may be scaled, see set_step_scale()
         self.callback = callback
 
+    def set_step_scale(self, factor):
+        # For simulations with a timestep other than the standard one, so that
+        # the timer keeps its pace in simulated time.
+        self.step = self.timer_type.step * factor
+
     def update(self):
         # Invoke this once per timestep
-        next_value = (self.value + self.timer_type.step) % (2 * math.pi)
+        next_value = (self.value + self.step) % (2 * math.pi)
         if self.value < self.timer_type.true_from \
             and next_value >= self.timer_type.true_from:
             self.callback(True)
@@ -90,8 +112,225 @@ class Timer:
         self.value = next_value
 
 
+class VectorTimerEngine:
+    # Advances a set of timers at once, keeping their state in NumPy arrays
+    # instead of invoking Timer.update on each of them. Callbacks are only
+    # invoked for the timers that actually entered a different zone, so the
+    # per-tick Python overhead no longer grows with the number of timers.
+    # Produces the same zone changes as Timer.update. Note that the timers'
+    # values are only written back to the Timer objects by sync().
+
+    TWO_PI = 2 * math.pi
+
+    def __init__(self):
+        self._timers = []
+        self._indices = {}      # id(timer) -> position in self._timers
+        self._removed = []      # positions of removed timers
+        self._is_built = False
+
+    def add(self, timer):
+        self._indices[id(timer)] = len(self._timers)
+        self._timers.append(timer)
+        self._is_built = False
+
+    def remove(self, timer):
+        # The timer won't be advanced anymore, nor will its callback be invoked.
+        idx = self._indices[id(timer)]
+        self._removed.append(idx)
+        if self._is_built:
+            self._active[idx] = False
+
+    def _build(self):
+        # (Re)creates the arrays, taking over the current values of the timers.
+        self._values = np.array([t.value for t in self._timers], dtype=np.float64)
+        self._steps = np.array([t.step for t in self._timers], dtype=np.float64)
+        self._true_from = np.array([t.timer_type.true_from for t in self._timers], dtype=np.float64)
+        self._false_from = np.array([t.timer_type.false_from for t in self._timers], dtype=np.float64)
+        self._active = np.ones(len(self._timers), dtype=bool)
+        self._active[self._removed] = False
+        self._is_built = True
+
+    def update(self):
+        # Invoke this once per timestep
+        if not self._is_built:
+            self._build()
+        next_values = np.mod(self._values + self._steps, self.TWO_PI)
+        enters_true = (self._values < self._true_from) & (next_values >= self._true_from) & self._active
+        enters_false = (self._values < self._false_from) & (next_values >= self._false_from) & self._active
+        self._values = next_values
+        # Like in Timer.update, entering the True zone is handled first, in case
+        # both zones are entered in the same timestep
+        for idx in np.flatnonzero(enters_true):
+            self._timers[idx].callback(True)
+        for idx in np.flatnonzero(enters_false):
+            self._timers[idx].callback(False)
+
+    def sync(self):
+        # Writes the current values back to the Timer objects, e.g. for drawing.
+        if not self._is_built:
+            return
+        for timer, value in zip(self._timers, self._values.tolist()):
+            timer.value = value
+
+
+class ScheduledTimerEngine:
+    # Advances a set of timers, but only touches a timer on the timesteps where
+    # it enters a different zone. As the step of a timer is constant, the
+    # timestep of its next zone change is computed in advance and kept in a
+    # priority queue, so the per-tick cost is proportional to the number of
+    # zone changes instead of the number of timers.
+    # Produces exactly the same zone changes as Timer.update, including its
+    # floating point rounding (see _advance). Note that the timers' values are
+    # only written back to the Timer objects by sync().
+
+    TWO_PI = 2 * math.pi
+
+    # Zone changes are searched at most that many timesteps ahead, timers
+    # without zone change in that time are rescheduled afterwards
+    LOOKAHEAD_TICKS = 10000
+
+    BINADE_CACHE_SIZE = 100000
+    _binade_cache = {}      # (step, exponent) -> see _binade_progression
+
+    def __init__(self):
+        self._timers = []
+        self._value_ticks = []  # per timer: timestep its value in self._values refers to
+        self._values = []
+        self._queue = []        # heap of tuples (tick, timer index, value, enters_true, enters_false)
+        self._indices = {}      # id(timer) -> timer index
+        self._removed = set()   # indices of removed timers
+        self._cur_ticks = 0
+
+    def add(self, timer):
+        idx = len(self._timers)
+        self._indices[id(timer)] = idx
+        self._timers.append(timer)
+        self._value_ticks.append(self._cur_ticks)
+        self._values.append(timer.value)
+        self._schedule(idx)
+
+    def remove(self, timer):
+        # The timer won't be advanced anymore, nor will its callback be invoked.
+        self._removed.add(self._indices[id(timer)])
+
+    def _schedule(self, idx):
+        # Queues the next zone change of the timer.
+        timer = self._timers[idx]
+        tt = timer.timer_type
+        steps, value, enters_true, enters_false = self._advance( \
+            self._values[idx], timer.step, tt.true_from, tt.false_from, self.LOOKAHEAD_TICKS)
+        if steps is None:
+            return  # The timer's value doesn't change anymore
+        heapq.heappush(self._queue, \
+            (self._value_ticks[idx] + steps, idx, value, enters_true, enters_false))
+
+    def update(self):
+        # Invoke this once per timestep
+        self._cur_ticks += 1
+        while len(self._queue) > 0 and self._queue[0][0] <= self._cur_ticks:
+            tick, idx, value, enters_true, enters_false = heapq.heappop(self._queue)
+            if idx in self._removed:
+                continue
+            self._value_ticks[idx] = tick
+            self._values[idx] = value
+            if enters_true:
+                self._timers[idx].callback(True)
+            if enters_false:
+                self._timers[idx].callback(False)
+            self._schedule(idx)
+
+    def sync(self):
+        # Writes the current values back to the Timer objects, e.g. for drawing.
+        for idx, timer in enumerate(self._timers):
+            if idx in self._removed:
+                continue
+            steps = self._cur_ticks - self._value_ticks[idx]
+            value = self._values[idx]
+            while steps > 0:
+                done, value, _, _ = self._advance(value, timer.step, None, None, steps)
+                if done is None:
+                    break
+                steps -= done
+            timer.value = value
+
+    @classmethod
+    def _binade_progression(cls, step, exponent):
+        # Returns a tuple (u, R, bound) for values in the binade [2^(e-1), 2^e):
+        # its ulp u, the multiple R of u that adding the step effectively adds,
+        # and the largest multiple of u the value may have after a step without
+        # leaving the binade or wrapping around. Returns None if adding the step
+        # is a tie, whose rounding depends on the value.
+        key = (step, exponent)
+        if key not in cls._binade_cache:
+            u = math.ldexp(1.0, exponent - 53)
+            q = step / u
+            r_floor = math.floor(q)
+            if q - r_floor == 0.5:
+                binade = None
+            else:
+                R = r_floor + 1 if q - r_floor > 0.5 else r_floor
+                bound = 2**53 - 2           # stay clear of the next binade
+                if exponent == 3:           # the binade containing 2*pi
+                    bound = min(bound, int(cls.TWO_PI / u) - 1)
+                binade = (u, R, bound)
+            if len(cls._binade_cache) >= cls.BINADE_CACHE_SIZE:
+                cls._binade_cache.clear()
+            cls._binade_cache[key] = binade
+        return cls._binade_cache[key]
+
+    @classmethod
+    def _advance(cls, value, step, true_from, false_from, max_steps):
+        # Advances a timer value like repeated calls of Timer.update would, until
+        # a zone is entered or max_steps steps were made. Returns a tuple
+        # (steps, value, enters_true, enters_false), steps is None if the value
+        # never changes anymore.
+        # true_from, false_from (float|None): None to ignore that zone
+        #
+        # Within one binade [2^(e-1), 2^e) all floats are multiples of the same
+        # ulp u, so as long as the value stays inside it, adding the step always
+        # rounds to adding the same multiple R of u, i.e., the values form an
+        # exact arithmetic progression and thresholds can be computed with
+        # integers. Steps that leave the binade or wrap around are made singly.
+        done = 0
+        while done < max_steps:
+            mantissa, exponent = math.frexp(value)
+            if value > 0 and exponent > -900:
+                binade = cls._binade_progression(step, exponent)
+                if binade is not None:
+                    u, R, bound = binade
+                    if R == 0:
+                        return None, value, False, False
+                    V = int(value / u)
+                    nb_steps = min((bound - V) // R, max_steps - done)
+                    if nb_steps > 0:
+                        # Steps until the thresholds are reached, if within reach
+                        k_true, k_false = nb_steps + 1, nb_steps + 1
+                        if true_from is not None and value < true_from:
+                            k_true = max(1, (math.ceil(true_from / u) - V + R - 1) // R)
+                        if false_from is not None and value < false_from:
+                            k_false = max(1, (math.ceil(false_from / u) - V + R - 1) // R)
+                        k = min(nb_steps, k_true, k_false)
+                        done += k
+                        value = (V + k * R) * u
+                        if k_true == k or k_false == k:
+                            return done, value, k_true == k, k_false == k
+                        if done == max_steps:
+                            break
+            # A single step, exactly like Timer.update
+            next_value = (value + step) % cls.TWO_PI
+            enters_true = true_from is not None and value < true_from and next_value >= true_from
+            enters_false = false_from is not None and value < false_from and next_value >= false_from
+            value = next_value
+            done += 1
+            if enters_true or enters_false:
+                return done, value, enters_true, enters_false
+        return done, value, False, False
+
+
 class TimerNodeType(NodeType):
 
+    __slots__ = ("tt",)
+
     def __init__(self, idx, bb_pos, mass, tt):
         super().__init__(idx, bb_pos, mass)
         self.tt = tt
@@ -100,9 +339,13 @@ class TimerNodeType(NodeType):
     def generate_random(cls, idx):
         node_type = NodeType.generate_random(idx)
         if node_type is None: return None
-        node_type.__class__ = TimerNodeType     # cast
-        node_type.tt = TimerType.generate_random()
-        return node_type
+        return cls(node_type.idx, node_type.bb_position, node_type.mass, TimerType.generate_random())
+
+    def copy(self):
+        return TimerNodeType(self.idx, self.bb_position, self.mass, self.tt.copy())
+
+    def get_content(self):
+        return super().get_content() + self.tt.get_content()
 
     def mutate(self):
         super().mutate()
@@ -111,17 +354,25 @@ class TimerNodeType(NodeType):
 
 class TimerMuscleType(MuscleType):
 
-    def __init__(self, node_type_1, node_type_2, max_force, damping, stiffness, contract_factor, tt):
-        super().__init__(node_type_1, node_type_2, max_force, damping, stiffness, contract_factor)
+    __slots__ = ("tt",)
+
+    def __init__(self, node_idx_1, node_idx_2, max_force, damping, stiffness, contract_factor, tt):
+        super().__init__(node_idx_1, node_idx_2, max_force, damping, stiffness, contract_factor)
         self.tt = tt
 
     @classmethod
     def generate_random(cls, node_type_1, node_type_2):
-        muscle_type = MuscleType.generate_random(node_type_1, node_type_2)
-        if muscle_type is None: return None
-        muscle_type.__class__ = TimerMuscleType     # cast
-        muscle_type.tt = TimerType.generate_random()
-        return muscle_type
+        mt = MuscleType.generate_random(node_type_1, node_type_2)
+        if mt is None: return None
+        return cls(mt.node_idx_1, mt.node_idx_2, mt.max_force, mt.damping, mt.stiffness, \
+            mt.contract_factor, TimerType.generate_random())
+
+    def copy(self):
+        return TimerMuscleType(self.node_idx_1, self.node_idx_2, self.max_force, self.damping, \
+            self.stiffness, self.contract_factor, self.tt.copy())
+
+    def get_content(self):
+        return super().get_content() + self.tt.get_content()
 
     def scale_timer_step(self, factor):
         # A special form of mutation
@@ -0,0 +1,352 @@
+
+import time
+import queue
+import struct
+
+import numpy as np
+
+
+class TrajectoryRecorder:
+    # Records the node positions, sticky nodes and contracted muscles of all
+    # creatures of a simulation, tick by tick, see Trajectory.write().
+
+    def __init__(self, simulation, keep_ticks=None):
+        # simulation (Simulation): Call record() once before its first
+        #   timestep and after each one
+        # keep_ticks (int|None): Number of the last recorded ticks to keep,
+        #   None for all
+        self.simulation = simulation
+        self.keep_ticks = keep_ticks
+        self.nb_ticks = 0       # number of recorded ticks
+        self.node_offsets, self.muscle_offsets = [0], [0]
+        for creature in simulation.creatures:
+            self.node_offsets.append(self.node_offsets[-1] + len(creature.nodes))
+            self.muscle_offsets.append(self.muscle_offsets[-1] + len(creature.muscles))
+        self.muscle_nodes = [(muscle.muscle_type.node_idx_1, muscle.muscle_type.node_idx_2) \
+            for creature in simulation.creatures for muscle in creature.muscles]
+        self.node_radii = [node.radius for creature in simulation.creatures for node in creature.nodes]
+        self.positions = []     # float32[nodes][2] per tick
+        self.sticky = []        # bool[nodes] per tick
+        self.contracted = []    # bool[muscles] per tick
+        # Tick from which on each creature was culled, None if it wasn't
+        self.end_ticks = [None] * len(simulation.creatures)
+
+    def record(self):
+        tick = self.nb_ticks
+        positions = np.empty((self.node_offsets[-1], 2), dtype=np.float32)
+        sticky = np.empty(self.node_offsets[-1], dtype=bool)
+        contracted = np.empty(self.muscle_offsets[-1], dtype=bool)
+        for idx, creature in enumerate(self.simulation.creatures):
+            n_start, n_end = self.node_offsets[idx:idx+2]
+            m_start, m_end = self.muscle_offsets[idx:idx+2]
+            if creature.frozen_fitness is not None:
+                # Its bodies may be reused already, keep its last state
+                if self.end_ticks[idx] is None:
+                    self.end_ticks[idx] = tick
+                positions[n_start:n_end] = self.positions[-1][n_start:n_end]
+                sticky[n_start:n_end] = self.sticky[-1][n_start:n_end]
+                contracted[m_start:m_end] = self.contracted[-1][m_start:m_end]
+                continue
+            positions[n_start:n_end] = [tuple(node.body.position) for node in creature.nodes]
+            sticky[n_start:n_end] = [node.is_sticky for node in creature.nodes]
+            contracted[m_start:m_end] = [muscle.is_contracted for muscle in creature.muscles]
+        self.positions.append(positions)
+        self.sticky.append(sticky)
+        self.contracted.append(contracted)
+        self.nb_ticks += 1
+        if self.keep_ticks is not None:
+            del self.positions[:-self.keep_ticks], self.sticky[:-self.keep_ticks], \
+                self.contracted[:-self.keep_ticks]
+
+
+class _CreatureFrames:
+    # Frames of creatures, where the arrays of all creatures' nodes and
+    # muscles are concatenated. Subclasses set _node_offsets, _muscle_offsets
+    # and _muscle_nodes, see Trajectory.
+
+    def get_nodes(self, creature_idx):
+        # Returns the slice of the creature's nodes in the arrays of a frame.
+        return slice(int(self._node_offsets[creature_idx]), int(self._node_offsets[creature_idx + 1]))
+
+    def get_muscles(self, creature_idx):
+        # Returns a tuple (slice, node indices): The slice of the creature's
+        # muscles in the arrays of a frame, and the indices of their nodes
+        # within the creature, int64[muscles][2].
+        muscles = slice(int(self._muscle_offsets[creature_idx]), int(self._muscle_offsets[creature_idx + 1]))
+        return muscles, self._muscle_nodes[muscles]
+
+    def get_bounding_boxes(self, positions):
+        # Returns a tuple (mins, maxs) of the creatures' bounding boxes in a
+        # frame, float[creatures][2] each, like Creature.get_bounding_box(),
+        # but including the nodes' radii.
+        starts = np.asarray(self._node_offsets[:-1], dtype=np.int64)
+        radii = self.node_radii[:, None]
+        return np.minimum.reduceat(positions - radii, starts), np.maximum.reduceat(positions + radii, starts)
+
+    def get_centers(self, positions):
+        # Returns the average node position of each creature in a frame,
+        # float[creatures][2].
+        starts = np.asarray(self._node_offsets[:-1], dtype=np.int64)
+        counts = np.diff(np.asarray(self._node_offsets, dtype=np.int64))
+        return np.add.reduceat(positions, starts) / counts[:, None]
+
+
+class Trajectory(_CreatureFrames):
+    """
+    A recording of creatures of a simulation, to replay them without
+    simulating them again. Memory-mapped like GenomeArchive, so opening it
+    is fast and any tick can be read right away.
+    The positions are stored in chunks of keyframe_interval ticks. Each
+    chunk starts with a keyframe of the exact positions, the positions of its
+    ticks are stored as int16 offsets from the keyframe, with a scale per
+    chunk and node:
+
+    header          MAGIC, VERSION, sizes, generation idx, timestep
+    node_offsets    int64[creatures + 1], first node of each creature
+    muscle_offsets  int64[creatures + 1], first muscle of each creature
+    muscle_nodes    int64[muscles][2], node indices within the creature
+    fitnesses       float64[creatures]
+    end_ticks       int64[creatures], from which on a creature was culled,
+                    ticks if it wasn't
+    ground          float64[ground points][2]
+    node_radii      float32[nodes]
+    keyframes       float32[chunks][nodes][2]
+    scales          float32[chunks][nodes]
+    offsets         int16[ticks][nodes][2]
+    sticky          uint8[ticks][nodes / 8], bits of the sticky nodes
+    contracted      uint8[ticks][muscles / 8], bits of the contracted muscles
+
+    Each array starts at a multiple of 8 bytes.
+    """
+
+    MAGIC = b"EVOTRACE"
+    VERSION = 1
+
+    FILE_EXTENSION = ".trajectory"
+
+    # magic, version, keyframe interval, generation idx, number of creatures,
+    # nodes, muscles, ticks and ground points, timestep
+    HEADER_FORMAT = "<8sIIqqqqqqd"
+
+    KEYFRAME_INTERVAL = 100
+
+    # Positions beyond this are clipped, e.g. of exploded creatures
+    MAX_COORDINATE = 1e6
+
+    def __init__(self, location):
+        # Opens an existing trajectory, see write() for creating one.
+        self.location = location
+        self._data = np.memmap(location, dtype=np.uint8, mode="r")
+        header_size = struct.calcsize(self.HEADER_FORMAT)
+        magic, version, self.keyframe_interval, self.generation_idx, self.nb_creatures, nb_nodes, \
+            nb_muscles, self.nb_ticks, nb_ground_points, self.timestep = struct.unpack( \
+            self.HEADER_FORMAT, self._data[:header_size].tobytes())
+        if magic != self.MAGIC:
+            raise ValueError("{} is not a trajectory".format(location))
+        if version != self.VERSION:
+            raise ValueError("{} has version {}, supported is {}".format(location, version, self.VERSION))
+        for name, dtype, shape, offset in self._get_layout(self.keyframe_interval, self.nb_creatures, \
+                nb_nodes, nb_muscles, self.nb_ticks, nb_ground_points):
+            size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            # Plain arrays, still backed by the file, are faster to index
+            setattr(self, "_" + name, self._data[offset:offset+size].view(dtype=dtype, type=np.ndarray) \
+                .reshape(shape))
+        self.ground = self._ground
+        self.fitnesses = self._fitnesses
+        self.node_radii = self._node_radii
+
+    @classmethod
+    def _get_layout(cls, keyframe_interval, nb_creatures, nb_nodes, nb_muscles, nb_ticks, nb_ground_points):
+        # Returns a list of tuples (name, dtype, shape, offset) of the arrays
+        # following the header.
+        nb_chunks = (nb_ticks + keyframe_interval - 1) // keyframe_interval
+        arrays = [
+            ("node_offsets", np.int64, (nb_creatures + 1,)),
+            ("muscle_offsets", np.int64, (nb_creatures + 1,)),
+            ("muscle_nodes", np.int64, (nb_muscles, 2)),
+            ("fitnesses", np.float64, (nb_creatures,)),
+            ("end_ticks", np.int64, (nb_creatures,)),
+            ("ground", np.float64, (nb_ground_points, 2)),
+            ("node_radii", np.float32, (nb_nodes,)),
+            ("keyframes", np.float32, (nb_chunks, nb_nodes, 2)),
+            ("scales", np.float32, (nb_chunks, nb_nodes)),
+            ("offsets", np.int16, (nb_ticks, nb_nodes, 2)),
+            ("sticky", np.uint8, (nb_ticks, (nb_nodes + 7) // 8)),
+            ("contracted", np.uint8, (nb_ticks, (nb_muscles + 7) // 8)),
+        ]
+        layout = []
+        offset = struct.calcsize(cls.HEADER_FORMAT)
+        for name, dtype, shape in arrays:
+            layout.append((name, dtype, shape, offset))
+            offset += int(np.prod(shape)) * np.dtype(dtype).itemsize
+            offset += -offset % 8
+        return layout
+
+    @classmethod
+    def write(cls, location, recorder, fitnesses, ground, timestep, generation_idx, keyframe_interval=None):
+        # Writes what the recorder recorded to a new trajectory, replacing the
+        # file if it exists.
+        # fitnesses (float[]): Of each creature of the recorded simulation
+        # ground (ndarray): See Simulation.generate_ground()
+        # timestep (float): Seconds of simulated time per tick
+        if keyframe_interval is None:
+            keyframe_interval = cls.KEYFRAME_INTERVAL
+        positions = np.clip(np.nan_to_num(np.array(recorder.positions, dtype=np.float32)), \
+            -cls.MAX_COORDINATE, cls.MAX_COORDINATE)
+        nb_ticks, nb_nodes = positions.shape[0:2]
+        nb_muscles = len(recorder.muscle_nodes)
+
+        keyframes = positions[::keyframe_interval]
+        offsets = positions - np.repeat(keyframes, keyframe_interval, axis=0)[:nb_ticks]
+        # The largest offset of each chunk and node maps to the largest int16
+        chunk_maxima = np.zeros(keyframes.shape[0:2], dtype=np.float32)
+        np.maximum.at(chunk_maxima, np.arange(nb_ticks) // keyframe_interval, np.abs(offsets).max(axis=2))
+        scales = np.where(chunk_maxima > 0, chunk_maxima / np.iinfo(np.int16).max, 1).astype(np.float32)
+        offsets = np.rint(offsets / np.repeat(scales, keyframe_interval, axis=0)[:nb_ticks, :, None])
+
+        end_ticks = [nb_ticks if end_tick is None else end_tick for end_tick in recorder.end_ticks]
+        arrays = {
+            "node_offsets": np.array(recorder.node_offsets, dtype=np.int64),
+            "muscle_offsets": np.array(recorder.muscle_offsets, dtype=np.int64),
+            "muscle_nodes": np.array(recorder.muscle_nodes, dtype=np.int64).reshape(-1, 2),
+            "fitnesses": np.array(fitnesses, dtype=np.float64),
+            "end_ticks": np.array(end_ticks, dtype=np.int64),
+            "ground": np.array(ground, dtype=np.float64).reshape(-1, 2),
+            "node_radii": np.array(recorder.node_radii, dtype=np.float32),
+            "keyframes": keyframes,
+            "scales": scales,
+            "offsets": offsets,
+            "sticky": np.packbits(np.array(recorder.sticky, dtype=bool).reshape(nb_ticks, nb_nodes), axis=1),
+            "contracted": np.packbits(np.array(recorder.contracted, dtype=bool).reshape(nb_ticks, nb_muscles), \
+                axis=1),
+        }
+        f = open(location, "wb")
+        f.write(struct.pack(cls.HEADER_FORMAT, cls.MAGIC, cls.VERSION, keyframe_interval, generation_idx, \
+            len(fitnesses), nb_nodes, nb_muscles, nb_ticks, len(arrays["ground"]), timestep))
+        for name, dtype, shape, offset in cls._get_layout(keyframe_interval, len(fitnesses), nb_nodes, \
+                nb_muscles, nb_ticks, len(arrays["ground"])):
+            f.write(b"\0" * (offset - f.tell()))
+            f.write(np.ascontiguousarray(arrays[name], dtype=dtype).tobytes())
+        f.close()
+
+    def get_frame(self, tick):
+        # Returns a tuple (positions, sticky, contracted) of the tick, from 0
+        # to nb_ticks - 1:
+        # positions (ndarray): float32[nodes][2] of all creatures' nodes
+        # sticky (ndarray): bool[nodes]
+        # contracted (ndarray): bool[muscles]
+        if not 0 <= tick < self.nb_ticks:
+            raise IndexError("tick {} of {}".format(tick, self.nb_ticks))
+        chunk = tick // self.keyframe_interval
+        positions = self._keyframes[chunk] + self._offsets[tick] * self._scales[chunk][:, None]
+        nb_nodes, nb_muscles = self._node_offsets[-1], self._muscle_offsets[-1]
+        sticky = np.unpackbits(self._sticky[tick], count=nb_nodes).astype(bool)
+        contracted = np.unpackbits(self._contracted[tick], count=nb_muscles).astype(bool)
+        return positions, sticky, contracted
+
+    def is_culled(self, creature_idx, tick):
+        return tick >= self._end_ticks[creature_idx]
+
+    def close(self):
+        # Frames that were read stay valid.
+        for name, dtype, shape, offset in self._get_layout(1, 0, 0, 0, 0, 0):
+            setattr(self, "_" + name, None)
+        self.ground, self.fitnesses, self.node_radii = None, None, None
+        self._data = None
+
+
+class Snapshot(_CreatureFrames):
+    # The state of the creatures of a simulation at a tick, sent by a
+    # SnapshotStream to watch them live.
+
+    def __init__(self, generation_idx, tick, max_ticks, recorder, fitnesses, source=None):
+        # recorder (TrajectoryRecorder): Which recorded the tick last
+        # fitnesses (float[]): Of each creature at the tick
+        # source (int|None): Which of the simulations of a generation the
+        #   snapshot is of, e.g. the position of its batch, see merge()
+        self.generation_idx = generation_idx
+        self.source = source
+        self.tick = tick
+        self.max_ticks = max_ticks
+        self.nb_creatures = len(fitnesses)
+        self._node_offsets = recorder.node_offsets
+        self._muscle_offsets = recorder.muscle_offsets
+        self._muscle_nodes = np.array(recorder.muscle_nodes, dtype=np.int64).reshape(-1, 2)
+        self.node_radii = np.array(recorder.node_radii, dtype=np.float32)
+        self.positions = recorder.positions[-1]
+        self.sticky = recorder.sticky[-1]
+        self.contracted = recorder.contracted[-1]
+        self.fitnesses = np.array(fitnesses, dtype=np.float64)
+        self.culled = [end_tick is not None for end_tick in recorder.end_ticks]
+
+    def get_percent_done(self):
+        return int(self.tick / self.max_ticks * 100)
+
+    @classmethod
+    def merge(cls, snapshots, nb_sources=None):
+        # Returns one snapshot of the creatures of all snapshots, e.g. the
+        # latest one of each batch of a generation, in their order.
+        # nb_sources (int|None): Number of simulations of the generation, the
+        #   ones without a snapshot yet count as not started. None for
+        #   len(snapshots).
+        if nb_sources is None:
+            nb_sources = len(snapshots)
+        merged = cls.__new__(cls)
+        merged.generation_idx = snapshots[0].generation_idx
+        merged.source = None
+        merged.tick = sum(snapshot.tick for snapshot in snapshots)
+        merged.max_ticks = snapshots[0].max_ticks * nb_sources
+        merged.nb_creatures = sum(snapshot.nb_creatures for snapshot in snapshots)
+        node_offsets, muscle_offsets = [0], [0]
+        for snapshot in snapshots:
+            node_offsets.extend(node_offsets[-1] + offset for offset in snapshot._node_offsets[1:])
+            muscle_offsets.extend(muscle_offsets[-1] + offset for offset in snapshot._muscle_offsets[1:])
+        merged._node_offsets, merged._muscle_offsets = node_offsets, muscle_offsets
+        merged._muscle_nodes = np.concatenate([snapshot._muscle_nodes for snapshot in snapshots])
+        merged.node_radii = np.concatenate([snapshot.node_radii for snapshot in snapshots])
+        merged.positions = np.concatenate([snapshot.positions for snapshot in snapshots])
+        merged.sticky = np.concatenate([snapshot.sticky for snapshot in snapshots])
+        merged.contracted = np.concatenate([snapshot.contracted for snapshot in snapshots])
+        merged.fitnesses = np.concatenate([snapshot.fitnesses for snapshot in snapshots])
+        merged.culled = [culled for snapshot in snapshots for culled in snapshot.culled]
+        return merged
+
+
+class SnapshotStream:
+    """
+    Sends Snapshots of a simulation to a queue while it runs, e.g. from a
+    worker process to the main process. Sends at most RATE per second of wall
+    time, regardless of how fast the simulation runs, and drops the ones the
+    queue has no room for, so the simulation never waits for the receiver.
+    """
+
+    RATE = 60
+
+    def __init__(self, simulation, snapshot_queue, rate=None, source=None):
+        # snapshot_queue (Queue): E.g. of a multiprocessing manager, bounded
+        # source (int|None): See Snapshot
+        self.simulation = simulation
+        self.queue = snapshot_queue
+        self.source = source
+        self.interval = 1 / (self.RATE if rate is None else rate)
+        self._recorder = TrajectoryRecorder(simulation, keep_ticks=1)
+        self._next_time = 0
+
+    def update(self, force=False):
+        # Sends a snapshot of the current tick, if one is due. Call after each
+        # timestep.
+        # force (bool): Send one regardless, e.g. of the last tick
+        now = time.perf_counter()
+        if now < self._next_time and not force:
+            return
+        self._next_time = now + self.interval
+        self._recorder.record()
+        self.simulation.evaluate()
+        fitnesses = {id(creature): fitness for fitness, creature in self.simulation.ranked_creatures}
+        snapshot = Snapshot(self.simulation.generation.idx, self.simulation.cur_ticks, \
+            self.simulation.max_ticks, self._recorder, \
+            [fitnesses[id(creature)] for creature in self.simulation.creatures], self.source)
+        try:
+            self.queue.put_nowait(snapshot)
+        except queue.Full:
+            pass
@@ -4,3 +4,13 @@ def stay_in_bounds(v, v_min, v_max):
     if v < v_min: return v_min
     if v > v_max: return v_max
     return v
+
+def set_slots_state(obj, state):
+    # Sets the attributes of an instance with __slots__ from its pickled state,
+    # which is a dict of attributes for instances pickled before the class had
+    # __slots__, or a tuple (dict|None, dict of slots) otherwise.
+    if isinstance(state, tuple):
+        dict_state, slots_state = state
+        state = dict(dict_state or {}, **(slots_state or {}))
+    for name, value in state.items():
+        setattr(obj, name, value)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+# Evaluates a saved generation, and optionally random genomes, with and
+# without culling (see CULL_CHECK_TICKS in simulation.py) and reports whether
+# culling changed any fitness or the ranking, along with the time each took.
+# Culling must only save time, so the exit status is 1 if the rankings differ.
+
+import sys
+import time
+import random
+import argparse
+
+from validateFidelity import *
+
+
+def evaluate_fitnesses(genomes, simulation_class, max_ticks, workers, terrain_seed, cull):
+    # Returns the fitness of each genome, in the order of genomes, why each
+    # was culled (None if not) and the time taken.
+    cull_check_ticks = simulation_class.CULL_CHECK_TICKS
+    if not cull:
+        simulation_class.CULL_CHECK_TICKS = 0
+    try:
+        time_start = time.perf_counter()
+        fg = evaluate_genomes(genomes, simulation_class, max_ticks, workers, terrain_seed=terrain_seed)
+        duration = time.perf_counter() - time_start
+    finally:
+        simulation_class.CULL_CHECK_TICKS = cull_check_ticks
+    fitness_by_genome = {id(genome): fitness for fitness, genome in fg.ranked_genomes}
+    culled = [None] * len(genomes)
+    for result in fg.results:
+        culled[result.genome_id] = result.culled
+    return [fitness_by_genome[id(genome)] for genome in genomes], culled, duration
+
+def get_ranking(fitnesses):
+    # Returns the positions of fitnesses, best first, ties in order.
+    return sorted(range(len(fitnesses)), key=lambda i: fitnesses[i], reverse=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that culling doesn't change the fitness ranking.")
+    parser.add_argument("location", nargs="?", help="A saved generation")
+    parser.add_argument("-random", type=int, default=0, metavar="NUMBER",
+        help="Number of random genomes to evaluate as well")
+    parser.add_argument("-environment", choices=SIMULATION_CLASSES.keys(), default="hopper")
+    parser.add_argument("-ticks", type=int, default=SIMULATION_TICKS,
+        help="Number of ticks to simulate")
+    parser.add_argument("-workers", type=int, default=MAX_WORKERS)
+    parser.add_argument("-terrain", type=int, metavar="SEED", default=1,
+        help="Seed of the terrain, and of the random genomes")
+    parser.add_argument("-stuck", type=int, metavar="TICKS",
+        help="Cull stuck creatures with this CULL_STUCK_WINDOW_TICKS instead of the simulation's")
+    parser.add_argument("-top", type=int, default=SURVIVORS_PER_GENERATION,
+        help="Number of best genomes whose order must match")
+    args = parser.parse_args()
+
+    generation = load(args.location) if args.location is not None else Generation(1, [])
+    random.seed(args.terrain)
+    generation.add_random_genomes(args.random)
+    genomes = generation.genomes
+    simulation_class = SIMULATION_CLASSES[args.environment]
+    if args.stuck is not None:
+        simulation_class.CULL_STUCK_WINDOW_TICKS = args.stuck
+    full_fitnesses, _, full_duration = evaluate_fitnesses( \
+        genomes, simulation_class, args.ticks, args.workers, args.terrain, False)
+    fitnesses, culled, duration = evaluate_fitnesses( \
+        genomes, simulation_class, args.ticks, args.workers, args.terrain, True)
+
+    changed = [i for i in range(len(genomes)) if fitnesses[i] != full_fitnesses[i]]
+    for i in changed:
+        print("Genome {}: fitness {:.1f} instead of {:.1f}{}".format(i, fitnesses[i], full_fitnesses[i], \
+            "" if culled[i] is None else ", culled as " + culled[i]))
+    ranking, full_ranking = get_ranking(fitnesses), get_ranking(full_fitnesses)
+    top_matches = ranking[:args.top] == full_ranking[:args.top]
+    nb_culled = len([reason for reason in culled if reason is not None])
+    print("Culled {} of {} genomes, {} fitnesses changed".format(nb_culled, len(genomes), len(changed)))
+    print("Time {:.1f} s instead of {:.1f} s, speedup {:.2f}".format(duration, full_duration, \
+        full_duration / duration))
+    print("Rank correlation {:.3f}, top {} {}".format(rank_correlation(fitnesses, full_fitnesses), \
+        args.top, "match" if top_matches else "differ"))
+    sys.exit(0 if ranking == full_ranking else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+# Evaluates a saved generation with each fidelity profile (see
+# FIDELITY_PROFILES in simulation.py) and reports how well the fitness ranking
+# of each profile agrees with the one of the reference profile, along with the
+# time each profile took. A cheap profile with a rank correlation close to 1
+# ranks creatures like the reference, so it can be used for evolution instead.
+
+import time
+import argparse
+
+from headless import *
+
+
+def get_ranks(values):
+    # Returns the rank of each value, tied values get the average of their ranks.
+    order = sorted(range(len(values)), key=lambda i: values[i])
+    ranks = [0] * len(values)
+    i = 0
+    while i < len(order):
+        j = i
+        while j + 1 < len(order) and values[order[j+1]] == values[order[i]]:
+            j += 1
+        for k in range(i, j+1):
+            ranks[order[k]] = (i + j) / 2 + 1
+        i = j + 1
+    return ranks
+
+def rank_correlation(values_1, values_2):
+    # Spearman's rank correlation coefficient of two equally long lists.
+    ranks_1, ranks_2 = get_ranks(values_1), get_ranks(values_2)
+    n = len(ranks_1)
+    mean_1, mean_2 = sum(ranks_1) / n, sum(ranks_2) / n
+    cov = sum([(r1 - mean_1) * (r2 - mean_2) for r1, r2 in zip(ranks_1, ranks_2)])
+    var_1 = sum([(r1 - mean_1)**2 for r1 in ranks_1])
+    var_2 = sum([(r2 - mean_2)**2 for r2 in ranks_2])
+    if var_1 == 0 or var_2 == 0:
+        return 0
+    return cov / (var_1 * var_2) ** 0.5
+
+def evaluate_fitnesses(genomes, simulation_class, max_ticks, workers, fidelity, terrain_seed):
+    # Returns the fitness of each genome, in the order of genomes, and the time taken.
+    time_start = time.perf_counter()
+    fg = evaluate_genomes(genomes, simulation_class, max_ticks, workers, \
+        fidelity=fidelity, terrain_seed=terrain_seed)
+    duration = time.perf_counter() - time_start
+    fitness_by_genome = {id(genome): fitness for fitness, genome in fg.ranked_genomes}
+    return [fitness_by_genome[id(genome)] for genome in genomes], duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the fitness rankings of the fidelity profiles.")
+    parser.add_argument("location", help="A saved generation")
+    parser.add_argument("-environment", choices=SIMULATION_CLASSES.keys(), default="hopper")
+    parser.add_argument("-ticks", type=int, default=SIMULATION_TICKS,
+        help="Number of ticks to simulate, at the standard timestep")
+    parser.add_argument("-workers", type=int, default=MAX_WORKERS)
+    parser.add_argument("-reference", choices=FIDELITY_PROFILES.keys(), default="reference")
+    parser.add_argument("-terrain", type=int, metavar="SEED", default=1,
+        help="Seed of the terrain, the same for all profiles")
+    args = parser.parse_args()
+
+    genomes = load(args.location).genomes
+    simulation_class = SIMULATION_CLASSES[args.environment]
+    reference = FIDELITY_PROFILES[args.reference]
+    reference_fitnesses, reference_duration = evaluate_fitnesses( \
+        genomes, simulation_class, args.ticks, args.workers, reference, args.terrain)
+
+    print("{:<12} {:<8} {:<10} {:<10}".format("Profile", "Time s", "Speedup", "Rank corr"))
+    for profile in FIDELITY_PROFILES.values():
+        if profile is reference:
+            fitnesses, duration = reference_fitnesses, reference_duration
+        else:
+            fitnesses, duration = evaluate_fitnesses( \
+                genomes, simulation_class, args.ticks, args.workers, profile, args.terrain)
+        print("{:<12} {:<8.1f} {:<10.2f} {:<10.3f}".format(profile.name, duration, \
+            reference_duration / duration, rank_correlation(fitnesses, reference_fitnesses)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+
+# Evaluates for a coordinator, e.g. "headless.py -listen HOST:PORT", possibly
+# on another machine, see DistributedPool. Starts several worker processes,
+# each with its own connection, and exits when the coordinator is done.
+
+import os
+import argparse
+import multiprocessing
+
+from evolution import *
+
+
+def _drop_evaluation_stores(args):
+    return tuple([None if isinstance(arg, EvaluationStore) else arg for arg in args])
+
+def run_worker(address, authkey, keep_stores, wait):
+    # Does the tasks of the coordinator at address until it's done or lost.
+    worker = DistributedWorker(address, authkey, None if keep_stores else _drop_evaluation_stores)
+    if not worker.connect(wait):
+        print("Worker {}: Can't connect to {}:{}".format(os.getpid(), *address))
+        return
+    nb_tasks = worker.run()
+    print("Worker {}: Done after {} tasks".format(os.getpid(), nb_tasks))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate genomes for a coordinator.")
+    parser.add_argument("address", metavar="HOST:PORT",
+        help="Where the coordinator listens")
+    parser.add_argument("-processes", type=int, default=os.cpu_count(),
+        help="Number of worker processes, one per core if not given")
+    parser.add_argument("-authkey", default=DEFAULT_AUTHKEY.decode(),
+        help="Key of the coordinator, the one it printed if it wasn't given one")
+    parser.add_argument("-wait", type=float, default=60,
+        help="Seconds to wait for the coordinator to listen")
+    parser.add_argument("-nostore", action="store_true",
+        help="Don't write results to the coordinator's evaluation store, for machines that don't share "
+            "its save directory")
+    args = parser.parse_args()
+
+    worker_args = (parse_address(args.address), args.authkey.encode(), not args.nostore, args.wait)
+    processes = [multiprocessing.Process(target=run_worker, args=worker_args) for i in range(args.processes)]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()